@@ -4,6 +4,8 @@
 #        (Sorted first by chromosome (string) and then by nucleotide position (numeric))
 
 import os
+from enum import Enum
+from typing import List
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (Metadata, generateFilePath, generateMetadata, getDataDirectory,
@@ -12,6 +14,18 @@ from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (Metadata, gene
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter
 from benbiohelpers.CountThisInThat.InputDataStructures import EncompassedDataDefaultStrand, EncompassingDataDefaultStrand, EncompassingData
 from benbiohelpers.CountThisInThat.CounterOutputDataHandler import AmbiguityHandling, OutputDataWriter
+from mutperiodpy.helper_scripts.DyadPositionCounting import (DyadPositionCountingTask, countMutationsInNucleosomeMaps,
+                                                             countMutationsInNucleosomeMapsWithNumPy)
+
+
+# The available engines for counting mutations at each dyad position.
+#   thisInThat: Counts each mutation file against each nucleosome map and radius separately using ThisInThatCounter.
+#   multiplexed: Counts each mutation file against every nucleosome map and radius at once, in a single pass.
+#   numpy: Like multiplexed, but counts one chromosome at a time using NumPy arrays.
+class CountingBackend(Enum):
+    thisInThat = "thisInThat"
+    multiplexed = "multiplexed"
+    numpy = "numpy"
 
 
 def getCountDerivatives(outputDataWriter: OutputDataWriter, getHeaders):
@@ -57,7 +71,8 @@ class MutationsInStrandedNucleosomesCounter(ThisInThatCounter):
         return EncompassingData(line, self.acceptableChromosomes)
 
 
-def countNucleosomePositionMutations(mutationFilePaths, nucleosomeMapNames, countSingleNuc, countNucGroup, linkerOffset, useNucStrand = False):
+def countNucleosomePositionMutations(mutationFilePaths, nucleosomeMapNames, countSingleNuc, countNucGroup, linkerOffset, useNucStrand = False,
+                                     countingBackend = CountingBackend.thisInThat):
 
     # Check for the special case where a nucleosome map is being counted against itself to determine the nucleosome repeat length.
     if (len(mutationFilePaths) == 1 and len(nucleosomeMapNames) == 1 and 
@@ -96,9 +111,11 @@ def countNucleosomePositionMutations(mutationFilePaths, nucleosomeMapNames, coun
                                    "\" in the name.",
                                    postPathMessage = "Are you sure you inputted a file from the mutperiod pipeline?")
 
+        countingTasks: List[DyadPositionCountingTask] = list() # Used to collect the counting work for the multiplexed backend.
+
         for nucleosomeMapName in nucleosomeMapNames:
 
-            print("Counting with nucleosome map:",nucleosomeMapName)
+            if countingBackend is CountingBackend.thisInThat: print("Counting with nucleosome map:",nucleosomeMapName)
 
             # Generate the path to the nucleosome-map-specific directory.
             nucleosomeMapDataDirectory = os.path.join(os.path.dirname(mutationFilePath),nucleosomeMapName)
@@ -145,11 +162,15 @@ def countNucleosomePositionMutations(mutationFilePaths, nucleosomeMapNames, coun
                                                                     fileExtension = ".tsv", dataType = DataTypeStr.rawNucCounts)
 
                 # Ready, set, go!
-                print("Counting mutations at each nucleosome position in a 73 bp radius +", str(linkerOffset), "bp linker DNA.")
-                counter = CounterClass(mutationFilePath, metadata.baseNucPosFilePath, nucleosomeMutationCountsFilePath, 
-                                       encompassingFeatureExtraRadius=73 + linkerOffset, acceptableChromosomes=acceptableChromosomes,
-                                       checkForSortedFiles = (True, not nucleosomeMapSortingChecked))
-                counter.count()
+                if countingBackend is not CountingBackend.thisInThat:
+                    countingTasks.append(DyadPositionCountingTask(metadata.baseNucPosFilePath, 73 + linkerOffset,
+                                                                  nucleosomeMutationCountsFilePath))
+                else:
+                    print("Counting mutations at each nucleosome position in a 73 bp radius +", str(linkerOffset), "bp linker DNA.")
+                    counter = CounterClass(mutationFilePath, metadata.baseNucPosFilePath, nucleosomeMutationCountsFilePath, 
+                                           encompassingFeatureExtraRadius=73 + linkerOffset, acceptableChromosomes=acceptableChromosomes,
+                                           checkForSortedFiles = (True, not nucleosomeMapSortingChecked))
+                    counter.count()
 
                 nucleosomeMutationCountsFilePaths.append(nucleosomeMutationCountsFilePath)
 
@@ -162,14 +183,25 @@ def countNucleosomePositionMutations(mutationFilePaths, nucleosomeMapNames, coun
                                                                     fileExtension = ".tsv", dataType = DataTypeStr.rawNucCounts)
 
                 # Ready, set, go!
-                print("Counting mutations at each nucleosome position in a 1000 bp radius.")
-                counter = CounterClass(mutationFilePath, metadata.baseNucPosFilePath, nucleosomeMutationCountsFilePath, 
-                                       encompassingFeatureExtraRadius=1000, acceptableChromosomes=acceptableChromosomes,
-                                       checkForSortedFiles = (True, not nucleosomeMapSortingChecked))
-                counter.count()
+                if countingBackend is not CountingBackend.thisInThat:
+                    countingTasks.append(DyadPositionCountingTask(metadata.baseNucPosFilePath, 1000,
+                                                                  nucleosomeMutationCountsFilePath))
+                else:
+                    print("Counting mutations at each nucleosome position in a 1000 bp radius.")
+                    counter = CounterClass(mutationFilePath, metadata.baseNucPosFilePath, nucleosomeMutationCountsFilePath, 
+                                           encompassingFeatureExtraRadius=1000, acceptableChromosomes=acceptableChromosomes,
+                                           checkForSortedFiles = (True, not nucleosomeMapSortingChecked))
+                    counter.count()
 
                 nucleosomeMutationCountsFilePaths.append(nucleosomeMutationCountsFilePath)
 
+        # Count against every nucleosome map and radius at once if the multiplexed or NumPy backend was selected.
+        if countingBackend is not CountingBackend.thisInThat and len(countingTasks) > 0:
+            print("Counting mutations at each nucleosome position for", len(nucleosomeMapNames), "nucleosome map(s) in a single pass.")
+            if countingBackend is CountingBackend.numpy:
+                countMutationsInNucleosomeMapsWithNumPy(mutationFilePath, countingTasks, acceptableChromosomes, useNucStrand)
+            else: countMutationsInNucleosomeMaps(mutationFilePath, countingTasks, acceptableChromosomes, useNucStrand)
+
         nucleosomeMapSortingChecked = True
 
     return nucleosomeMutationCountsFilePaths
@@ -4,19 +4,21 @@
 import os
 from benbiohelpers.CustomErrors import InvalidPathError
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
-from benbiohelpers.FileSystemHandling.BedToFasta import bedToFasta
-from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
+from mutperiodpy.helper_scripts.PackedGenome import PackedGenome, getPackedGenome
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import Metadata, generateFilePath, DataTypeStr, getContext, getDataDirectory
 
 
-# Expands the range of each mutation position in the original mutation file to encompass one extra base on either side.
-def expandBedPositions(inputBedFilePath,bedExpansionFilePath,contextNum):
-    "Expands the range of each mutation position in the original mutation file to encompass one extra base on either side."
+# Expands the range of each mutation position in the original mutation file to encompass the desired context, and
+# writes each mutation to a new bed file with the expanded context retrieved from the packed genome.
+# The input file is streamed through in a single pass.
+def generateExpandedContext(inputBedFilePath,packedGenome: PackedGenome,expandedContextFilePath,contextNum):
+    "Writes each mutation in the input bed file to a new bed file with an expanded context retrieved from the packed genome."
 
-    with open(bedExpansionFilePath,'w') as bedExpansionFile:
-        with open(inputBedFilePath, 'r') as inputBedFile:
+    print("Writing mutations with expanded context to new bed file...")
+
+    with open(inputBedFilePath, 'r') as inputBedFile:
+        with open(expandedContextFilePath, 'w') as expandedContextFile:
 
-            print("Writing expanded mutation indicies to intermediate bed file...")
             for line in inputBedFile:
 
                 # Get a list of all the arguments for a single mutation in the bed file.
@@ -26,53 +28,22 @@ def expandBedPositions(inputBedFilePath,bedExpansionFilePath,contextNum):
                 middleBaseNum = (float(choppedUpLine[1]) + float(choppedUpLine[2]) - 1) / 2
 
                 # Expand the position of the mutation to create the desired context.
-                choppedUpLine[1] = str(int(middleBaseNum - contextNum/2 + 0.5))
-                choppedUpLine[2] = str(int(middleBaseNum + contextNum/2 - 0.5 + 1))
-
-                # Write the results to the intermediate expansion file as long as it is not at the start of the chromosome.
-                if float(choppedUpLine[1]) > -1: bedExpansionFile.write("\t".join(choppedUpLine)+"\n")
-                else: print("Mutation at chromosome", choppedUpLine[0], "with expanded start pos", choppedUpLine[1],
-                            "extends into invalid positions.  Skipping.")
-
-
-# Uses the expanded reads fasta file to create a new bed file with the expanded mutational context.
-def generateExpandedContext(inputBedFilePath,fastaReadsFilePath,expandedContextFilePath,contextNum):
-    "Uses the expanded reads fasta file to create a new bed file with the expanded mutational context."
-
-    print("Using fasta file to write expanded context to new bed file...")
-
-    # For even context numbers, we'll need to offset the fasta positions back to half-base positions.
-    if contextNum % 2 == 0: halfBaseOffset = 0.5
-    else: halfBaseOffset = 0
-
-    # Open the un-expanded bed file and the expanded fasta reads that will be combined to create the expanded context.
-    with open(inputBedFilePath, 'r') as inputBedFile:
-        with open(fastaReadsFilePath, 'r') as fastaReadsFile:
-            with open(expandedContextFilePath, 'w') as expandedContextFile:
-
-                # Work through the un-expanded bed file one mutation at a time.
-                for fastaEntry in FastaFileIterator(fastaReadsFile):
+                expandedStartPos = int(middleBaseNum - contextNum/2 + 0.5)
+                expandedEndPos = int(middleBaseNum + contextNum/2 - 0.5 + 1)
 
-                    # Find the un-expanded entry corresponding to this entry.
-                    while True:
+                # Skip the mutation if the expanded context extends before the start of the chromosome.
+                if expandedStartPos <= -1:
+                    print("Mutation at chromosome", choppedUpLine[0], "with expanded start pos", expandedStartPos,
+                          "extends into invalid positions.  Skipping.")
+                    continue
 
-                        # Read in the next line
-                        nextLine = inputBedFile.readline()
+                # Retrieve the expanded context.  Mutations whose context extends past the end of their chromosome are skipped.
+                expandedSequence = packedGenome.fetch(choppedUpLine[0], expandedStartPos, expandedEndPos, choppedUpLine[5])
+                if expandedSequence is None: continue
 
-                        # If we reached the end of the file without finding a match, we have a problem...
-                        if len(nextLine) == 0:
-                            raise ValueError("Reached end of single base bed file without finding a match for:",fastaEntry.sequenceLocation)
-
-                        # Split the next line on tab characters and check for a match with the current read in the fasta file.
-                        choppedUpLine = nextLine.strip().split("\t")
-                        if (str(int(fastaEntry.startPos)+int(contextNum/2)-halfBaseOffset) == choppedUpLine[1] and 
-                            fastaEntry.chromosome == choppedUpLine[0] and fastaEntry.strand == choppedUpLine[5]): break
-
-                    # Replace the mutation's previous context with the expanded context.
-                    choppedUpLine[3] = fastaEntry.sequence
-
-                    # Write the result to the new expanded context file.
-                    expandedContextFile.write("\t".join(choppedUpLine)+"\n")
+                # Replace the mutation's previous context with the expanded context and write the result to the new file.
+                choppedUpLine[3] = expandedSequence
+                expandedContextFile.write("\t".join(choppedUpLine)+"\n")
 
 
 def expandContext(inputBedFilePaths, expansionContextNum):
@@ -103,32 +74,13 @@ def expandContext(inputBedFilePaths, expansionContextNum):
             raise InvalidPathError(inputBedFilePath, "The given mutation file at does not have a lower context "
                                    "than the desired output context.", postPathMessage = "There is nothing to expand.")
 
-        # Generate paths to intermediate data files.
-        intermediateFilesDirectory = os.path.join(metadata.directory,"intermediate_files")
-        
-        bedExpansionFilePath = generateFilePath(directory = intermediateFilesDirectory, dataGroup = metadata.dataGroupName,
-                                                dataType = "intermediate_expansion", fileExtension = ".bed")
-
-        fastaReadsFilePath = generateFilePath(directory = intermediateFilesDirectory, dataGroup = metadata.dataGroupName,
-                                              dataType = "expanded_reads", fileExtension = ".fa")
-
         # Generate a path to the final output file.
         expandedContextFilePath = generateFilePath(directory = metadata.directory, dataGroup = metadata.dataGroupName,
                                                   context = thisExpansionContextNum, dataType = DataTypeStr.mutations, fileExtension = ".bed")
 
-        # Create a directory for intermediate files if it does not already exist...
-        if not os.path.exists(intermediateFilesDirectory):
-            os.mkdir(os.path.join(intermediateFilesDirectory))
-
-        # Expand the nucleotide coordinates in the singlenuc context bed file as requested.
-        expandBedPositions(inputBedFilePath,bedExpansionFilePath,thisExpansionContextNum)
-
-        # Convert the expanded coordinates in the bed file to the referenced nucleotides in fasta format.
-        print("Generating fasta file from expanded bed file...")
-        bedToFasta(bedExpansionFilePath,metadata.genomeFilePath,fastaReadsFilePath)
-
-        # Using the newly generated fasta file, create a new bed file with the expanded context.
-        generateExpandedContext(inputBedFilePath,fastaReadsFilePath,expandedContextFilePath,thisExpansionContextNum)
+        # Using the packed genome, create a new bed file with the expanded context.
+        generateExpandedContext(inputBedFilePath,getPackedGenome(metadata.genomeFilePath),
+                                expandedContextFilePath,thisExpansionContextNum)
 
         expandedContextFilePaths.append(expandedContextFilePath)
 
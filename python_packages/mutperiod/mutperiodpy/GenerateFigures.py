@@ -1,12 +1,13 @@
 # This script takes paths to files containing nucleosome counts and exports them to an R script which generates
 # some nice plots for the files and exports them to a given location.
 
-import os, subprocess, sys
+import os, sys
 from typing import List
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError, checkIfPathExists
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 from benbiohelpers.FileSystemHandling.DirectoryHandling import getFilesInDirectory
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory, getExpectedPeriod, rScriptsDirectory, DataTypeStr
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory, getExpectedPeriod, DataTypeStr
+from mutperiodpy.helper_scripts.RWorker import runRScript, getRInputsFilePath
 
 
 def generateFigures(tsvFilePaths: List[str], rdaFilePaths: List[str], exportPath: str,
@@ -55,7 +56,7 @@ def generateFigures(tsvFilePaths: List[str], rdaFilePaths: List[str], exportPath
         exportFileName = os.path.basename(exportPath)
 
     # Create the temporary inputs file to pass to the R script
-    inputsFilePath = os.path.join(os.getenv("HOME"), ".mutperiod","R_inputs.txt")
+    inputsFilePath = getRInputsFilePath()
 
     # Write the inputs
     with open(inputsFilePath, 'w') as inputsFile:
@@ -67,8 +68,8 @@ def generateFigures(tsvFilePaths: List[str], rdaFilePaths: List[str], exportPath
 
     # Call the R script to generate the figures.
     print("Calling R script...")
-    subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"GenerateFigures.R"),inputsFilePath, str(omitOutliers),
-                    str(smoothNucGroup), str(strandAlign)), check = True)
+    try: runRScript("GenerateFigures.R", inputsFilePath, str(omitOutliers), str(smoothNucGroup), str(strandAlign))
+    finally: os.remove(inputsFilePath)
 
 
 def parseArgs(args):
@@ -5,26 +5,25 @@ import os
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError
 from benbiohelpers.DNA_SequenceHandling import reverseCompliment
 from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
+from mutperiodpy.helper_scripts.KmerCounting import countKmers
+from mutperiodpy.helper_scripts.GenomeContextProfile import (PROFILE_CONTEXT_NUMS, getGenomeContextProfileFilePath,
+                                                             getGenomeContextProfileFilePathFromFrequencyFile,
+                                                             generateGenomeContextProfile, readGenomeContextProfile)
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (Metadata, DataTypeStr, generateFilePath, getContext,
-                                                                  getDataDirectory, getAcceptableChromosomes)
+                                                                  getDataDirectory, getAcceptableChromosomes, generationLock)
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 
 
-# This function generates a file containing the frequencies of each sequence in a given context for a given genome
-# on the given strand, including N-containing values (but only for "acceptable chromosomes").
-def generateGenomeContextFrequencyFile(genomeFilePath, genomeContextFrequencyFilePath, contextNum, contextText, acceptableChromosomes):
+# This function counts the occurrences of each sequence in a given context for a given genome on the plus strand,
+# including N-containing values (but only for "acceptable chromosomes").  Returns the counts as a dictionary.
+def countGenomeContexts(genomeFilePath, contextNum, acceptableChromosomes):
 
-    contextCounts=dict() # A dictionary of all the relevant tri/singlenuc contexts and their counts.
+    contextCounts = dict() # A dictionary of all the relevant contexts and their counts.
 
     # Get ready to read from the genome file.
     with open(genomeFilePath, 'r') as genomeFile:
 
-        # Used to pull out the context of desired length.
-        extensionLength = contextNum/2 - 0.5
-        if contextNum % 2 == 0: halfBaseOffset = 0.5
-        else: halfBaseOffset = 0
-
-        # Read the genome file line by line, and count context frequencies as we go.
+        # Read the genome file one chromosome at a time, and count context frequencies as we go.
         for fastaEntry in FastaFileIterator(genomeFile, False):
 
             # Check and make sure that the sequence is one we actually want to count.
@@ -32,19 +31,18 @@ def generateGenomeContextFrequencyFile(genomeFilePath, genomeContextFrequencyFil
 
                 print ("Counting context sequences in ",fastaEntry.sequenceName,"...",sep='')
 
-                # Count all available context sequences.
-                for i in range(0,len(fastaEntry.sequence)):
-
-                    if i + halfBaseOffset >= extensionLength and i + halfBaseOffset < len(fastaEntry.sequence) - extensionLength: 
-                        context = fastaEntry.sequence[int(i+halfBaseOffset-extensionLength):int(i+halfBaseOffset+extensionLength+1)]
-                    
-                        # Add the context to the dictionary if it's not there, and then increment its count.
-                        contextCounts.setdefault(context,0)
-                        contextCounts[context] += 1
+                # Every full-length context in the chromosome is counted, so this is just a k-mer count.
+                countKmers(fastaEntry.sequence, contextNum, contextCounts)
 
             else:
                 print ("Skipping",fastaEntry.sequenceName)
 
+    return contextCounts
+
+
+# This function writes the given genome context counts to a genome context frequency file.
+def writeGenomeContextFrequencyFile(contextCounts, genomeContextFrequencyFilePath, contextText):
+
     totalContextCounts = sum(contextCounts.values())
 
     # Open the file to write the counts to.
@@ -62,9 +60,47 @@ def generateGenomeContextFrequencyFile(genomeFilePath, genomeContextFrequencyFil
             genomeContextFrequencyFile.write('\n')
 
 
+# This function generates a file containing the frequencies of each sequence in a given context for a given genome
+# on the given strand, including N-containing values (but only for "acceptable chromosomes").
+# Counts are taken from the genome context profile when the context is one it stores (generating the profile if necessary).
+def generateGenomeContextFrequencyFile(genomeFilePath, genomeContextFrequencyFilePath, contextNum, contextText, acceptableChromosomes):
+
+    if contextNum in PROFILE_CONTEXT_NUMS:
+        genomeContextProfileFilePath = getGenomeContextProfileFilePath(genomeFilePath)
+        with generationLock(genomeContextProfileFilePath):
+            if not os.path.exists(genomeContextProfileFilePath):
+                print("Genome context profile not found at path:",genomeContextProfileFilePath)
+                print("Generating genome context profile...")
+                generateGenomeContextProfile(genomeFilePath, acceptableChromosomes, genomeContextProfileFilePath)
+        contextCounts = readGenomeContextProfile(genomeContextProfileFilePath, contextNum)
+    else:
+        contextCounts = countGenomeContexts(genomeFilePath, contextNum, acceptableChromosomes)
+
+    writeGenomeContextFrequencyFile(contextCounts, genomeContextFrequencyFilePath, contextText)
+
+
+# This function reads the plus strand genome context counts from a given genome context frequency file.
+def readGenomeContextFrequencyFile(genomeContextFrequencyFilePath):
+
+    contextCounts = dict()
+
+    with open(genomeContextFrequencyFilePath, 'r') as genomeContextFrequencyFile:
+
+        for lineNum,line in enumerate(genomeContextFrequencyFile):
+
+            # The first two lines are headers, so ignore them.
+            if lineNum < 2: continue
+
+            choppedUpLine = line.strip().split('\t')
+            contextCounts[choppedUpLine[0]] = int(choppedUpLine[1])
+
+    return contextCounts
+
+
 # This function gets the set of genome context counts from a given file path.
 # By default, the counts across both strands are given, but this can be changed to return
 # one strand or the other.
+# If a genome context profile exists alongside the frequency file, the counts are read from it instead.
 def getGenomeContextCounts(genomeContextFrequencyFilePath, countPlusStrand = True, countMinusStrand = True):
 
     # Make sure one strand is actually being counted.
@@ -79,25 +115,26 @@ def getGenomeContextCounts(genomeContextFrequencyFilePath, countPlusStrand = Tru
 
     contextCounts = dict() # A dictionary to store the context counts.
 
-    # Access the file with context counts.
-    with open(genomeContextFrequencyFilePath, 'r') as genomeContextFrequencyFile:
+    # Get the plus strand counts, preferring the genome context profile and falling back to the frequency file.
+    genomeContextProfileFilePath = getGenomeContextProfileFilePathFromFrequencyFile(genomeContextFrequencyFilePath)
+    contextNum = getContext(genomeContextFrequencyFilePath, asInt = True)
+    if (genomeContextProfileFilePath is not None and contextNum in PROFILE_CONTEXT_NUMS
+        and os.path.exists(genomeContextProfileFilePath)):
+        plusStrandContextCounts = readGenomeContextProfile(genomeContextProfileFilePath, contextNum)
+    else:
+        plusStrandContextCounts = readGenomeContextFrequencyFile(genomeContextFrequencyFilePath)
 
-        for lineNum,line in enumerate(genomeContextFrequencyFile):
+    for context, counts in plusStrandContextCounts.items():
 
-            # The first two lines are headers, so ignore them.
-            if lineNum < 2: continue
+        # Get the reverse compliment of the context.
+        reverseContext = reverseCompliment(context)
 
-            # Get the context sequence, its reverse compliment, and its counts for this line.
-            context = line.strip().split('\t')[0]
-            reverseContext = reverseCompliment(context)
-            counts = int(line.strip().split('\t')[1])
-            
-            # Add counts to the dictionary based on the parameters set.
-            if countPlusStrand:
-                addFrequency(context,counts)
+        # Add counts to the dictionary based on the parameters set.
+        if countPlusStrand:
+            addFrequency(context,counts)
 
-            if countMinusStrand:
-                addFrequency(reverseContext,counts)
+        if countMinusStrand:
+            addFrequency(reverseContext,counts)
 
     return contextCounts
 
@@ -260,11 +297,13 @@ def generateMutationBackground(mutationFilePaths, backgroundContextNum):
                                                       fileExtension = ".tsv")
 
         # If the genome context frequency file doesn't exist, create it.
-        if not os.path.exists(genomeContextFrequencyFilePath):
-            print("Genome", contextText, "context frequency file not found at path:",genomeContextFrequencyFilePath)
-            print("Generating genome " + contextText + " context frequency file...")
-            generateGenomeContextFrequencyFile(metadata.genomeFilePath, genomeContextFrequencyFilePath, thisBackgroundContextNum, 
-                                               contextText, acceptableChromosomes)
+        # (The lock ensures that only one process generates it if several are running at once.)
+        with generationLock(genomeContextFrequencyFilePath):
+            if not os.path.exists(genomeContextFrequencyFilePath):
+                print("Genome", contextText, "context frequency file not found at path:",genomeContextFrequencyFilePath)
+                print("Generating genome " + contextText + " context frequency file...")
+                generateGenomeContextFrequencyFile(metadata.genomeFilePath, genomeContextFrequencyFilePath, thisBackgroundContextNum, 
+                                                   contextText, acceptableChromosomes)
 
         # Create a directory for intermediate files if it does not already exist...
         if not os.path.exists(intermediateFilesDirectory):
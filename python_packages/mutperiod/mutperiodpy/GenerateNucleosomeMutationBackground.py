@@ -2,69 +2,15 @@
 # generates a background file with the expected mutations at each dyad position from -73 to 73 (inclusive).
 
 import os
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import numpy as np
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
-from benbiohelpers.DNA_SequenceHandling import reverseCompliment
-from benbiohelpers.FileSystemHandling.BedToFasta import bedToFasta
-from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (getContext, getIsolatedParentDir, Metadata, checkDirs,
-                                                                  generateFilePath, DataTypeStr, getDataDirectory)
-
-
-# This function takes a bed file of strongly positioned nucleosomes and expands their coordinates to encompass
-# the given radius plus 2 bases. (in order to get up to hexanucleotide sequences.)
-# If a linker offset is requested, the expansion will be even greater to accomodate.
-# The expanded bed file is then used to generate a fasta file of nucleosome sequences.
-# Returns the file path to the fasta file.
-def generateNucleosomeFasta(baseNucPosFilePath, genomeFilePath, dyadRadius, linkerOffset, useNucStrand = False):
-
-    # Ensure that an intermediate files directory exists for the current nucleosome map.
-    intermediateFilesDir = os.path.join(os.path.dirname(baseNucPosFilePath), "intermediate_files")
-    checkDirs(intermediateFilesDir)
-
-    # Generate a path to the fasta file of nucleosome sequences (Potentially including linker DNA).
-    if dyadRadius == 73:
-        nucPosFastaFilePath = generateFilePath(directory = intermediateFilesDir,
-                                               dataGroup = os.path.basename(baseNucPosFilePath).rsplit('.',1)[0],
-                                               linkerOffset = linkerOffset, fileExtension = ".fa") 
-    elif dyadRadius == 1000:
-        nucPosFastaFilePath = generateFilePath(directory = intermediateFilesDir,
-                                               dataGroup = os.path.basename(baseNucPosFilePath).rsplit('.',1)[0],
-                                               usesNucGroup = True, fileExtension = ".fa") 
-    else: raise ValueError("Invalid dyad radius: " + str(dyadRadius) + ".  Expected 73 or 1000.")
-
-    # Make sure the file doesn't already exist.  If it does, we're done!
-    if os.path.exists(nucPosFastaFilePath):
-        print("Found relevant nucleosome fasta file:",os.path.basename(nucPosFastaFilePath))
-        return nucPosFastaFilePath
-    else: print("Nucleosome fasta file not found at: ",nucPosFastaFilePath,"\nGenerating...", sep = '')
-
-    # Generate the (temporary) expanded file path.
-    expandedNucPosBedFilePath = generateFilePath(directory = intermediateFilesDir,
-                                                 dataGroup = os.path.basename(baseNucPosFilePath).rsplit('.',1)[0],
-                                                 dataType = "expanded", fileExtension = ".bed")
-
-    # Expand the bed coordinates.
-    print("Expanding nucleosome coordinates...")
-    with open(baseNucPosFilePath,'r') as baseNucPosFile:
-        with open(expandedNucPosBedFilePath, 'w') as expandedNucPosBedFile:
-
-            # Write the expanded positions to the new file, one line at a time.
-            for line in baseNucPosFile:
-                choppedUpLine = line.strip().split('\t')
-                choppedUpLine[1] = str(int(choppedUpLine[1]) - dyadRadius - linkerOffset - 2)
-                choppedUpLine[2] = str(int(choppedUpLine[2]) + dyadRadius + linkerOffset + 2)
-
-                # Write the results to the expansion file as long as it is not before the start of the chromosome.
-                if int(choppedUpLine[1]) > -1: expandedNucPosBedFile.write('\t'.join(choppedUpLine) + '\n')
-                else: print("Nucleosome at chromosome", choppedUpLine[0], "with expanded start pos", choppedUpLine[1],
-                            "extends into invalid positions.  Skipping.")
-                                            
-    # Convert the expanded bed file to fasta format.
-    print("Converting expanded coordinates to fasta file...")
-    bedToFasta(expandedNucPosBedFilePath,genomeFilePath,nucPosFastaFilePath, includeStrand=useNucStrand)
-
-    return nucPosFastaFilePath
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (getContext, getIsolatedParentDir, Metadata,
+                                                                  generateFilePath, DataTypeStr, getDataDirectory, generationLock)
+from mutperiodpy.helper_scripts.PackedGenome import getPackedGenome, COMPLEMENT_TABLE
+from mutperiodpy.helper_scripts.KmerCounting import decodeKmers
 
 
 # Returns a dictionary of background mutation rates for the relevant contexts in the associated genome.
@@ -82,14 +28,23 @@ def getGenomeBackgroundMutationRates(genomeMutationBackgroundFilePath):
     return genomeBackgroundMutationRates
 
 
-# This function generates a file of context counts in the genome for each dyad position.
-def generateDyadPosContextCounts(nucPosFastaFilePath, dyadPosContextCountsFilePath, 
-                                 contextNum, dyadRadius, linkerOffset):
+# The number of bases pulled from the genome at once when counting contexts at each dyad position.
+DYAD_POS_BATCH_BASE_NUM = 2**22
+
+# The bases that are counted with the dense context count matrix.  Contexts containing anything else (e.g. N or
+# soft-masked lowercase bases) are tallied separately.
+DENSE_CONTEXT_ALPHABET = "ACGT"
 
-    # Dictionary of context counts for every dyad position. (Contains a dictionary of either counts for each dyad position)
-    plusStrandNucleosomeDyadPosContextCounts = dict()
 
-    observedContexts = dict() # Hash table of observed contexts for lookup.
+# This function generates a file of context counts in the genome for each dyad position.
+# The sequence around each nucleosome (the given radius plus linker offset plus 2 bases, to get up to hexanucleotide
+# contexts) is pulled directly from the packed genome in batches, and contexts are tallied in a dense
+# (dyad positions x 4^contextNum) matrix.  Nucleosomes extending past either end of their chromosome are skipped.
+# Contexts are written in the order they are first encountered, reading nucleosomes in file order.
+def generateDyadPosContextCounts(baseNucPosFilePath, genomeFilePath, dyadPosContextCountsFilePath,
+                                 contextNum, dyadRadius, linkerOffset, useNucStrand = False):
+
+    packedGenome = getPackedGenome(genomeFilePath)
 
     # This is a bit weird.  If the context number is even, we need to account for half positions,
     # but if the context number is odd, we need to keep in mind that there's one extra valid position in the dyad range.
@@ -100,92 +55,252 @@ def generateDyadPosContextCounts(nucPosFastaFilePath, dyadPosContextCountsFilePa
         halfBaseOffset = 0
         extraDyadPos = 1
 
-    # Initialize the dictionary for context counts on the plus strand.
-    for dyadPos in range(-dyadRadius-linkerOffset,dyadRadius+linkerOffset+extraDyadPos): 
-        plusStrandNucleosomeDyadPosContextCounts[dyadPos + halfBaseOffset] = dict()
+    trackedPositionNum = dyadRadius*2 + linkerOffset*2 + extraDyadPos # How many dyad positions we care about.
+    windowLength = trackedPositionNum + contextNum - 1 # How many bases are needed to get a context at every dyad position.
+    expansionLength = dyadRadius + linkerOffset + 2 # How far each nucleosome's sequence extends past its coordinates.
+
+    # Where the first tracked context starts relative to the extra context bases at the start of a nucleosome's sequence.
+    contextStartOffset = int(halfBaseOffset - (contextNum/2 - 0.5))
+
+    # Lookup tables for encoding bases (anything outside the dense alphabet is encoded as len(DENSE_CONTEXT_ALPHABET))
+    # and for complementing minus strand sequences.
+    encodingTable = np.full(256, len(DENSE_CONTEXT_ALPHABET), dtype = np.uint8)
+    for i, base in enumerate(DENSE_CONTEXT_ALPHABET): encodingTable[ord(base)] = i
+    complementTable = np.frombuffer(COMPLEMENT_TABLE, dtype = np.uint8)
+    possibleContextNum = len(DENSE_CONTEXT_ALPHABET)**contextNum
+
+    # Dense context counts for every dyad position, and the (nucleosome, dyad position) order key at which each
+    # context was first observed.  Contexts outside the dense alphabet get their own dictionaries.
+    denseContextCounts = np.zeros(trackedPositionNum*possibleContextNum, dtype = np.int64)
+    unobservedKey = np.iinfo(np.int64).max
+    denseFirstObservedKeys = np.full(possibleContextNum, unobservedKey, dtype = np.int64)
+    otherContextCounts: List[Dict[str, int]] = [dict() for _ in range(trackedPositionNum)]
+    otherFirstObservedKeys: Dict[str, int] = dict()
+
+    positionOffsets = np.arange(trackedPositionNum, dtype = np.int64)*possibleContextNum
+    windowBaseOffsets = np.arange(windowLength, dtype = np.int64)
+
+    windowStarts = list() # Offsets in the packed genome where each nucleosome's window begins.
+    windowIsMinusStrand = list()
+    countedNucleosomeNum = 0
+
+    # Counts the contexts in the currently batched windows.
+    def countBatchedContexts():
+
+        nonlocal countedNucleosomeNum
+        if len(windowStarts) == 0: return
+
+        # Gather the windows, reverse complementing those on the minus strand.
+        windows = packedGenome.sequences[np.array(windowStarts, dtype = np.int64)[:,None] + windowBaseOffsets]
+        minusStrandRows = np.array(windowIsMinusStrand, dtype = bool)
+        if minusStrandRows.any(): windows[minusStrandRows] = complementTable[windows[minusStrandRows,::-1]]
+
+        # Compute the code of the context at every dyad position, keeping track of contexts with unexpected bases.
+        encodedWindows = encodingTable[windows]
+        unexpectedBases = encodedWindows == len(DENSE_CONTEXT_ALPHABET)
+        contextCodes = np.zeros((len(windows), trackedPositionNum), dtype = np.int64)
+        hasUnexpectedBase = np.zeros((len(windows), trackedPositionNum), dtype = bool)
+        for i in range(contextNum):
+            contextCodes *= len(DENSE_CONTEXT_ALPHABET)
+            contextCodes += encodedWindows[:,i:i+trackedPositionNum] % len(DENSE_CONTEXT_ALPHABET)
+            hasUnexpectedBase |= unexpectedBases[:,i:i+trackedPositionNum]
+
+        # Tally the dense contexts (only touching the counts they index into) and record when any new ones were first observed.
+        isDense = ~hasUnexpectedBase
+        denseContextCodes = contextCodes[isDense]
+        np.add.at(denseContextCounts, (contextCodes + positionOffsets)[isDense], 1)
+        batchContextCodes, firstIndices = np.unique(denseContextCodes, return_index = True)
+        batchKeys = countedNucleosomeNum*trackedPositionNum + np.flatnonzero(isDense)[firstIndices]
+        denseFirstObservedKeys[batchContextCodes] = np.minimum(denseFirstObservedKeys[batchContextCodes], batchKeys)
+
+        # Tally the contexts with unexpected bases by their distinct (context, dyad position) pairs.  Each context's bytes
+        # are packed into one integer, which is combined with the position (leaving room for hexanucleotide contexts
+        # and thousands of dyad positions in 63 bits).
+        rows, positions = np.nonzero(hasUnexpectedBase)
+        otherContextCodes = np.zeros(len(rows), dtype = np.int64)
+        for i in range(contextNum):
+            otherContextCodes <<= 8
+            otherContextCodes |= windows[rows, positions + i]
+        pairCodes, firstIndices, pairCounts = np.unique(otherContextCodes*trackedPositionNum + positions,
+                                                        return_index = True, return_counts = True)
+
+        for pairCode, firstIndex, count in zip(pairCodes.tolist(), firstIndices.tolist(), pairCounts.tolist()):
+            contextCode, position = divmod(pairCode, trackedPositionNum)
+            context = contextCode.to_bytes(contextNum, "big").decode()
+            otherContextCounts[position][context] = otherContextCounts[position].get(context, 0) + count
+            key = (countedNucleosomeNum + int(rows[firstIndex]))*trackedPositionNum + position
+            if key < otherFirstObservedKeys.get(context, unobservedKey): otherFirstObservedKeys[context] = key
+
+        countedNucleosomeNum += len(windowStarts)
+        windowStarts.clear()
+        windowIsMinusStrand.clear()
+
+    # Find each nucleosome's window of sequence in the packed genome, counting the contexts one batch at a time.
+    with open(baseNucPosFilePath,'r') as baseNucPosFile:
+
+        for line in baseNucPosFile:
+
+            choppedUpLine = line.strip().split('\t')
+            expandedStartPos = int(choppedUpLine[1]) - expansionLength
+            expandedEndPos = int(choppedUpLine[2]) + expansionLength
+
+            # Skip the nucleosome if it extends before the start of the chromosome.
+            if expandedStartPos < 0:
+                print("Nucleosome at chromosome", choppedUpLine[0], "with expanded start pos", expandedStartPos,
+                      "extends into invalid positions.  Skipping.")
+                continue
+
+            # Skip nucleosomes on unknown chromosomes or that extend past the end of the chromosome.
+            chromosomeLength = packedGenome.getChromosomeLength(choppedUpLine[0])
+            if chromosomeLength is None or expandedEndPos > chromosomeLength: continue
+
+            # Determine where the window of bases needed for the tracked contexts falls within the expanded sequence.
+            expandedLength = expandedEndPos - expandedStartPos
+            windowOffset = int((expandedLength - trackedPositionNum)/2) + contextStartOffset
+            if windowOffset < 0 or windowOffset + windowLength > expandedLength:
+                raise ValueError("Sequence length does not match expected context length.")
+
+            # Minus strand windows are taken from the other end of the expanded sequence (and reverse complemented later).
+            chromosomeOffset = packedGenome.chromosomeIndex[choppedUpLine[0]][0]
+            if useNucStrand and choppedUpLine[5] == '-':
+                windowStarts.append(chromosomeOffset + expandedEndPos - windowOffset - windowLength)
+                windowIsMinusStrand.append(True)
+            else:
+                windowStarts.append(chromosomeOffset + expandedStartPos + windowOffset)
+                windowIsMinusStrand.append(False)
+
+            if len(windowStarts)*windowLength >= DYAD_POS_BATCH_BASE_NUM: countBatchedContexts()
+
+        countBatchedContexts()
+
+    # Order the observed contexts by when they were first observed.
+    observedDenseCodes = np.flatnonzero(denseFirstObservedKeys != unobservedKey)
+    contextOrder = list(zip(denseFirstObservedKeys[observedDenseCodes].tolist(),
+                            decodeKmers(observedDenseCodes, contextNum, DENSE_CONTEXT_ALPHABET), observedDenseCodes.tolist()))
+    contextOrder += [(key, context, None) for context, key in otherFirstObservedKeys.items()]
+    contextOrder.sort()
+    denseContextCounts = denseContextCounts.reshape(trackedPositionNum, possibleContextNum)
+
+    # Write the context counts for every dyad position on the plus strand in the output file
+    with open(dyadPosContextCountsFilePath, 'w') as dyadPosContextCountsFile:
 
-    # Read through the file, adding contexts for every dyad position to the running total in the dictionary
-    with open(nucPosFastaFilePath, 'r') as nucPosFastaFile:
+        # Write the header for the file
+        dyadPosContextCountsFile.write("Dyad_Pos\t" + '\t'.join(context for _, context, _ in contextOrder) + '\n')
 
-        trackedPositionNum = dyadRadius*2 + linkerOffset*2 + extraDyadPos # How many dyad positions we care about.
+        # Write the context counts at each dyad position.
+        for i in range(trackedPositionNum):
 
-        for fastaEntry in FastaFileIterator(nucPosFastaFile):
+            dyadPos = i - dyadRadius - linkerOffset + halfBaseOffset
+            positionDenseCounts = denseContextCounts[i].tolist()
+            positionOtherCounts = otherContextCounts[i]
 
-            # Reset dyad position counter
-            dyadPos = -dyadRadius - linkerOffset + halfBaseOffset
-            
-            # Determine how much extra information is present in this line at either end for generating contexts.
-            extraContextNum = int((len(fastaEntry.sequence) - trackedPositionNum)/2)
+            dyadPosContextCountsFile.write(str(dyadPos) + ''.join(
+                '\t' + str(positionOtherCounts.get(context, 0) if code is None else positionDenseCounts[code])
+                for _, context, code in contextOrder) + '\n')
 
-            # Used to pull out the context of desired length.
-            extensionLength = contextNum/2 - 0.5
+    # Cache the counts in binary form too, so they never need to be parsed from the tsv file.
+    dyadPositions = [i - dyadRadius - linkerOffset + halfBaseOffset for i in range(trackedPositionNum)]
+    dyadPosContextCountMatrix = np.zeros((trackedPositionNum, len(contextOrder)), dtype = np.int64)
+    for column, (_, context, code) in enumerate(contextOrder):
+        if code is None: dyadPosContextCountMatrix[:,column] = [otherContextCounts[i].get(context, 0) for i in range(trackedPositionNum)]
+        else: dyadPosContextCountMatrix[:,column] = denseContextCounts[:,code]
+    writeDyadPosContextCountsCache(dyadPosContextCountsFilePath, dyadPositions,
+                                   [context for _, context, _ in contextOrder], dyadPosContextCountMatrix)
 
-            # Count all available contexts.
-            for i in range(0,trackedPositionNum):
+# Returns the paths to the binary count matrix (.npy) and its header sidecar file, which are cached alongside
+# the given dyad position context counts tsv file.
+def getDyadPosContextCountsCacheFilePaths(dyadPosContextCountsFilePath) -> Tuple[str, str]:
+    basePath = dyadPosContextCountsFilePath.rsplit(".tsv",1)[0]
+    return basePath + ".npy", basePath + "_header.tsv"
 
-                context = fastaEntry.sequence[int(i + halfBaseOffset + extraContextNum - extensionLength):
-                                              int(i + halfBaseOffset + extraContextNum + extensionLength+1)]
-                if len(context) != contextNum: raise ValueError("Sequence length does not match expected context length.")
-                if context not in observedContexts: observedContexts[context] = None              
-                plusStrandNucleosomeDyadPosContextCounts[dyadPos][context] = plusStrandNucleosomeDyadPosContextCounts[dyadPos].setdefault(context, 0) + 1
 
-                # Increment the dyadPos counter
-                dyadPos += 1
+# Writes the given dyad position context counts to the binary cache associated with the given tsv file.
+# The header sidecar contains one line of dyad positions (the matrix rows) and one line of contexts (the matrix columns).
+def writeDyadPosContextCountsCache(dyadPosContextCountsFilePath, dyadPositions, contexts, dyadPosContextCountMatrix: np.ndarray):
 
-    # Write the context counts for every dyad position on the plus strand in the output file
-    with open(dyadPosContextCountsFilePath, 'w') as dyadPosContextCountsFile:
+    countMatrixFilePath, headerFilePath = getDyadPosContextCountsCacheFilePaths(dyadPosContextCountsFilePath)
 
-        # Write the header for the file
-        dyadPosContextCountsFile.write("Dyad_Pos\t" + '\t'.join(observedContexts.keys()) + '\n')
+    # Write to temporary files first so that a partially written cache is never mistaken for a complete one.
+    with open(countMatrixFilePath + ".tmp", "wb") as countMatrixFile:
+        np.save(countMatrixFile, np.ascontiguousarray(dyadPosContextCountMatrix, dtype = np.int64))
+    with open(headerFilePath + ".tmp", 'w') as headerFile:
+        headerFile.write('\t'.join(["Dyad_Pos"] + [str(dyadPos) for dyadPos in dyadPositions]) + '\n')
+        headerFile.write('\t'.join(["Contexts"] + list(contexts)) + '\n')
 
-        # Write the context counts at each dyad position.
-        for dyadPos in plusStrandNucleosomeDyadPosContextCounts.keys():
-            
-            dyadPosContextCountsFile.write(str(dyadPos))
+    os.replace(countMatrixFilePath + ".tmp", countMatrixFilePath)
+    os.replace(headerFilePath + ".tmp", headerFilePath)
 
-            for context in observedContexts.keys():
-                if context in plusStrandNucleosomeDyadPosContextCounts[dyadPos]:
-                    dyadPosContextCountsFile.write('\t' + str(plusStrandNucleosomeDyadPosContextCounts[dyadPos][context]))
-                else: dyadPosContextCountsFile.write("\t0")
 
-            dyadPosContextCountsFile.write('\n')
-        
-    
-# This function retrieves the context counts for each dyad position in a genome from a given file.
-# The data is returned as a dictionary of dictionaries, with the first key being dyad position and the second
-# being a context.
-def getDyadPosContextCounts(dyadPosContextCountsFilePath):
+# Reads the context counts for each dyad position from the given tsv file (the slow way).
+# The data is returned in the same form as getDyadPosContextCountMatrix.
+def parseDyadPosContextCountsFile(dyadPosContextCountsFilePath) -> Tuple[np.ndarray, List[str], np.ndarray]:
+
     with open(dyadPosContextCountsFilePath, 'r') as dyadPosContextCountsFile:
-        
-        contexts = list()
-        headersHaveBeenRead = False
-        dyadPosContextCounts= dict()
 
+        contexts = dyadPosContextCountsFile.readline().strip().split('\t')[1:]
+
+        dyadPositions = list()
+        countRows = list()
         for line in dyadPosContextCountsFile:
+            choppedUpLine = line.strip().split('\t')
+            dyadPositions.append(float(choppedUpLine[0]))
+            countRows.append(choppedUpLine[1:])
+
+    return (np.array(dyadPositions, dtype = float), contexts,
+            np.array(countRows, dtype = np.int64).reshape(len(dyadPositions), len(contexts)))
 
-            if not headersHaveBeenRead:
-                headersHaveBeenRead = True
-                contexts = line.strip().split('\t')[1:]
-    
-            else: 
-                choppedUpLine = line.strip().split('\t')
-                dyadPos = float(choppedUpLine[0])
-                dyadPosContextCounts[dyadPos] = dict()
-                for i,context in enumerate(contexts):
-                    dyadPosContextCounts[dyadPos][context] = int(choppedUpLine[i+1])
 
-    return dyadPosContextCounts
+# Loads the context counts for each dyad position from the binary cache associated with the given tsv file, creating the
+# cache from the tsv file first if it is missing or out of date.  The count matrix is memory-mapped (read only).
+# Loaded counts are kept in memory, keyed on the tsv file's path and modification time.
+@lru_cache(maxsize = 16)
+def loadDyadPosContextCountMatrix(dyadPosContextCountsFilePath, modificationTime) -> Tuple[np.ndarray, List[str], np.ndarray]:
+
+    countMatrixFilePath, headerFilePath = getDyadPosContextCountsCacheFilePaths(dyadPosContextCountsFilePath)
+
+    # (The lock ensures that only one process generates the cache if several are running at once.)
+    with generationLock(countMatrixFilePath):
+        if not (os.path.exists(countMatrixFilePath) and os.path.exists(headerFilePath)
+                and os.path.getmtime(headerFilePath) >= modificationTime):
+            print("Caching dyad position context counts from",os.path.basename(dyadPosContextCountsFilePath),"in binary form...")
+            writeDyadPosContextCountsCache(dyadPosContextCountsFilePath, *parseDyadPosContextCountsFile(dyadPosContextCountsFilePath))
+
+    with open(headerFilePath, 'r') as headerFile:
+        dyadPositions = np.array(headerFile.readline().rstrip('\n').split('\t')[1:], dtype = float)
+        contexts = headerFile.readline().rstrip('\n').split('\t')[1:]
+
+    # (Empty arrays can't be memory-mapped.)
+    if len(dyadPositions) > 0 and len(contexts) > 0: dyadPosContextCountMatrix = np.load(countMatrixFilePath, mmap_mode = 'r')
+    else: dyadPosContextCountMatrix = np.load(countMatrixFilePath)
+
+    return dyadPositions, contexts, dyadPosContextCountMatrix
+
+
+# This function retrieves the context counts for each dyad position in a genome from a given file.
+# The data is returned as a tuple of an array of dyad positions, a list of contexts, and a matrix of counts
+# with one row per dyad position and one column per context.  (Don't modify the returned objects; they are cached.)
+def getDyadPosContextCountMatrix(dyadPosContextCountsFilePath) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    return loadDyadPosContextCountMatrix(dyadPosContextCountsFilePath, os.path.getmtime(dyadPosContextCountsFilePath))
+
+
+# Returns the reverse complement of every given context (all of which must be the same length),
+# translating them all at once instead of one string at a time.
+def reverseComplementContexts(contexts) -> List[str]:
+
+    if len(contexts) == 0: return list()
+
+    contextArray = np.frombuffer(''.join(contexts).encode(), dtype = np.uint8).reshape(len(contexts), -1)
+    complementTable = np.frombuffer(COMPLEMENT_TABLE, dtype = np.uint8)
+    return [reverseContext.tobytes().decode() for reverseContext in complementTable[contextArray[:,::-1]]]
 
 
 # This function generates a nucleosome mutation background file from a general mutation background file
 # and a file of strongly positioned nucleosome coordinates.
+# The expected mutations for each strand are the product of the dyad position x context count matrix and a vector of
+# context mutation rates, with the minus strand's rates permuted to the reverse complement of each context.
 def generateNucleosomeMutationBackgroundFile(dyadPosContextCountsFilePath, mutationBackgroundFilePath, 
                                              nucleosomeMutationBackgroundFilePath, dyadRadius, linkerOffset):
 
-    # Dictionaries of expected mutations for every dyad position included in the analysis, one for each strand.
-    plusStrandNucleosomeMutationBackground = dict() 
-    minusStrandNucleosomeMutationBackground = dict()
-
     # This is a bit weird.  If the context number is even, we need to account for half positions,
     # but if the context number is odd, we need to keep in mind that there's one extra valid position in the dyad range.
     if getContext(mutationBackgroundFilePath, asInt = True) % 2 == 0:
@@ -195,28 +310,24 @@ def generateNucleosomeMutationBackgroundFile(dyadPosContextCountsFilePath, mutat
         halfBaseOffset = 0
         extraDyadPos = 1
 
-    # Initialize the dictionary
-    for i in range(-dyadRadius - linkerOffset, dyadRadius + linkerOffset + extraDyadPos): 
-        dyadPos = i + halfBaseOffset
-        plusStrandNucleosomeMutationBackground[dyadPos] = 0
-        minusStrandNucleosomeMutationBackground[dyadPos] = 0
-
-    # Get the corresponding mutation background and context counts dictionaries.
+    # Get the corresponding mutation background and context counts.
     backgroundMutationRate = getGenomeBackgroundMutationRates(mutationBackgroundFilePath)
-    dyadPosContextCounts = getDyadPosContextCounts(dyadPosContextCountsFilePath)
+    dyadPositions, contexts, dyadPosContextCounts = getDyadPosContextCountMatrix(dyadPosContextCountsFilePath)
 
-    # Calculate the expected mutation rates for each dyad position based on the context counts at that position and that context's mutation rate
-    for dyadPos in dyadPosContextCounts:
+    # Line up the mutation rates with the count matrix's contexts, and with their reverse complements for the minus strand.
+    backgroundRates = np.array(list(backgroundMutationRate.values()), dtype = float)
+    backgroundContextIndices = {context:i for i, context in enumerate(backgroundMutationRate)}
+    plusStrandRateIndex = np.array([backgroundContextIndices[context] for context in contexts], dtype = np.int64)
+    minusStrandRateIndex = np.array([backgroundContextIndices[reverseContext]
+                                     for reverseContext in reverseComplementContexts(contexts)], dtype = np.int64)
 
-        for context in dyadPosContextCounts[dyadPos]:
-
-            reverseContext = reverseCompliment(context)
-            
-            # Add the context's mutation rate to the running total in the background dictionaries.
-            plusStrandNucleosomeMutationBackground[dyadPos] += backgroundMutationRate[context] * dyadPosContextCounts[dyadPos][context]
-            minusStrandNucleosomeMutationBackground[dyadPos] += backgroundMutationRate[reverseContext] * dyadPosContextCounts[dyadPos][context]
+    # Calculate the expected mutation rates for each dyad position based on the context counts at that position and that context's mutation rate
+    plusStrandNucleosomeMutationBackground = dict(zip(dyadPositions.tolist(),
+                                                      (dyadPosContextCounts @ backgroundRates[plusStrandRateIndex]).tolist()))
+    minusStrandNucleosomeMutationBackground = dict(zip(dyadPositions.tolist(),
+                                                       (dyadPosContextCounts @ backgroundRates[minusStrandRateIndex]).tolist()))
 
-    # Write the results of the dictionary to the nucleosome mutation background file.
+    # Write the results to the nucleosome mutation background file.
     with open(nucleosomeMutationBackgroundFilePath, 'w') as nucleosomeMutationBackgroundFile:
 
         # Write the headers for the data.
@@ -230,10 +341,12 @@ def generateNucleosomeMutationBackgroundFile(dyadPosContextCountsFilePath, mutat
         for i in range(-dyadRadius - linkerOffset, dyadRadius + linkerOffset + extraDyadPos):
 
             dyadPos = i + halfBaseOffset
-            dataRow = '\t'.join((str(dyadPos),str(plusStrandNucleosomeMutationBackground[dyadPos]),
-            str(minusStrandNucleosomeMutationBackground[dyadPos]),
-            str(plusStrandNucleosomeMutationBackground[dyadPos] + minusStrandNucleosomeMutationBackground[dyadPos]),
-            str(plusStrandNucleosomeMutationBackground[dyadPos] + minusStrandNucleosomeMutationBackground[-dyadPos])))
+            plusStrandBackground = plusStrandNucleosomeMutationBackground.get(dyadPos, 0)
+            minusStrandBackground = minusStrandNucleosomeMutationBackground.get(dyadPos, 0)
+            dataRow = '\t'.join((str(dyadPos),str(plusStrandBackground),
+            str(minusStrandBackground),
+            str(plusStrandBackground + minusStrandBackground),
+            str(plusStrandBackground + minusStrandNucleosomeMutationBackground.get(-dyadPos, 0))))
 
             nucleosomeMutationBackgroundFile.write(dataRow + '\n')
 
@@ -286,13 +399,13 @@ def generateNucleosomeMutationBackground(mutationBackgroundFilePaths, nucleosome
                                                                 dataType = "dyad_pos_counts", fileExtension = ".tsv")
 
                 # Make sure we have a tsv file with the appropriate context counts at each dyad position.
-                if not os.path.exists(dyadPosContextCountsFilePath): 
-                    print("Dyad position " + contextText + " counts file not found at",dyadPosContextCountsFilePath)
-                    print("Generating genome wide dyad position " + contextText + " counts file...")
-                    # Make sure we have a fasta file for strongly positioned nucleosome coordinates
-                    nucPosFastaFilePath = generateNucleosomeFasta(metadata.baseNucPosFilePath, metadata.genomeFilePath, dyadRadius, currentLinkerOffset, useNucStrand)
-                    generateDyadPosContextCounts(nucPosFastaFilePath, dyadPosContextCountsFilePath,
-                                                contextNum, dyadRadius, currentLinkerOffset)
+                # (The lock ensures that only one process generates it if several are running at once.)
+                with generationLock(dyadPosContextCountsFilePath):
+                    if not os.path.exists(dyadPosContextCountsFilePath): 
+                        print("Dyad position " + contextText + " counts file not found at",dyadPosContextCountsFilePath)
+                        print("Generating genome wide dyad position " + contextText + " counts file...")
+                        generateDyadPosContextCounts(metadata.baseNucPosFilePath, metadata.genomeFilePath, dyadPosContextCountsFilePath,
+                                                     contextNum, dyadRadius, currentLinkerOffset, useNucStrand)
 
                 # A path to the final output file.
                 nucleosomeMutationBackgroundFilePath = generateFilePath(directory = metadata.directory, dataGroup = metadata.dataGroupName,
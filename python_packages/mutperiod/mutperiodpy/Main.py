@@ -1,8 +1,11 @@
 # This script will be called from the command line to execute other scripts.
 from argparse import ArgumentParser
 from mutperiodpy import RunNucleosomeMutationAnalysis, RunAnalysisSuite, GenerateFigures, StratifyNucleosomeMap
-from mutperiodpy.input_parsing import ParseCustomBed, ParseICGC
+from mutperiodpy.input_parsing import ParseCustomBed, ParseICGC, ParseVCF
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import DataTypeStr, parseArgsForNewDataDirectory
+from mutperiodpy.CountNucleosomePositionMutations import CountingBackend
+from mutperiodpy.NormalizeMutationCounts import NormalizationEngine
+from mutperiodpy.RunNucleosomeMutationAnalysis import PeriodicityEngine, ResamplingMethod
 from mutperiodpy.helper_scripts.CustomErrors import *
 from benbiohelpers.CustomErrors import *
 from _tkinter import TclError
@@ -47,6 +50,12 @@ class MutperiodArgParser():
                                                                          "to be parsed for use in the main pipeline.  If no additional "
                                                                          "arguments are given, the UI opens instead.")
         self._formatParseBedParser(parseBedParser)                                                                  
+
+
+        parseVCFParser = subparsers.add_parser("parseVCF", description = "Pass in one or more VCF files "
+                                                                         "to be parsed for use in the main pipeline.  If no additional "
+                                                                         "arguments are given, the UI opens instead.")
+        self._formatParseVCFParser(parseVCFParser)
         
 
         # For RunAnalysisSuite...
@@ -83,7 +92,7 @@ class MutperiodArgParser():
         self._formatCreateDataDirectoryParser(createDataDirectoryParser)
 
 
-        self.subparserDict = {"parseICGC" : parseICGCParser, "parseBed" : parseBedParser, "mainPipeline" : mainPipelineParser,
+        self.subparserDict = {"parseICGC" : parseICGCParser, "parseBed" : parseBedParser, "parseVCF" : parseVCFParser, "mainPipeline" : mainPipelineParser,
                               "periodicityAnalysis" : periodicityAnalysisParser, "generateFigures" : generateFiguresParser,
                               "nucStratifier" : nucStratifierParser, "createDataDirectory" : createDataDirectoryParser}
 
@@ -103,6 +112,9 @@ class MutperiodArgParser():
                                     help = "Stratify results by microsatellite stability")
         parseICGCParser.add_argument("-s", "--stratify-by-mut-sigs", action = "store_true", 
                                     help = "Stratify results by mutation signature")
+        parseICGCParser.add_argument("-j", "--jobs", type = int, default = 1,
+                                    help = "The number of processes used to parse each ICGC file, which is split into shards "
+                                        "of whole donor blocks.  (Defaults to 1)")
 
 
     def _formatParseBedParser(self, parseBedParser: ArgumentParser):
@@ -130,6 +142,36 @@ class MutperiodArgParser():
                                     help = "Coerce a bed3 (or bed6+ with strand info) input to custom bed. "
                                            "This option is mutually exclusive with all the stratification options, "
                                            "the only-sbs option, and the include-indels option.")
+        parseBedParser.add_argument("--streaming", action = "store_true",
+                                    help = "Check, convert, and stratify each input file in a single pass, without copying, "
+                                           "sorting (unless it is unsorted), or overwriting it.  Auto-acquired bases and strand "
+                                           "designations are not written back to the input file.")
+        parseBedParser.add_argument("--trusted-input", action = "store_true",
+                                    help = "Only check a sample of the input's lines for formatting errors (all lines are "
+                                           "checked by default).  Only use this for input that is known to be well-formed.")
+
+
+    def _formatParseVCFParser(self, parseVCFParser: ArgumentParser):
+
+        parseVCFParser.set_defaults(func = ParseVCF.parseArgs)
+        parseVCFParser.add_argument("vcfFilePaths", nargs = '*',
+                                    help = "One or more paths to VCF files to parse (plain, gzipped, or bgzipped).  If given a "
+                                        "directory, the directory will be recursively searched for files ending in "
+                                        "\".vcf\" or \".vcf.gz\".").complete = fileCompletion
+
+        parseVCFParser.add_argument("-g", "--genome-file", help = "The associated genome fasta file").complete = fileCompletion
+
+        parseVCFParser.add_argument("-c", "--stratify-by-cohorts", action = "store_true",
+                                    help = "Stratify results by individual samples")
+        parseVCFParser.add_argument("-m", "--stratify-by-microsatellite", action = "store_true",
+                                    help = "Stratify results by microsatellite stability")
+        parseVCFParser.add_argument("-s", "--stratify-by-mut-sigs", action = "store_true",
+                                    help = "Stratify results by mutation signature")
+        parseVCFParser.add_argument("-i", "--include-indels", action = "store_true",
+                                    help = "Include insertion and deletion entries in the output file")
+        parseVCFParser.add_argument("-j", "--jobs", type = int, default = 1,
+                                    help = "The number of processes used to convert each VCF file.  Tabix-indexed files are "
+                                        "split by chromosome, and other files by blocks of lines.  (Defaults to 1)")
 
 
     def _formatMainPipelineParser(self, mainPipelineParser: ArgumentParser):
@@ -173,6 +215,22 @@ class MutperiodArgParser():
                                         help = "Generate output files where mutations are counted within a 1000 base pair radius "
                                             "of each dyad center to cover a group of several nucleosomes.")
 
+        mainPipelineParser.add_argument("-j", "--jobs", type = int, default = 1,
+                                        help = "The number of mutation files to run through the pipeline in parallel.  "
+                                            "(Defaults to 1)")
+        mainPipelineParser.add_argument("--counting-backend", choices = [backend.value for backend in CountingBackend],
+                                        default = CountingBackend.thisInThat.value,
+                                        help = "The engine used to count mutations at each dyad position.  \"thisInThat\" counts "
+                                            "each nucleosome map and radius separately, while \"multiplexed\" counts every "
+                                            "nucleosome map and radius in a single pass over each mutation file.  \"numpy\" "
+                                            "does the same, but on NumPy arrays, one chromosome at a time.  "
+                                            "(Defaults to thisInThat)")
+        mainPipelineParser.add_argument("--normalization-engine", choices = [engine.value for engine in NormalizationEngine],
+                                        default = NormalizationEngine.python.value,
+                                        help = "The engine used to normalize counts.  \"python\" normalizes in-process, while "
+                                            "\"R\" calls the original R script for each file (and requires R and mutperiodR).  "
+                                            "Both produce the same normalized counts files.  (Defaults to python)")
+
 
     def _formatPeriodicityAnalysisParser(self, periodicityAnalysisParser: ArgumentParser):
 
@@ -196,6 +254,13 @@ class MutperiodArgParser():
                                             help = "Align the strands in the counts data so that they both run 5' to 3'.  "
                                                     "By default, the strand data is interpreted in the context of the double helix, "
                                                     "with the two strands running antiparallel to one another.")
+        periodicityAnalysisParser.add_argument("--periodicity-engine", choices = [engine.value for engine in PeriodicityEngine],
+                                            default = PeriodicityEngine.python.value,
+                                            help = "The engine used to run the periodicity analysis.  \"python\" computes the "
+                                                    "periodograms for all counts files at once in-process, while \"R\" calls the "
+                                                    "original R script (and requires R and mutperiodR).  Both produce the same "
+                                                    "periodicity results, but only the R engine can output .rda files, so it is "
+                                                    "always used for them.  (Defaults to python)")
 
         groupComparison = periodicityAnalysisParser.add_argument_group("Periodicity Comparison")
         groupComparison.add_argument("--group-1", nargs = '*',
@@ -206,6 +271,20 @@ class MutperiodArgParser():
         groupComparison.add_argument("--group-2", nargs = '*',
                                         help = "The counterpart to --group-1").complete = fileCompletion
 
+        significanceTesting = periodicityAnalysisParser.add_argument_group("SNR Significance Testing")
+        significanceTesting.add_argument("--significance-test", choices = [method.value for method in ResamplingMethod],
+                                        help = "Test the significance of each SNR against the SNRs of null counts profiles "
+                                            "made by shuffling (\"permutation\") or resampling with replacement (\"bootstrap\") "
+                                            "each file's counts across dyad positions, adding an empirical p-value column to the "
+                                            "results.  Requires the python engine and a .tsv output file.")
+        significanceTesting.add_argument("--resample-num", type = int, default = 1000,
+                                        help = "The number of null counts profiles to generate for each file.  (Defaults to 1000)")
+        significanceTesting.add_argument("--seed", type = int, default = 0,
+                                        help = "The seed for generating null counts profiles.  The same seed always gives "
+                                            "the same p-values, regardless of the number of jobs.  (Defaults to 0)")
+        significanceTesting.add_argument("-j", "--jobs", type = int, default = 1,
+                                        help = "The number of parallel jobs used to test significance.  (Defaults to 1)")
+
 
     def _formatGenerateFiguresParser(self, generateFiguresParser: ArgumentParser):
 
@@ -1,11 +1,104 @@
-# This script takes raw nucleosome mutation count files, and passes them an R script which normalizes the data.
+# This script takes raw nucleosome mutation count files and normalizes them by their background counts, either in Python
+# or by passing them to an R script.
 
-import os, subprocess, datetime
+import os, datetime, math
+from enum import Enum
 from typing import List, Dict
+import numpy as np
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (getLinkerOffset, getContext, getDataDirectory, Metadata, 
-                                                                  generateFilePath, DataTypeStr, rScriptsDirectory, checkForNucGroup)
+                                                                  generateFilePath, DataTypeStr, checkForNucGroup)
+from mutperiodpy.helper_scripts.RWorker import runRScript
+from mutperiodpy.helper_scripts.RDataTableCompatibility import readDataTable, writeDataTable
+
+
+# The available engines for normalizing counts.
+#   python: Normalizes in this process with NumPy.
+#   R: Calls the NormalizeNucleosomeMutationCounts.R script (through Rscript) for each pair of files.
+# Both produce the same normalized counts files.
+class NormalizationEngine(Enum):
+    python = "python"
+    R = "R"
+
+
+# The headers for the background counts columns, in order.  (Custom backgrounds use raw counts headers instead.)
+BACKGROUND_COUNTS_HEADERS = ("Dyad_Position", "Expected_Mutations_Plus_Strand", "Expected_Mutations_Minus_Strand",
+                             "Expected_Mutations_Both_Strands", "Expected_Mutations_Aligned_Strands")
+RAW_COUNTS_HEADERS = ("Dyad_Position", "Plus_Strand_Counts", "Minus_Strand_Counts", "Both_Strands_Counts", "Aligned_Strands_Counts")
+
+# The normalized counts headers, and the raw and background counts headers they are derived from.
+NORMALIZED_COUNTS_SOURCE_HEADERS = {
+    "Normalized_Minus_Strand": ("Minus_Strand_Counts", "Expected_Mutations_Minus_Strand"),
+    "Normalized_Plus_Strand": ("Plus_Strand_Counts", "Expected_Mutations_Plus_Strand"),
+    "Normalized_Both_Strands": ("Both_Strands_Counts", "Expected_Mutations_Both_Strands"),
+    "Normalized_Aligned_Strands": ("Aligned_Strands_Counts", "Expected_Mutations_Aligned_Strands")
+}
+
+
+# Returns whether or not the given table uses half-base dyad positions (judged by its first position, like the R script).
+def usesHalfBasePositions(counts: Dict[str, np.ndarray]):
+    return int(counts["Dyad_Position"][0]) != counts["Dyad_Position"][0]
+
+
+# Lowers the resolution of half-base position counts by averaging each pair of adjacent rows.
+def averageAdjacentPositions(counts: Dict[str, np.ndarray]):
+    return {header: (column[:-1] + column[1:]) / 2 for header, column in counts.items()}
+
+
+# Given a path to a file of raw mutation counts with a corresponding file of background counts, normalizes the raw counts
+# and writes them to the given file path.  This mirrors the mutperiodR normalizeNucleosomeMutationCounts function
+# (including its handling of half-base positions and alternative scaling factors) and produces identical files.
+def normalizeNucleosomeMutationCounts(rawCountsFilePath, backgroundCountsFilePath, normalizedCountsFilePath,
+                                      alternativeScalingFactor = None):
+
+    rawCounts = readDataTable(rawCountsFilePath)
+    backgroundCounts = readDataTable(backgroundCountsFilePath)
+
+    # If the background file is "custom input" it will have the same column names as a raw counts file.
+    if list(backgroundCounts)[1] == "Plus_Strand_Counts":
+        backgroundCounts = dict(zip(BACKGROUND_COUNTS_HEADERS, backgroundCounts.values()))
+
+    # Check to see if one of the tables has half-base positions while the other does not.
+    # If this turns out to be the case, lower the resolution of the half-base positions by
+    # splitting them up into the two adjacent integer positions.  Also warn the user.
+    if usesHalfBasePositions(backgroundCounts) and not usesHalfBasePositions(rawCounts):
+        print("Warning: Background counts use half-base positions but raw counts do not.  "
+              "Splitting background counts into adjacent integer positions and omitting a base on each end.")
+        rawCounts = {header: column[1:-1] for header, column in rawCounts.items()}
+        backgroundCounts = averageAdjacentPositions(backgroundCounts)
+
+    elif not usesHalfBasePositions(backgroundCounts) and usesHalfBasePositions(rawCounts):
+        print("Warning: Raw counts use half-base positions but background counts do not.  "
+              "Splitting raw counts into adjacent integer positions and omitting a base on each end.")
+        backgroundCounts = {header: column[1:-1] for header, column in backgroundCounts.items()}
+        rawCounts = averageAdjacentPositions(rawCounts)
+
+    # Make sure that the raw and background counts both use the same number of dyad positions.
+    if len(rawCounts["Dyad_Position"]) != len(backgroundCounts["Dyad_Position"]):
+        raise UserInputError("Unequal dyad positions in raw vs. background counts data.")
+
+    # Compute a basic scaling factor from the ratio of total
+    # background:raw nucleosome mutation counts.  (Centers final normalized counts on 1)
+    # (Like R, an empty raw counts table gives an infinite or undefined scaling factor rather than an error.)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        scalingFactor = (np.float64(math.fsum(backgroundCounts["Expected_Mutations_Both_Strands"].tolist())) /
+                         np.float64(math.fsum(rawCounts["Both_Strands_Counts"].tolist())))
+
+    # Normalize by dividing raw by expected, except where expected is 0.
+    normalizedCounts = {"Dyad_Position": backgroundCounts["Dyad_Position"]}
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        for normalizedHeader, (rawHeader, backgroundHeader) in NORMALIZED_COUNTS_SOURCE_HEADERS.items():
+            normalizedCounts[normalizedHeader] = np.where(backgroundCounts[backgroundHeader] == 0, 0.0,
+                                                          rawCounts[rawHeader] / backgroundCounts[backgroundHeader] * scalingFactor)
+
+    # If an alternative scaling factor was given, compute additional normalized values with this factor
+    if alternativeScalingFactor is not None:
+        for normalizedHeader in NORMALIZED_COUNTS_SOURCE_HEADERS:
+            normalizedCounts["Alternative_" + normalizedHeader] = (normalizedCounts[normalizedHeader] /
+                                                                   scalingFactor * alternativeScalingFactor)
+
+    writeDataTable(normalizedCountsFilePath, normalizedCounts)
 
 
 # Pairs each background file path with its respective raw counts file path.
@@ -80,7 +173,8 @@ def getParentDataFeatureCounts(filePath):
 
 
 def normalizeCounts(backgroundCountsFilePaths: List[str], customRawCountsFilePaths: List[str] = list(), 
-                    customBackgroundCountsDir = None, includeAlternativeScaling = False, forceAlternativeScalingToOne = False):
+                    customBackgroundCountsDir = None, includeAlternativeScaling = False, forceAlternativeScalingToOne = False,
+                    normalizationEngine = NormalizationEngine.python):
 
     normalizedCountsFilePaths = list()
 
@@ -109,24 +203,32 @@ def normalizeCounts(backgroundCountsFilePaths: List[str], customRawCountsFilePat
                                                         usesNucGroup = checkForNucGroup(backgroundCountsFilePath),
                                                         dataType = DataTypeStr.normNucCounts, fileExtension = ".tsv")
 
-            # Prepare the arguments to the subprocess call.
-            args = ["Rscript",os.path.join(rScriptsDirectory,"NormalizeNucleosomeMutationCounts.R"),
-                    rawCountsFilePath,backgroundCountsFilePath,normalizedCountsFilePath]
-
-            # If alternative scaling is requested, determine the appropriate scaling factor and add it to the arguments
+            # If alternative scaling is requested, determine the appropriate scaling factor.
+            alternativeScalingFactor = None
             if includeAlternativeScaling:
 
                 # If we are normalizing by sequence context, just revert the automatic scaling.
-                if customBackgroundCountsDir is None or forceAlternativeScalingToOne: args.append("1")
+                if customBackgroundCountsDir is None or forceAlternativeScalingToOne: alternativeScalingFactor = 1
 
                 # If we are normalizing by a custom context, scale based on the relative sizes of the parent background and raw data sets.
                 else:
-                    args.append(str(getParentDataFeatureCounts(backgroundCountsFilePath) /
-                                    getParentDataFeatureCounts(rawCountsFilePath)))                    
+                    alternativeScalingFactor = (getParentDataFeatureCounts(backgroundCountsFilePath) /
+                                                getParentDataFeatureCounts(rawCountsFilePath))
+
+            if normalizationEngine is NormalizationEngine.python:
+                print("Generating normalized counts...")
+                normalizeNucleosomeMutationCounts(rawCountsFilePath, backgroundCountsFilePath, normalizedCountsFilePath,
+                                                  alternativeScalingFactor)
+
+            else:
+
+                # Prepare the arguments to the R script.
+                args = [rawCountsFilePath,backgroundCountsFilePath,normalizedCountsFilePath]
+                if alternativeScalingFactor is not None: args.append(str(alternativeScalingFactor))
 
-            # Pass the file paths to the R script to generate the normalized counts file.
-            print("Calling R script to generate normalized counts...")
-            subprocess.run(args, check = True)
+                # Pass the file paths to the R script to generate the normalized counts file.
+                print("Calling R script to generate normalized counts...")
+                runRScript("NormalizeNucleosomeMutationCounts.R", *args)
 
             normalizedCountsFilePaths.append(normalizedCountsFilePath)
 
@@ -3,6 +3,7 @@
 
 from typing import List
 import os, sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError, checkIfPathExists
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (DataTypeStr, getDataDirectory, 
@@ -10,9 +11,9 @@ from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (DataTypeStr, g
 from benbiohelpers.FileSystemHandling.DirectoryHandling import getFilesInDirectory
 from mutperiodpy.ExpandContext import expandContext
 from mutperiodpy.GenerateMutationBackground import generateMutationBackground
-from mutperiodpy.GenerateNucleosomeMutationBackground import generateNucleosomeMutationBackground
-from mutperiodpy.CountNucleosomePositionMutations import countNucleosomePositionMutations
-from mutperiodpy.NormalizeMutationCounts import normalizeCounts
+from mutperiodpy.GenerateNucleosomeMutationBackground import generateNucleosomeMutationBackground, loadDyadPosContextCountMatrix
+from mutperiodpy.CountNucleosomePositionMutations import countNucleosomePositionMutations, CountingBackend
+from mutperiodpy.NormalizeMutationCounts import normalizeCounts, NormalizationEngine
 
 # Used to generate the relevant background counts files for normalization before the rest of the analysis.
 def generateCustomBackground(customBackgroundDir, nucleosomeMapNames, useSingleNucRadius,
@@ -30,8 +31,46 @@ def generateCustomBackground(customBackgroundDir, nucleosomeMapNames, useSingleN
     print ("Finished generating background!\n")
 
 
+# Runs a single mutation file through the rest of the analysis pipeline (context expansion, counting, and normalization).
+def runAnalysisSuiteOnFile(mutationFilePath, nucleosomeMapNames, normalizationMethod, normalizationMethodNum, customBackgroundDir,
+                           useSingleNucRadius, linkerOffset, useNucGroupRadius, includeAlternativeScaling, useNucStrand,
+                           countingBackend = CountingBackend.thisInThat, normalizationEngine = NormalizationEngine.python):
+
+    # If necessary, expand the file's context so that it is sufficient for the requested background.
+    if normalizationMethodNum is not None and getContext(mutationFilePath, True) < normalizationMethodNum:
+        print("\nExpanding file context...\n")
+        mutationFilePath = expandContext((mutationFilePath,),normalizationMethodNum)[0]
+
+    print("\nCounting mutations at each dyad position...")
+    nucleosomeMutationCountsFilePaths = countNucleosomePositionMutations((mutationFilePath,), nucleosomeMapNames,
+                                                                         useSingleNucRadius, useNucGroupRadius, linkerOffset, useNucStrand,
+                                                                         countingBackend)
+
+    if normalizationMethodNum is not None:
+
+        print("\nGenerating genome-wide mutation background...")
+        mutationBackgroundFilePaths = generateMutationBackground((mutationFilePath,),normalizationMethodNum)
+
+        print("\nGenerating nucleosome mutation background...")
+        nucleosomeMutationBackgroundFilePaths = generateNucleosomeMutationBackground(mutationBackgroundFilePaths, nucleosomeMapNames,
+                                                                                     useSingleNucRadius, useNucGroupRadius, linkerOffset, useNucStrand)
+
+        print("\nNormalizing counts with nucleosome background data...")
+        normalizeCounts(nucleosomeMutationBackgroundFilePaths, normalizationEngine = normalizationEngine)
+
+    elif normalizationMethod == "Custom Background":
+        print("\nNormalizing counts using custom background data...")
+        normalizeCounts(list(), nucleosomeMutationCountsFilePaths, customBackgroundDir, includeAlternativeScaling,
+                        normalizationEngine = normalizationEngine)
+
+    return mutationFilePath
+
+
+# Runs the given mutation files through the analysis pipeline.
+# If more than one job is requested, independent mutation files are run in parallel on a pool of processes.
 def runAnalysisSuite(mutationFilePaths: List[str], nucleosomeMapNames: List[str], normalizationMethod, customBackgroundDir, 
-                     useSingleNucRadius, includeLinker, useNucGroupRadius, includeAlternativeScaling = False, useNucStrand = False):
+                     useSingleNucRadius, includeLinker, useNucGroupRadius, includeAlternativeScaling = False, useNucStrand = False,
+                     jobs = 1, countingBackend = CountingBackend.thisInThat, normalizationEngine = NormalizationEngine.python):
 
     # Make sure at least one radius was selected.
     if not useNucGroupRadius and not useSingleNucRadius:
@@ -41,6 +80,8 @@ def runAnalysisSuite(mutationFilePaths: List[str], nucleosomeMapNames: List[str]
     if len(mutationFilePaths) == 0: raise UserInputError("No valid input files given.")
     if len(nucleosomeMapNames) == 0: raise UserInputError("No valid nucleosome map files given")
 
+    if jobs < 1: raise UserInputError("The number of jobs must be at least 1.")
+
     # Convert background context to int
     if normalizationMethod == "Singlenuc/Dinuc":
         normalizationMethodNum = 1
@@ -56,12 +97,8 @@ def runAnalysisSuite(mutationFilePaths: List[str], nucleosomeMapNames: List[str]
     if includeLinker: linkerOffset = 30
     else: linkerOffset = 0
 
-    ### Ensure that every mutation file has a context sufficient for the requested background.
-
-    # create a new list of mutation file paths, replacing any with contexts that are too low.
+    ### Ensure that every mutation file has a context that can be expanded for the requested background.
     if normalizationMethodNum is not None:
-        print("\nExpanding file context where necessary...\n")
-        updatedMutationFilePaths = list()
         for mutationFilePath in mutationFilePaths:
             mutationFileContext = getContext(mutationFilePath, True)
 
@@ -72,32 +109,29 @@ def runAnalysisSuite(mutationFilePaths: List[str], nucleosomeMapNames: List[str]
             if mutationFileContext == 0: raise UserInputError("Mixed context files cannot be normalized by sequence context.")
             assert mutationFileContext != -1, "Wait, what?  How did you even get this context for this input file? " + os.path.basename
 
-            if mutationFileContext < normalizationMethodNum:
-                updatedMutationFilePaths += expandContext((mutationFilePath,),normalizationMethodNum)
-            else: updatedMutationFilePaths.append(mutationFilePath)
-    else: updatedMutationFilePaths = mutationFilePaths
-
-    ### Run the rest of the analysis.
-
-    print("\nCounting mutations at each dyad position...")
-    nucleosomeMutationCountsFilePaths = countNucleosomePositionMutations(updatedMutationFilePaths, nucleosomeMapNames,
-                                                                         useSingleNucRadius, useNucGroupRadius, linkerOffset, useNucStrand)
-
-    if normalizationMethodNum is not None:
-
-        print("\nGenerating genome-wide mutation background...")
-        mutationBackgroundFilePaths = generateMutationBackground(updatedMutationFilePaths,normalizationMethodNum)
-
-        print("\nGenerating nucleosome mutation background...")
-        nucleosomeMutationBackgroundFilePaths = generateNucleosomeMutationBackground(mutationBackgroundFilePaths, nucleosomeMapNames,
-                                                                                     useSingleNucRadius, useNucGroupRadius, linkerOffset, useNucStrand)
-
-        print("\nNormalizing counts with nucleosome background data...")
-        normalizeCounts(nucleosomeMutationBackgroundFilePaths)
-
-    elif normalizationMethod == "Custom Background":
-        print("\nNormalizing counts using custom background data...")
-        normalizeCounts(list(), nucleosomeMutationCountsFilePaths, customBackgroundDir, includeAlternativeScaling)
+    ### Run each file through the rest of the analysis.
+    pipelineArguments = (nucleosomeMapNames, normalizationMethod, normalizationMethodNum, customBackgroundDir,
+                         useSingleNucRadius, linkerOffset, useNucGroupRadius, includeAlternativeScaling, useNucStrand,
+                         countingBackend, normalizationEngine)
+
+    # (Dyad position context counts loaded along the way stay cached in memory until every file has been run.)
+    try:
+        if jobs == 1 or len(mutationFilePaths) == 1:
+            for i, mutationFilePath in enumerate(mutationFilePaths):
+                print("\nRunning",os.path.basename(mutationFilePath),"through the analysis pipeline...")
+                runAnalysisSuiteOnFile(mutationFilePath, *pipelineArguments)
+                print("\nFinished", os.path.basename(mutationFilePath), f"({i+1} of {len(mutationFilePaths)})")
+
+        else:
+            print("\nRunning", len(mutationFilePaths), "mutation files through the analysis pipeline with", 
+                  min(jobs, len(mutationFilePaths)), "parallel jobs...")
+            with ProcessPoolExecutor(max_workers = min(jobs, len(mutationFilePaths))) as executor:
+                futures = {executor.submit(runAnalysisSuiteOnFile, mutationFilePath, *pipelineArguments):mutationFilePath
+                           for mutationFilePath in mutationFilePaths}
+                for i, future in enumerate(as_completed(futures)):
+                    future.result() # Re-raises any exception from the job.
+                    print("\nFinished", os.path.basename(futures[future]), f"({i+1} of {len(mutationFilePaths)})")
+    finally: loadDyadPosContextCountMatrix.cache_clear()
 
 
 def parseArgs(args):
@@ -141,7 +175,9 @@ def parseArgs(args):
     elif args.generate_background_immediately: raise UserInputError("Background generation requested, but no background given.")
 
     runAnalysisSuite(list(set(finalBedMutationPaths)), list(set(nucleosomeMapNames)), normalizationMethod, customBackgroundDir, 
-                     args.singlenuc_radius, args.add_linker, args.nuc_group_radius)
+                     args.singlenuc_radius, args.add_linker, args.nuc_group_radius, jobs = args.jobs,
+                     countingBackend = CountingBackend(args.counting_backend),
+                     normalizationEngine = NormalizationEngine(args.normalization_engine))
 
 
 def main():
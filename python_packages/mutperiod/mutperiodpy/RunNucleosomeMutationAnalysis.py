@@ -1,16 +1,46 @@
-# This script takes normalized nucleosome mutation counts files and passes them to an R script
-# which outputs relevant data about them such as periodicity snr, assymetry, and differences between MSI and MSS data.
+# This script takes normalized nucleosome mutation counts files and runs a periodicity analysis on them, either in Python
+# or by passing them to an R script which also outputs relevant data about them such as assymetry, and differences between MSI and MSS data.
 
-import os, subprocess, sys
-from typing import List
+import os, sys, re, math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from enum import Enum
+from typing import List, Dict
+import numpy as np
 
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError, checkIfPathExists
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (DataTypeStr, getDataDirectory, Metadata,
-                                                                  rScriptsDirectory, getContext, checkForNucGroup, getExpectedPeriod)
+                                                                  getContext, checkForNucGroup, getExpectedPeriod)
+from mutperiodpy.helper_scripts.RWorker import runRScript, getRInputsFilePath
+from mutperiodpy.helper_scripts.RDataTableCompatibility import readDataTable, writeDataTable
+from mutperiodpy.helper_scripts.LombScargle import (getScannedFrequencies, getLombScarglePowers, getPeriodicityStatistics,
+                                                    countNullSNRExceedances, ResamplingMethod)
 from benbiohelpers.FileSystemHandling.DirectoryHandling import getFilesInDirectory
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 
 
+# The available engines for the periodicity analysis.
+#   python: Runs the analysis in this process with NumPy, computing the periodograms for many counts files at once.
+#           Only periodicity results (.tsv) can be output.
+#   R: Calls the RunNucleosomeMutationAnalysis.R script, which can also output the complete mutperiodData object (.rda).
+# Both produce the same periodicity results.
+class PeriodicityEngine(Enum):
+    python = "python"
+    R = "R"
+
+
+# Only counts within this distance of the dyad are totaled when checking counts files against the mutation cutoff.
+NUCLEOSOME_DYAD_POS_CUTOFF = 60
+# Counts files with fewer mutations than this (within the above cutoff) are left out of the analysis.
+NUCLEOSOME_MUTATION_CUTOFF = 5000
+
+# The dyad position cutoff and the range of periods scanned for single nucleosome and nuc-group counts files.
+SINGLE_NUC_PERIODICITY_PARAMETERS = (NUCLEOSOME_DYAD_POS_CUTOFF, 5, 25)
+NUC_GROUP_PERIODICITY_PARAMETERS = (1000, 50, 250)
+
+PERIODICITY_RESULTS_HEADERS = ("Data_Set", "Peak_Periodicity", "Expected_Peak_Periodicity", "Power", "SNR")
+SNR_P_VALUE_HEADER = "SNR_P_Value"
+
+
 # Given a list of file paths pointing to nucleosome mutation data, returns the paths that fit the given specifications
 # normalizationMethods: A list of integers designating which normalization methods are allowed.
 #   0: Raw, 1/2: Singlenuc or dinuc, 3/4: trinuc or quadrunuc, 5/6: pentanuc or hexanuc, -1: custom
@@ -75,8 +105,213 @@ def getFilePathGroup(potentialFilePaths, normalizationMethods: List[int], single
     return filePathGroup
 
 
+# Returns the path to the raw counts file associated with the given raw or normalized counts file.
+def getRawCountsFilePath(rawOrNormalizedCountsFilePath):
+
+    fileName = os.path.basename(rawOrNormalizedCountsFilePath)
+    if "raw_nucleosome" in fileName: return rawOrNormalizedCountsFilePath
+
+    dataSetName = re.split("singlenuc|dinuc|trinuc|quadrunuc|pentanuc|hexanuc|custom_context", fileName)[0]
+    if "nuc-group" in fileName: dyadRadius = "nuc-group_"
+    else: dyadRadius = ''
+    linkerOffsets = [piece for piece in fileName.split('_') if "linker+" in piece]
+    linkerOffset = ''.join(piece + '_' for piece in linkerOffsets)
+
+    return os.path.join(os.path.dirname(rawOrNormalizedCountsFilePath),
+                        dataSetName + linkerOffset + dyadRadius + DataTypeStr.rawNucCounts + ".tsv")
+
+
+# Returns the data set name for the given counts file (everything before "_nucleosome_mutation_counts").
+def getDataSetName(countsFilePath):
+    return os.path.basename(countsFilePath).split('_' + DataTypeStr.generalNucCounts)[0]
+
+
+# Returns the p-value of a two-sided Wilcoxon rank sum test between the two given groups of values, computed the same
+# way as R's wilcox.test: exactly when both groups have fewer than 50 values and there are no ties, and otherwise through
+# the normal approximation with a continuity correction.
+def getWilcoxonRankSumPValue(group1Values, group2Values):
+
+    group1Values = [value for value in group1Values if math.isfinite(value)]
+    group2Values = [value for value in group2Values if math.isfinite(value)]
+    group1Size, group2Size = len(group1Values), len(group2Values)
+    if group1Size == 0 or group2Size == 0:
+        raise UserInputError("Both groups must contain at least one valid SNR value to run the Wilcoxon rank sum test.")
+
+    # Rank the combined values, averaging the ranks of ties.
+    sortedValues = sorted(group1Values + group2Values)
+    tiedValueCounts: Dict[float, int] = dict()
+    for value in sortedValues: tiedValueCounts[value] = tiedValueCounts.get(value, 0) + 1
+    averageRanks = dict()
+    rank = 0
+    for value in sorted(tiedValueCounts):
+        averageRanks[value] = rank + (tiedValueCounts[value] + 1)/2
+        rank += tiedValueCounts[value]
+
+    statistic = sum(averageRanks[value] for value in group1Values) - group1Size*(group1Size + 1)/2
+
+    if group1Size < 50 and group2Size < 50 and len(tiedValueCounts) == len(sortedValues):
+
+        # Get the number of ways to achieve each value of the statistic from the generating function
+        # prod((1 - q^(group2Size+i))/(1 - q^i)) for i in 1..group1Size.
+        maxStatistic = group1Size*group2Size
+        waysToAchieve = [1] + [0]*maxStatistic
+        for i in range(1, group1Size + 1):
+            for u in range(maxStatistic, group2Size + i - 1, -1): waysToAchieve[u] -= waysToAchieve[u - group2Size - i]
+            for u in range(i, maxStatistic + 1): waysToAchieve[u] += waysToAchieve[u - i]
+        totalWays = math.comb(group1Size + group2Size, group1Size)
+
+        statistic = int(statistic)
+        if statistic > maxStatistic/2: pValue = sum(waysToAchieve[statistic:])/totalWays
+        else: pValue = sum(waysToAchieve[:statistic + 1])/totalWays
+        return min(2*pValue, 1)
+
+    else:
+
+        z = statistic - group1Size*group2Size/2
+        sigma = math.sqrt((group1Size*group2Size/12) *
+                          ((group1Size + group2Size + 1) -
+                           sum(count**3 - count for count in tiedValueCounts.values()) /
+                           ((group1Size + group2Size)*(group1Size + group2Size - 1))))
+        z = (z - math.copysign(0.5, z) if z != 0 else 0)/sigma
+        return min(math.erfc(abs(z)/math.sqrt(2)), 1)
+
+
+# Returns empirical p-values for the given observed SNRs, from the given number of null counts profiles resampled from each counts
+# profile with the given method.  The p-value is (1 + the number of null SNRs at least as high as the observed SNR)/(resampleNum + 1).
+# Each counts profile is resampled with its own seed spawned from the given seed, so results do not depend on the number of jobs.
+def getSNRPValues(countsProfileGroups: Dict[tuple, List[int]], countsProfiles: List[np.ndarray], observedSNRs: np.ndarray,
+                  expectedPeriodicities: np.ndarray, resamplingMethod: ResamplingMethod, resampleNum, seed, jobs):
+
+    seeds = np.random.SeedSequence(seed).spawn(len(countsProfiles))
+
+    # Split each group of counts profiles into tasks, with a few tasks per job so the work is spread evenly.
+    tasks = list()
+    for (fromPeriod, toPeriod, dyadPositionsBytes), indices in countsProfileGroups.items():
+        dyadPositions = np.frombuffer(dyadPositionsBytes, dtype = np.float64)
+        chunkSize = math.ceil(len(indices)/(4*jobs))
+        for chunkStart in range(0, len(indices), chunkSize):
+            chunk = indices[chunkStart:chunkStart + chunkSize]
+            tasks.append((chunk, (dyadPositions, fromPeriod, toPeriod, [countsProfiles[i] for i in chunk], observedSNRs[chunk],
+                                  [seeds[i] for i in chunk], resampleNum, resamplingMethod,
+                                  None if expectedPeriodicities is None else expectedPeriodicities[chunk])))
+
+    exceedances = np.zeros(len(countsProfiles), dtype = np.int64)
+    if jobs == 1 or len(tasks) == 1:
+        for i, (chunk, taskArguments) in enumerate(tasks):
+            exceedances[chunk] = countNullSNRExceedances(*taskArguments)
+            print(f"Finished resampling {i+1} of {len(tasks)} sets of counts files.")
+    else:
+        with ProcessPoolExecutor(max_workers = min(jobs, len(tasks))) as executor:
+            futures = {executor.submit(countNullSNRExceedances, *taskArguments):chunk for chunk, taskArguments in tasks}
+            for i, future in enumerate(as_completed(futures)):
+                exceedances[futures[future]] = future.result()
+                print(f"Finished resampling {i+1} of {len(tasks)} sets of counts files.")
+
+    SNRPValues = (exceedances + 1)/(resampleNum + 1)
+    SNRPValues[np.isnan(observedSNRs)] = np.nan
+    return SNRPValues
+
+
+# Runs the periodicity analysis from generateMutperiodData in mutperiodR on the given counts files, writing the periodicity
+# results table to the given output file path.  Counts files are read once, and periodograms for all files with the same
+# dyad positions and period range are computed together.
+def generatePeriodicityResults(nucleosomeMutationCountsFilePaths: List[str], outputFilePath, expectedPeriods: List[float],
+                               overridePeakPeriodicityWithExpected, alignStrands,
+                               filePathGroup1: List[str] = list(), filePathGroup2: List[str] = list(),
+                               resamplingMethod: ResamplingMethod = None, resampleNum = 1000, seed = 0, jobs = 1):
+
+    # Filter out counts files with too few mutations near the dyad, based on their raw counts.
+    rawCountsTables = dict()
+    countsFileEntries = list()
+    for countsFilePath, expectedPeriod in zip(nucleosomeMutationCountsFilePaths, expectedPeriods):
+
+        rawCountsFilePath = getRawCountsFilePath(countsFilePath)
+        if rawCountsFilePath not in rawCountsTables: rawCountsTables[rawCountsFilePath] = readDataTable(rawCountsFilePath)
+        rawCountsTable = rawCountsTables[rawCountsFilePath]
+        nucleosomeMutationCounts = rawCountsTable["Both_Strands_Counts"][
+            np.abs(rawCountsTable["Dyad_Position"]) <= NUCLEOSOME_DYAD_POS_CUTOFF].sum()
+
+        dataSetName = getDataSetName(countsFilePath)
+        if nucleosomeMutationCounts >= NUCLEOSOME_MUTATION_CUTOFF:
+            countsFileEntries.append((dataSetName, countsFilePath, rawCountsFilePath, float(expectedPeriod)))
+        else: print(dataSetName, "is not valid with only", nucleosomeMutationCounts, "total counts and will be filtered out.")
+
+    countsFileEntries.sort(key = lambda countsFileEntry: countsFileEntry[0])
+    if len(countsFileEntries) == 0: print("Warning: No valid files given.  Returning blank analysis.")
+
+    # Retrieve the counts to analyze from each valid file, and group them by their dyad positions and scanned periods.
+    countsProfileGroups: Dict[tuple, List[int]] = dict()
+    countsProfiles = list()
+    for i, (dataSetName, countsFilePath, rawCountsFilePath, _) in enumerate(countsFileEntries):
+
+        if countsFilePath == rawCountsFilePath:
+            countsTable = rawCountsTables[rawCountsFilePath]
+            countsHeader = "Aligned_Strands_Counts" if alignStrands else "Both_Strands_Counts"
+        else:
+            countsTable = readDataTable(countsFilePath)
+            countsHeader = "Normalized_Aligned_Strands" if alignStrands else "Normalized_Both_Strands"
+
+        if checkForNucGroup(countsFilePath): dyadPosCutoff, fromPeriod, toPeriod = NUC_GROUP_PERIODICITY_PARAMETERS
+        else: dyadPosCutoff, fromPeriod, toPeriod = SINGLE_NUC_PERIODICITY_PARAMETERS
+
+        dyadPositions = countsTable["Dyad_Position"].astype(np.float64)
+        counts = countsTable[countsHeader].astype(np.float64)
+        keep = (np.abs(dyadPositions) <= dyadPosCutoff) & ~np.isnan(counts)
+        order = np.argsort(dyadPositions[keep], kind = "stable")
+        dyadPositions, counts = dyadPositions[keep][order], counts[keep][order]
+
+        countsProfiles.append(counts)
+        countsProfileGroups.setdefault((fromPeriod, toPeriod, dyadPositions.tobytes()), list()).append(i)
+
+    # Compute the periodograms and periodicity statistics for each group of counts profiles together.
+    peakPeriodicities, relevantPowers, SNRs = (np.empty(len(countsFileEntries), dtype = np.float64) for _ in range(3))
+    expectedPeakPeriodicities = np.array([countsFileEntry[3] for countsFileEntry in countsFileEntries], dtype = np.float64)
+    for (fromPeriod, toPeriod, dyadPositionsBytes), indices in countsProfileGroups.items():
+
+        print(f"Running periodicity analysis on {len(indices)} counts file(s) scanning periods from {fromPeriod} to {toPeriod}...")
+        dyadPositions = np.frombuffer(dyadPositionsBytes, dtype = np.float64)
+        frequencies = getScannedFrequencies(dyadPositions, fromPeriod, toPeriod)
+        powers = getLombScarglePowers(dyadPositions, np.vstack([countsProfiles[i] for i in indices]), frequencies)
+        (peakPeriodicities[indices], relevantPowers[indices],
+         SNRs[indices]) = getPeriodicityStatistics(frequencies, powers,
+                                                   expectedPeakPeriodicities[indices] if overridePeakPeriodicityWithExpected else None)
+
+    dataSetNames = np.array([countsFileEntry[0] for countsFileEntry in countsFileEntries], dtype = object)
+    periodicityResults = dict(zip(PERIODICITY_RESULTS_HEADERS, (dataSetNames, peakPeriodicities, expectedPeakPeriodicities,
+                                                                relevantPowers, SNRs)))
+
+    # If requested, test the significance of each SNR against resampled counts profiles.
+    if resamplingMethod is not None:
+        print(f"Testing SNR significance with {resampleNum} {resamplingMethod.value} resamples of each counts file "
+              f"using {jobs} job(s)...")
+        periodicityResults[SNR_P_VALUE_HEADER] = getSNRPValues(countsProfileGroups, countsProfiles, SNRs,
+                                                               expectedPeakPeriodicities if overridePeakPeriodicityWithExpected else None,
+                                                               resamplingMethod, resampleNum, seed, jobs)
+
+    writeDataTable(outputFilePath, periodicityResults)
+
+    # Run the SNR Wilcoxon rank sum test if necessary.
+    if len(filePathGroup1) > 0 and len(filePathGroup2) > 0:
+
+        print("Comparing periodicity results between given groups.")
+
+        group1DataSetNames = {os.path.basename(filePath).split("_nucleosome")[0] for filePath in filePathGroup1}
+        group2DataSetNames = {os.path.basename(filePath).split("_nucleosome")[0] for filePath in filePathGroup2}
+        group1SNRs = [SNR for dataSetName, SNR in zip(dataSetNames, SNRs.tolist()) if dataSetName in group1DataSetNames]
+        group2SNRs = [SNR for dataSetName, SNR in zip(dataSetNames, SNRs.tolist()) if dataSetName in group2DataSetNames]
+
+        if len(group1SNRs) + len(group2SNRs) > len(SNRs):
+            print("Warning: The number of the group1 and group2 combined SNR values is greater than the total number of SNR values")
+        elif len(group1SNRs) + len(group2SNRs) < len(SNRs):
+            print("Warning: The number of the group1 and group2 combined SNR values is less than the total number of SNR values")
+
+        print("wilcoxon test p-value:", getWilcoxonRankSumPValue(group1SNRs, group2SNRs))
+
+
 def runNucleosomeMutationAnalysis(nucleosomeMutationCountsFilePaths: List[str], outputFilePath: str, overridePeakPeriodicityWithExpected,
-                                  alignStrands, filePathGroup1: List[str] = list(), filePathGroup2: List[str] = list()):
+                                  alignStrands, filePathGroup1: List[str] = list(), filePathGroup2: List[str] = list(),
+                                  periodicityEngine = PeriodicityEngine.python, resamplingMethod: ResamplingMethod = None,
+                                  resampleNum = 1000, seed = 0, jobs = 1):
 
     # Check for valid input.
     if (len(filePathGroup1) == 0) != (len(filePathGroup2) == 0):
@@ -90,12 +325,31 @@ def runNucleosomeMutationAnalysis(nucleosomeMutationCountsFilePaths: List[str],
         outputFile.close()
     except IOError:
         raise InvalidPathError(outputFilePath, "Given output file path is not writeable: ")
+    if resamplingMethod is not None:
+        if periodicityEngine is not PeriodicityEngine.python or not outputFilePath.endswith(".tsv"):
+            raise UserInputError("SNR significance testing is only available with the python engine and a .tsv output file.")
+        if resampleNum < 1: raise UserInputError("The number of resamples must be at least 1.")
+        if jobs < 1: raise UserInputError("The number of jobs must be at least 1.")
 
     # Retrieve the expected periods for each of the given counts files.
-    expectedPeriods = [str(getExpectedPeriod(nucleosomeMutationCountsFilePath)) for nucleosomeMutationCountsFilePath in nucleosomeMutationCountsFilePaths]
+    expectedPeriods = [getExpectedPeriod(nucleosomeMutationCountsFilePath) for nucleosomeMutationCountsFilePath in nucleosomeMutationCountsFilePaths]
+
+    # The complete mutperiodData object can only be output by the R script.
+    if periodicityEngine is PeriodicityEngine.python and outputFilePath.endswith(".rda"):
+        print("Output file is an .rda file, so the R script will be used for the analysis.")
+        periodicityEngine = PeriodicityEngine.R
+
+    if periodicityEngine is PeriodicityEngine.python:
+        generatePeriodicityResults(nucleosomeMutationCountsFilePaths, outputFilePath, expectedPeriods,
+                                   overridePeakPeriodicityWithExpected, alignStrands, filePathGroup1, filePathGroup2,
+                                   resamplingMethod, resampleNum, seed, jobs)
+        print("Results can be found at",outputFilePath)
+        return
+
+    expectedPeriods = [str(expectedPeriod) for expectedPeriod in expectedPeriods]
 
     # Write the inputs to a temporary file to be read by the R script
-    inputsFilePath = os.path.join(os.getenv("HOME"), ".mutperiod","R_inputs.txt")
+    inputsFilePath = getRInputsFilePath()
 
     with open(inputsFilePath, 'w') as inputsFile:
         if (len(filePathGroup1) == 0 and len(filePathGroup2) == 0):
@@ -115,7 +369,8 @@ def runNucleosomeMutationAnalysis(nucleosomeMutationCountsFilePaths: List[str],
 
     # Call the R script
     print("Calling R script...")
-    subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"RunNucleosomeMutationAnalysis.R"),inputsFilePath), check = True)
+    try: runRScript("RunNucleosomeMutationAnalysis.R", inputsFilePath)
+    finally: os.remove(inputsFilePath)
 
     print("Results can be found at",outputFilePath)
 
@@ -150,7 +405,9 @@ def parseArgs(args):
     filePathGroups[0] = filePathGroups[0] | filePathGroups[1] | filePathGroups[2]
 
     runNucleosomeMutationAnalysis(list(filePathGroups[0]), args.output_file_path, args.use_expected_periodicity, args.align_strands,
-                                  list(filePathGroups[1]), list(filePathGroups[2]))
+                                  list(filePathGroups[1]), list(filePathGroups[2]), PeriodicityEngine(args.periodicity_engine),
+                                  None if args.significance_test is None else ResamplingMethod(args.significance_test),
+                                  args.resample_num, args.seed, args.jobs)
 
 
 def main():
@@ -0,0 +1,340 @@
+# This script contains engines for counting mutations at each dyad position around nucleosomes.
+# The multiplexed engine streams the (sorted) mutation file through once, and advances cursors over any number of nucleosome maps
+# at the same time, counting every requested radius for each map in that single pass.  The NumPy engine does the same work
+# one chromosome at a time on arrays, finding the mutations around each dyad with searchsorted and tallying them with bincount.
+# The output files match those from the ThisInThatCounter-based counters in CountNucleosomePositionMutations (relative position
+# and strand comparison stratifiers, with ambiguous mutations counted for every nucleosome they fall near).
+# Like the strand comparison stratifier, a mutation is only counted as "plus strand" when its strand designation is the same
+# as the nucleosome's ('+' unless nucleosome strands are used).  Any other designation, including '.' (e.g. for indels),
+# is counted as "minus strand".  Dyad positions are only flipped for nucleosomes on the '-' strand.
+from typing import Dict, List, Tuple
+import numpy as np
+from benbiohelpers.CustomErrors import UserInputError
+
+
+# The maximum number of mutation-nucleosome pairs the NumPy engine will hold in memory at once.
+MAX_PAIRS_PER_CHUNK = 2**22
+
+# Integer codes for strand designations, so that the NumPy engine can compare them in arrays.
+# New designations are given the next code as they are encountered.
+strandCodesByDesignation: Dict[str, int] = {'+': 0, '-': 1, '.': 2}
+
+
+# The information needed to produce one nucleosome mutation counts file.
+class DyadPositionCountingTask:
+
+    def __init__(self, nucleosomeMapFilePath, radius, outputFilePath):
+        self.nucleosomeMapFilePath = nucleosomeMapFilePath
+        self.radius = radius
+        self.outputFilePath = outputFilePath
+
+
+# Returns the center position of the feature in the given bed line's chopped up columns.
+# Features spanning an even number of bases are centered on a half position.
+def getCenterPosition(choppedUpLine):
+    return (float(choppedUpLine[1]) + float(choppedUpLine[2]) - 1) / 2
+
+
+# Returns the integer code for the given strand designation.
+def getStrandCode(strand):
+    return strandCodesByDesignation.setdefault(strand, len(strandCodesByDesignation))
+
+
+# Reads the dyad centers (and strands, if requested) from the given nucleosome map into a dictionary of sorted lists,
+# keyed by chromosome.  Nucleosomes on chromosomes that aren't acceptable are ignored.
+def readDyadCenters(nucleosomeMapFilePath, acceptableChromosomes, useNucStrand) -> Dict[str, List[Tuple[float, str]]]:
+
+    dyadCenters: Dict[str, List[Tuple[float, str]]] = dict()
+
+    with open(nucleosomeMapFilePath, 'r') as nucleosomeMapFile:
+        for line in nucleosomeMapFile:
+
+            choppedUpLine = line.strip().split('\t')
+            if choppedUpLine[0] not in acceptableChromosomes: continue
+
+            # Without strand designations, every nucleosome is treated as being on the plus strand.
+            if useNucStrand: strand = choppedUpLine[5]
+            else: strand = '+'
+
+            dyadCenters.setdefault(choppedUpLine[0], list()).append((getCenterPosition(choppedUpLine), strand))
+
+    for chromosome in dyadCenters: dyadCenters[chromosome].sort()
+
+    return dyadCenters
+
+
+# Writes the counts for one nucleosome map and radius to a nucleosome mutation counts file.
+def writeDyadPositionCounts(outputFilePath, radius, plusStrandCounts: Dict[float, int], minusStrandCounts: Dict[float, int],
+                            usesHalfPositions):
+
+    # Half positions fall strictly within the radius, so there is one fewer of them than there are whole positions.
+    if usesHalfPositions: dyadPositions = [i + 0.5 for i in range(-radius, radius)]
+    else: dyadPositions = list(range(-radius, radius + 1))
+
+    with open(outputFilePath, 'w') as outputFile:
+
+        outputFile.write('\t'.join(("Dyad_Position", "Plus_Strand_Counts", "Minus_Strand_Counts",
+                                    "Both_Strands_Counts", "Aligned_Strands_Counts")) + '\n')
+
+        for dyadPos in dyadPositions:
+            thisPlusCounts = plusStrandCounts.get(dyadPos, 0)
+            thisMinusCounts = minusStrandCounts.get(dyadPos, 0)
+            oppositeMinusCounts = minusStrandCounts.get(-dyadPos, 0)
+            outputFile.write('\t'.join((str(dyadPos), str(thisPlusCounts), str(thisMinusCounts),
+                                        str(thisPlusCounts + thisMinusCounts),
+                                        str(thisPlusCounts + oppositeMinusCounts))) + '\n')
+
+
+# Counts the mutations in the given sorted mutation file at each dyad position of every nucleosome map in the given tasks,
+# within each task's radius, in a single pass over the mutation file.
+# If useNucStrand is true, dyad positions are relative to each nucleosome's strand, and mutations are "plus strand" when they
+# have the same strand designation as the nucleosome.
+def countMutationsInNucleosomeMaps(mutationFilePath, countingTasks: List[DyadPositionCountingTask], acceptableChromosomes,
+                                   useNucStrand = False):
+
+    # Group the tasks by nucleosome map so that each map is only read (and traversed) once.
+    tasksByNucleosomeMap: Dict[str, List[DyadPositionCountingTask]] = dict()
+    for countingTask in countingTasks:
+        tasksByNucleosomeMap.setdefault(countingTask.nucleosomeMapFilePath, list()).append(countingTask)
+
+    nucleosomeMapFilePaths = list(tasksByNucleosomeMap)
+    dyadCentersByMap = [readDyadCenters(nucleosomeMapFilePath, acceptableChromosomes, useNucStrand)
+                        for nucleosomeMapFilePath in nucleosomeMapFilePaths]
+    radiiByMap = [[countingTask.radius for countingTask in tasksByNucleosomeMap[nucleosomeMapFilePath]]
+                  for nucleosomeMapFilePath in nucleosomeMapFilePaths]
+    maxRadiusByMap = [max(radii) for radii in radiiByMap]
+
+    # One pair of count dictionaries (same strand and opposite strand) for every map and radius.
+    plusStrandCountsByMap = [[dict() for _ in radii] for radii in radiiByMap]
+    minusStrandCountsByMap = [[dict() for _ in radii] for radii in radiiByMap]
+
+    usesHalfPositions = None
+    currentChromosome = None
+    finishedChromosomes = set()
+    previousPosition = None
+    currentDyadCenters: List[List[Tuple[float, str]]] = list()
+    cursors: List[int] = list()
+
+    with open(mutationFilePath, 'r') as mutationFile:
+        for line in mutationFile:
+
+            choppedUpLine = line.strip().split('\t')
+            chromosome = choppedUpLine[0]
+            if chromosome not in acceptableChromosomes: continue
+
+            mutationPosition = getCenterPosition(choppedUpLine)
+            if usesHalfPositions is None: usesHalfPositions = mutationPosition % 1 != 0
+            mutationStrand = choppedUpLine[5]
+
+            # Moving on to a new chromosome?  Reset the cursors for every map.
+            if chromosome != currentChromosome:
+                if chromosome in finishedChromosomes:
+                    raise UserInputError("The mutation file at " + mutationFilePath + " is not sorted.  "
+                                         "Chromosome " + chromosome + " appears in more than one block.")
+                if currentChromosome is not None: finishedChromosomes.add(currentChromosome)
+                currentChromosome = chromosome
+                previousPosition = None
+                currentDyadCenters = [dyadCenters.get(chromosome, list()) for dyadCenters in dyadCentersByMap]
+                cursors = [0]*len(dyadCentersByMap)
+
+            if previousPosition is not None and mutationPosition < previousPosition:
+                raise UserInputError("The mutation file at " + mutationFilePath + " is not sorted.  "
+                                     "Position " + choppedUpLine[1] + " on " + chromosome + " comes after a later position.")
+            previousPosition = mutationPosition
+
+            for mapIndex, chromosomeDyadCenters in enumerate(currentDyadCenters):
+
+                # Advance this map's cursor past any nucleosomes that are too far behind the mutation to ever be counted again.
+                maxRadius = maxRadiusByMap[mapIndex]
+                cursor = cursors[mapIndex]
+                while cursor < len(chromosomeDyadCenters) and chromosomeDyadCenters[cursor][0] < mutationPosition - maxRadius:
+                    cursor += 1
+                cursors[mapIndex] = cursor
+
+                # Count the mutation for every nucleosome (and radius) it falls within.
+                radii = radiiByMap[mapIndex]
+                i = cursor
+                while i < len(chromosomeDyadCenters) and chromosomeDyadCenters[i][0] <= mutationPosition + maxRadius:
+
+                    dyadCenter, nucleosomeStrand = chromosomeDyadCenters[i]
+                    if nucleosomeStrand == '-': dyadPos = dyadCenter - mutationPosition
+                    else: dyadPos = mutationPosition - dyadCenter
+                    if dyadPos % 1 == 0: dyadPos = int(dyadPos)
+
+                    if mutationStrand == nucleosomeStrand: strandCountsByRadius = plusStrandCountsByMap[mapIndex]
+                    else: strandCountsByRadius = minusStrandCountsByMap[mapIndex]
+
+                    for radiusIndex, radius in enumerate(radii):
+                        if abs(dyadPos) <= radius:
+                            strandCounts = strandCountsByRadius[radiusIndex]
+                            strandCounts[dyadPos] = strandCounts.get(dyadPos, 0) + 1
+
+                    i += 1
+
+    # Write the results for every task.
+    for mapIndex, nucleosomeMapFilePath in enumerate(nucleosomeMapFilePaths):
+        for radiusIndex, countingTask in enumerate(tasksByNucleosomeMap[nucleosomeMapFilePath]):
+            writeDyadPositionCounts(countingTask.outputFilePath, countingTask.radius,
+                                    plusStrandCountsByMap[mapIndex][radiusIndex], minusStrandCountsByMap[mapIndex][radiusIndex],
+                                    bool(usesHalfPositions))
+
+
+# Reads the dyad centers and strands from the given nucleosome map into NumPy arrays, keyed by chromosome.
+# Each value is a tuple of a (sorted) array of dyad centers and an array of each nucleosome's strand code.
+def readDyadCenterArrays(nucleosomeMapFilePath, acceptableChromosomes, useNucStrand) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+
+    dyadCenterArrays = dict()
+    for chromosome, dyadCenters in readDyadCenters(nucleosomeMapFilePath, acceptableChromosomes, useNucStrand).items():
+        dyadCenterArrays[chromosome] = (np.array([dyadCenter for dyadCenter, _ in dyadCenters], dtype = np.float64),
+                                        np.array([getStrandCode(strand) for _, strand in dyadCenters], dtype = np.int64))
+
+    return dyadCenterArrays
+
+
+# Yields the chromosome, mutation positions, and each mutation's strand code, as NumPy arrays, for each
+# block of chromosomes in the given (sorted) mutation file.  Mutations on chromosomes that aren't acceptable are ignored.
+# Like the multiplexed engine, raises a UserInputError if the file is not sorted.
+def readMutationArraysByChromosome(mutationFilePath, acceptableChromosomes):
+
+    currentChromosome = None
+    finishedChromosomes = set()
+    previousPosition = None
+    positions = list()
+    strandCodes = list()
+
+    with open(mutationFilePath, 'r') as mutationFile:
+        for line in mutationFile:
+
+            choppedUpLine = line.strip().split('\t')
+            chromosome = choppedUpLine[0]
+            if chromosome not in acceptableChromosomes: continue
+
+            if chromosome != currentChromosome:
+
+                if chromosome in finishedChromosomes:
+                    raise UserInputError("The mutation file at " + mutationFilePath + " is not sorted.  "
+                                         "Chromosome " + chromosome + " appears in more than one block.")
+
+                if currentChromosome is not None:
+                    finishedChromosomes.add(currentChromosome)
+                    yield currentChromosome, np.array(positions, dtype = np.float64), np.array(strandCodes, dtype = np.int64)
+
+                currentChromosome = chromosome
+                previousPosition = None
+                positions = list()
+                strandCodes = list()
+
+            mutationPosition = getCenterPosition(choppedUpLine)
+            if previousPosition is not None and mutationPosition < previousPosition:
+                raise UserInputError("The mutation file at " + mutationFilePath + " is not sorted.  "
+                                     "Position " + choppedUpLine[1] + " on " + chromosome + " comes after a later position.")
+            previousPosition = mutationPosition
+
+            positions.append(mutationPosition)
+            strandCodes.append(getStrandCode(choppedUpLine[5]))
+
+    if currentChromosome is not None:
+        yield currentChromosome, np.array(positions, dtype = np.float64), np.array(strandCodes, dtype = np.int64)
+
+
+# Adds the dyad position counts for one chromosome of mutations and one chromosome of nucleosomes to the given count arrays
+# (one pair of same strand/opposite strand arrays per radius).
+def addChromosomeDyadPositionCounts(mutationPositions: np.ndarray, mutationStrandCodes: np.ndarray,
+                                    dyadCenters: np.ndarray, dyadStrandCodes: np.ndarray,
+                                    radii, usesHalfPositions, plusStrandCountArrays, minusStrandCountArrays):
+
+    maxRadius = max(radii)
+
+    # Find the range of (sorted) mutations around each dyad center.
+    lowerBounds = np.searchsorted(mutationPositions, dyadCenters - maxRadius, side = "left")
+    upperBounds = np.searchsorted(mutationPositions, dyadCenters + maxRadius, side = "right")
+    pairCounts = upperBounds - lowerBounds
+
+    # Work through the nucleosomes in chunks so that the number of mutation-nucleosome pairs in memory stays reasonable.
+    cumulativePairCounts = np.cumsum(pairCounts)
+    chunkStart = 0
+    while chunkStart < len(dyadCenters):
+
+        chunkEnd = int(np.searchsorted(cumulativePairCounts, cumulativePairCounts[chunkStart] - pairCounts[chunkStart] + MAX_PAIRS_PER_CHUNK,
+                                       side = "right"))
+        chunkEnd = max(chunkEnd, chunkStart + 1)
+
+        # Expand the ranges into one mutation index and one nucleosome index per pair.
+        chunkPairCounts = pairCounts[chunkStart:chunkEnd]
+        dyadIndices = np.repeat(np.arange(chunkStart, chunkEnd), chunkPairCounts)
+        pairOffsets = np.arange(len(dyadIndices)) - np.repeat(np.cumsum(chunkPairCounts) - chunkPairCounts, chunkPairCounts)
+        mutationIndices = np.repeat(lowerBounds[chunkStart:chunkEnd], chunkPairCounts) + pairOffsets
+
+        # Get the position of each mutation relative to its dyad (flipped for minus strand nucleosomes)
+        # and whether the mutation has the same strand designation as the nucleosome.
+        pairDyadStrandCodes = dyadStrandCodes[dyadIndices]
+        relativePositions = mutationPositions[mutationIndices] - dyadCenters[dyadIndices]
+        relativePositions[pairDyadStrandCodes == strandCodesByDesignation['-']] *= -1
+        sameStrand = mutationStrandCodes[mutationIndices] == pairDyadStrandCodes
+
+        for radiusIndex, radius in enumerate(radii):
+
+            inRadius = np.abs(relativePositions) <= radius
+            if usesHalfPositions: binCount = 2*radius; binIndices = np.round(relativePositions + radius - 0.5).astype(np.int64)
+            else: binCount = 2*radius + 1; binIndices = np.round(relativePositions + radius).astype(np.int64)
+
+            plusStrandCountArrays[radiusIndex] += np.bincount(binIndices[inRadius & sameStrand], minlength = binCount)[:binCount]
+            minusStrandCountArrays[radiusIndex] += np.bincount(binIndices[inRadius & ~sameStrand], minlength = binCount)[:binCount]
+
+        chunkStart = chunkEnd
+
+
+# Counts the mutations in the given sorted mutation file at each dyad position of every nucleosome map in the given tasks,
+# within each task's radius, using NumPy arrays.  Produces the same output as countMutationsInNucleosomeMaps.
+def countMutationsInNucleosomeMapsWithNumPy(mutationFilePath, countingTasks: List[DyadPositionCountingTask], acceptableChromosomes,
+                                            useNucStrand = False):
+
+    # Group the tasks by nucleosome map so that each map is only read once.
+    tasksByNucleosomeMap: Dict[str, List[DyadPositionCountingTask]] = dict()
+    for countingTask in countingTasks:
+        tasksByNucleosomeMap.setdefault(countingTask.nucleosomeMapFilePath, list()).append(countingTask)
+
+    nucleosomeMapFilePaths = list(tasksByNucleosomeMap)
+    dyadCenterArraysByMap = [readDyadCenterArrays(nucleosomeMapFilePath, acceptableChromosomes, useNucStrand)
+                             for nucleosomeMapFilePath in nucleosomeMapFilePaths]
+    radiiByMap = [[countingTask.radius for countingTask in tasksByNucleosomeMap[nucleosomeMapFilePath]]
+                  for nucleosomeMapFilePath in nucleosomeMapFilePaths]
+
+    usesHalfPositions = None
+    plusStrandCountArraysByMap = None
+    minusStrandCountArraysByMap = None
+
+    for chromosome, mutationPositions, mutationStrandCodes in readMutationArraysByChromosome(mutationFilePath, acceptableChromosomes):
+
+        if len(mutationPositions) == 0: continue
+
+        # The first mutation determines whether counts are kept at whole or half positions.
+        if usesHalfPositions is None:
+            usesHalfPositions = bool(mutationPositions[0] % 1 != 0)
+            plusStrandCountArraysByMap = [[np.zeros(2*radius + (not usesHalfPositions), dtype = np.int64) for radius in radii]
+                                          for radii in radiiByMap]
+            minusStrandCountArraysByMap = [[np.zeros(2*radius + (not usesHalfPositions), dtype = np.int64) for radius in radii]
+                                           for radii in radiiByMap]
+
+        for mapIndex, dyadCenterArrays in enumerate(dyadCenterArraysByMap):
+            if chromosome not in dyadCenterArrays: continue
+            dyadCenters, dyadStrandCodes = dyadCenterArrays[chromosome]
+            addChromosomeDyadPositionCounts(mutationPositions, mutationStrandCodes, dyadCenters, dyadStrandCodes,
+                                            radiiByMap[mapIndex], usesHalfPositions,
+                                            plusStrandCountArraysByMap[mapIndex], minusStrandCountArraysByMap[mapIndex])
+
+    # Write the results for every task.
+    for mapIndex, nucleosomeMapFilePath in enumerate(nucleosomeMapFilePaths):
+        for radiusIndex, countingTask in enumerate(tasksByNucleosomeMap[nucleosomeMapFilePath]):
+
+            radius = countingTask.radius
+            if usesHalfPositions is None:
+                plusStrandCounts = dict(); minusStrandCounts = dict()
+            else:
+                if usesHalfPositions: dyadPositions = [i + 0.5 for i in range(-radius, radius)]
+                else: dyadPositions = list(range(-radius, radius + 1))
+                plusStrandCounts = dict(zip(dyadPositions, plusStrandCountArraysByMap[mapIndex][radiusIndex].tolist()))
+                minusStrandCounts = dict(zip(dyadPositions, minusStrandCountArraysByMap[mapIndex][radiusIndex].tolist()))
+
+            writeDyadPositionCounts(countingTask.outputFilePath, radius, plusStrandCounts, minusStrandCounts,
+                                    bool(usesHalfPositions))
@@ -0,0 +1,86 @@
+# This script handles the "genome context profile": the plus-strand counts of every context from singlenuc to hexanuc
+# across a genome's acceptable chromosomes.  All context widths are counted in a single pass over the genome fasta file
+# and stored together in one compressed .npz file next to the genome in __external_data/<genome>/.
+import os
+from typing import Dict
+import numpy as np
+from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
+from mutperiodpy.helper_scripts.KmerCounting import encodeSequence, countEncodedKmers, decodeKmers
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import generateFilePath, getContext
+
+
+# The context widths stored in every genome context profile.
+PROFILE_CONTEXT_NUMS = range(1,7)
+
+
+# Returns the path to the genome context profile associated with the given genome fasta file.
+def getGenomeContextProfileFilePath(genomeFilePath):
+    return generateFilePath(directory = os.path.dirname(genomeFilePath),
+                            dataGroup = os.path.basename(genomeFilePath).rsplit(".fa",1)[0],
+                            dataType = "context_profile", fileExtension = ".npz")
+
+
+# Returns the path to the genome context profile that lives alongside the given genome context frequency file.
+def getGenomeContextProfileFilePathFromFrequencyFile(genomeContextFrequencyFilePath):
+    contextText = getContext(genomeContextFrequencyFilePath)
+    if contextText is None: return None
+    genomeName = os.path.basename(genomeContextFrequencyFilePath).rsplit('_' + contextText + "_frequency", 1)[0]
+    return generateFilePath(directory = os.path.dirname(genomeContextFrequencyFilePath), dataGroup = genomeName,
+                            dataType = "context_profile", fileExtension = ".npz")
+
+
+# Counts every context width in PROFILE_CONTEXT_NUMS for the given genome in one pass over its fasta file
+# (but only for "acceptable chromosomes"), and writes the counts to the genome context profile file.
+def generateGenomeContextProfile(genomeFilePath, acceptableChromosomes, genomeContextProfileFilePath = None):
+
+    if genomeContextProfileFilePath is None:
+        genomeContextProfileFilePath = getGenomeContextProfileFilePath(genomeFilePath)
+
+    contextCounts: Dict[int, Dict[str, int]] = {contextNum:dict() for contextNum in PROFILE_CONTEXT_NUMS}
+
+    with open(genomeFilePath, 'r') as genomeFile:
+
+        for fastaEntry in FastaFileIterator(genomeFile, False):
+
+            if fastaEntry.sequenceName in acceptableChromosomes:
+
+                print ("Counting context sequences in ",fastaEntry.sequenceName,"...",sep='')
+
+                # Encode the chromosome once, and count every context width from the encoded sequence.
+                encodedSequence, alphabet = encodeSequence(fastaEntry.sequence)
+                for contextNum in PROFILE_CONTEXT_NUMS:
+                    observedCodes, observedCounts = countEncodedKmers(encodedSequence, contextNum, len(alphabet))
+                    theseContextCounts = contextCounts[contextNum]
+                    for context, count in zip(decodeKmers(observedCodes, contextNum, alphabet), observedCounts.tolist()):
+                        theseContextCounts[context] = theseContextCounts.get(context, 0) + count
+
+            else:
+                print ("Skipping",fastaEntry.sequenceName)
+
+    # Store each context width as a sorted array of contexts and a parallel array of counts.
+    profileArrays = dict()
+    for contextNum in PROFILE_CONTEXT_NUMS:
+        sortedContexts = sorted(contextCounts[contextNum])
+        profileArrays["contexts_" + str(contextNum)] = np.array(sortedContexts, dtype = str)
+        profileArrays["counts_" + str(contextNum)] = np.array([contextCounts[contextNum][context] for context in sortedContexts],
+                                                              dtype = np.int64)
+
+    # Write to a temporary file first so that a partially written profile is never mistaken for a complete one.
+    temporaryFilePath = genomeContextProfileFilePath + ".tmp"
+    with open(temporaryFilePath, "wb") as genomeContextProfileFile:
+        np.savez_compressed(genomeContextProfileFile, **profileArrays)
+    os.replace(temporaryFilePath, genomeContextProfileFilePath)
+
+    return genomeContextProfileFilePath
+
+
+# Reads the plus-strand counts for the given context width from the given genome context profile file.
+# Returns them as a dictionary of contexts and their counts, sorted by context.
+def readGenomeContextProfile(genomeContextProfileFilePath, contextNum) -> Dict[str, int]:
+
+    if contextNum not in PROFILE_CONTEXT_NUMS:
+        raise ValueError(str(contextNum) + " is not a context width stored in genome context profiles.")
+
+    with np.load(genomeContextProfileFilePath) as genomeContextProfile:
+        return dict(zip(genomeContextProfile["contexts_" + str(contextNum)].tolist(),
+                        genomeContextProfile["counts_" + str(contextNum)].tolist()))
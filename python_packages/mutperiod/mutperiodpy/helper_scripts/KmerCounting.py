@@ -0,0 +1,102 @@
+# This script contains NumPy-backed functions for counting sequence contexts (k-mers) in large sequences.
+# Sequences are encoded once as uint8 arrays, k-mer codes are computed with strided arithmetic over the encoded
+# array, and the codes are tallied in bulk instead of slicing and counting one context at a time.
+
+from typing import Dict
+import numpy as np
+
+
+# How many k-mers are encoded at once.  Keeps memory usage reasonable for very large chromosomes.
+KMER_CHUNK_SIZE = 2**24
+
+# The largest number of possible k-mer codes that will be tallied with a dense bincount array.
+# Anything larger is tallied with np.unique instead.
+MAX_BINCOUNT_SIZE = 2**24
+
+
+# Encodes the given sequence as a uint8 array of indices into its alphabet (the sorted set of characters in the sequence).
+# Returns the encoded sequence and the alphabet as a string.
+def encodeSequence(sequence):
+
+    if isinstance(sequence, str): sequence = sequence.encode()
+    sequenceBytes = np.frombuffer(sequence, dtype = np.uint8)
+
+    # Find every character present in the sequence and map it to its index in the (sorted) alphabet.
+    alphabetBytes = np.flatnonzero(np.bincount(sequenceBytes, minlength = 256))
+    encodingTable = np.zeros(256, dtype = np.uint8)
+    encodingTable[alphabetBytes] = np.arange(len(alphabetBytes), dtype = np.uint8)
+
+    return encodingTable[sequenceBytes], alphabetBytes.astype(np.uint8).tobytes().decode()
+
+
+# Computes the integer code for every k-mer in the given encoded sequence (in order).
+# Codes are the k-mers' digits in base alphabetSize, with the first base being the most significant digit.
+def getKmerCodes(encodedSequence: np.ndarray, k, alphabetSize):
+
+    kmerNum = len(encodedSequence) - k + 1
+    if kmerNum < 1: return np.zeros(0, dtype = np.int64)
+
+    kmerCodes = np.zeros(kmerNum, dtype = np.int64)
+    for i in range(k):
+        kmerCodes *= alphabetSize
+        kmerCodes += encodedSequence[i:i+kmerNum]
+
+    return kmerCodes
+
+
+# Converts the given k-mer codes back to their sequence strings using the given alphabet.
+def decodeKmers(kmerCodes, k, alphabet):
+
+    alphabetSize = len(alphabet)
+    alphabetArray = np.frombuffer(alphabet.encode(), dtype = np.uint8)
+    placeValues = alphabetSize ** np.arange(k-1, -1, -1, dtype = np.int64)
+    digits = (np.asarray(kmerCodes, dtype = np.int64)[:,None] // placeValues) % alphabetSize
+
+    return [kmer.tobytes().decode() for kmer in alphabetArray[digits]]
+
+
+# Counts every k-mer in the given encoded sequence.
+# Returns a tuple of two arrays: the codes of the k-mers that were observed and their respective counts.
+def countEncodedKmers(encodedSequence: np.ndarray, k, alphabetSize):
+
+    kmerNum = len(encodedSequence) - k + 1
+    possibleKmerNum = alphabetSize**k
+
+    if possibleKmerNum <= MAX_BINCOUNT_SIZE: kmerCounts = np.zeros(possibleKmerNum, dtype = np.int64)
+    else: chunkCodes = list(); chunkCounts = list()
+
+    # Encode and tally the k-mers one chunk at a time.  (Chunks overlap by k-1 bases so no k-mers are missed.)
+    for chunkStart in range(0, max(kmerNum, 0), KMER_CHUNK_SIZE):
+
+        chunkEnd = min(chunkStart + KMER_CHUNK_SIZE, kmerNum)
+        kmerCodes = getKmerCodes(encodedSequence[chunkStart:chunkEnd + k - 1], k, alphabetSize)
+
+        if possibleKmerNum <= MAX_BINCOUNT_SIZE:
+            kmerCounts += np.bincount(kmerCodes, minlength = possibleKmerNum)
+        else:
+            uniqueCodes, uniqueCounts = np.unique(kmerCodes, return_counts = True)
+            chunkCodes.append(uniqueCodes); chunkCounts.append(uniqueCounts)
+
+    if possibleKmerNum <= MAX_BINCOUNT_SIZE:
+        observedCodes = np.flatnonzero(kmerCounts)
+        return observedCodes, kmerCounts[observedCodes]
+    elif len(chunkCodes) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    else:
+        observedCodes, inverse = np.unique(np.concatenate(chunkCodes), return_inverse = True)
+        return observedCodes, np.bincount(inverse, weights = np.concatenate(chunkCounts)).astype(np.int64)
+
+
+# Counts every k-mer in the given sequence and adds the counts to the given dictionary (or a new one if none is given),
+# keyed by the k-mer sequences themselves.  Returns the dictionary.
+def countKmers(sequence, k, kmerCounts: Dict[str, int] = None):
+
+    if kmerCounts is None: kmerCounts = dict()
+
+    encodedSequence, alphabet = encodeSequence(sequence)
+    observedCodes, observedCounts = countEncodedKmers(encodedSequence, k, len(alphabet))
+
+    for kmer, count in zip(decodeKmers(observedCodes, k, alphabet), observedCounts.tolist()):
+        kmerCounts[kmer] = kmerCounts.get(kmer, 0) + count
+
+    return kmerCounts
@@ -0,0 +1,161 @@
+# This script computes Lomb-Scargle periodograms the same way the lomb R package's lsp function does (with type = "period"),
+# but for many counts profiles at once.  Profiles which share dyad positions share a frequency grid, so the sines and cosines
+# for each frequency are computed once, and the periodograms for every profile are found through matrix products.
+# Peak periodicities and signal-to-noise ratios are derived from the periodograms the same way as in generateMutperiodData.
+# The significance of each SNR can be tested against the SNRs of null profiles made by resampling each profile's counts.
+from enum import Enum
+from typing import Tuple, List
+import numpy as np
+from benbiohelpers.CustomErrors import UserInputError
+
+
+# The oversampling factor used for every periodogram (Matches the "ofac" argument used with lsp in mutperiodR).
+OVERSAMPLING_FACTOR = 100
+
+# Periods within this distance of the relevant periodicity are excluded from the noise when calculating SNR.
+SNR_NOISE_EXCLUSION_RADIUS = 0.5
+
+# Expected periodicities must be within this distance of a scanned period to be used in place of the peak periodicity.
+EXPECTED_PERIODICITY_TOLERANCE = 0.1
+
+# The maximum number of frequency-position pairs to hold sines and cosines for at once.
+MAX_TRIG_VALUES_PER_BLOCK = 2**20
+
+# The maximum number of null periodogram powers to hold in memory at once.
+MAX_NULL_POWERS_PER_BATCH = 2**23
+
+
+# The available methods for generating null counts profiles, which keep each profile's counts but not their periodicity.
+#   permutation: Shuffles the counts between the profile's dyad positions.
+#   bootstrap: Draws counts for each dyad position from the profile's counts, with replacement.
+class ResamplingMethod(Enum):
+    permutation = "permutation"
+    bootstrap = "bootstrap"
+
+
+# Returns the frequencies scanned by lsp when searching for periods between fromPeriod and toPeriod for the given positions.
+# Like lsp, the grid starts at 1/span (where span = max(positions) - min(positions)) and steps by 1/(span*oversamplingFactor)
+# up to 1/fromPeriod, and only the frequencies at or above 1/toPeriod are kept.  The steps are generated (and capped) the same
+# way as R's seq(1/span, 1/fromPeriod, by = 1/(span*oversamplingFactor)), so the same floating-point grid is scanned.
+def getScannedFrequencies(positions: np.ndarray, fromPeriod, toPeriod, oversamplingFactor = OVERSAMPLING_FACTOR):
+
+    span = np.max(positions) - np.min(positions)
+    startFrequency, step = 1/span, 1/(span*oversamplingFactor)
+    fromFrequency, toFrequency = 1/toPeriod, 1/fromPeriod
+
+    stepNum = int((toFrequency - startFrequency)/step + 1e-10)
+    if stepNum < 0: raise UserInputError(f"Erroneous frequency range specified: {fromPeriod} to {toPeriod}")
+    frequencies = np.minimum(startFrequency + np.arange(stepNum + 1)*step, toFrequency)
+
+    frequencies = frequencies[frequencies >= fromFrequency]
+    if len(frequencies) == 0: raise UserInputError(f"Erroneous frequency range specified: {fromPeriod} to {toPeriod}")
+    return frequencies
+
+
+# Returns the Lomb-Scargle power at each of the given frequencies (columns) for each of the given counts profiles (rows).
+# Every profile must have counts at the same given positions, with no missing values.
+def getLombScarglePowers(positions: np.ndarray, countsProfiles: np.ndarray, frequencies: np.ndarray):
+
+    positions = np.asarray(positions, dtype = np.float64)
+    countsProfiles = np.atleast_2d(np.asarray(countsProfiles, dtype = np.float64))
+
+    centeredCounts = countsProfiles - countsProfiles.mean(axis = 1, keepdims = True)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        norms = 1/(2*np.var(countsProfiles, axis = 1, ddof = 1))
+
+    powers = np.empty((countsProfiles.shape[0], len(frequencies)), dtype = np.float64)
+    blockSize = max(1, MAX_TRIG_VALUES_PER_BLOCK//len(positions))
+
+    for blockStart in range(0, len(frequencies), blockSize):
+
+        blockEnd = min(blockStart + blockSize, len(frequencies))
+        angularFrequencies = 2*np.pi*frequencies[blockStart:blockEnd]
+
+        # Find the time offset (tau) for each frequency, and the sines and cosines relative to it.
+        phases = np.outer(angularFrequencies, positions)
+        tau = 0.5*np.arctan2(np.sin(phases).sum(axis = 1), np.cos(phases).sum(axis = 1))/angularFrequencies
+        arguments = angularFrequencies[:,None]*(positions[None,:] - tau[:,None])
+        cosines, sines = np.cos(arguments), np.sin(arguments)
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            powers[:,blockStart:blockEnd] = ((centeredCounts @ cosines.T)**2/(cosines*cosines).sum(axis = 1) +
+                                             (centeredCounts @ sines.T)**2/(sines*sines).sum(axis = 1))
+
+    with np.errstate(invalid = "ignore"):
+        return powers*norms[:,None]
+
+
+# Given the scanned frequencies and the resulting periodograms (one per row), returns the peak periodicity for each periodogram,
+# along with the power and signal-to-noise ratio of the relevant periodicity.  The relevant periodicity is the peak periodicity
+# unless expected periodicities are given, in which case the power at the closest scanned period to each expected periodicity is used.
+# SNR is the relevant power divided by the median power of all scanned periods more than 0.5 away from the relevant periodicity.
+def getPeriodicityStatistics(frequencies: np.ndarray, powers: np.ndarray,
+                             expectedPeriodicities: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+
+    scannedPeriods = 1/frequencies
+    rowIndices = np.arange(powers.shape[0])
+
+    peakIndices = np.argmax(powers, axis = 1)
+    peakPeriodicities = scannedPeriods[peakIndices]
+
+    if expectedPeriodicities is None:
+        relevantPeriodicities = peakPeriodicities
+        relevantIndices = peakIndices
+    else:
+        relevantPeriodicities = np.asarray(expectedPeriodicities, dtype = np.float64)
+        relevantIndices = np.argmin(np.abs(scannedPeriods[None,:] - relevantPeriodicities[:,None]), axis = 1)
+        closestPeriodicities = scannedPeriods[relevantIndices]
+        for expectedPeriodicity, closestPeriodicity in zip(relevantPeriodicities, closestPeriodicities):
+            if abs(closestPeriodicity - expectedPeriodicity) > EXPECTED_PERIODICITY_TOLERANCE:
+                raise UserInputError(f"No scanned periodicities exist within {EXPECTED_PERIODICITY_TOLERANCE} units of the given "
+                                     f"expected periodicity, {expectedPeriodicity}.  Closest scanned periodicity is at {closestPeriodicity}.")
+
+    relevantPowers = powers[rowIndices, relevantIndices]
+
+    # Take the median of the noise powers in each row, leaving out the powers near the relevant periodicity.
+    # (Sorting moves the excluded powers, set to NaN, to the end of each row, so the median is found from the remaining count.)
+    isNoise = ((scannedPeriods[None,:] < relevantPeriodicities[:,None] - SNR_NOISE_EXCLUSION_RADIUS) |
+               (scannedPeriods[None,:] > relevantPeriodicities[:,None] + SNR_NOISE_EXCLUSION_RADIUS))
+    sortedNoisePowers = np.sort(np.where(isNoise, powers, np.nan), axis = 1)
+    noiseCounts = np.count_nonzero(isNoise, axis = 1)
+    medianNoisePowers = np.where(noiseCounts > 0, (sortedNoisePowers[rowIndices, np.maximum(noiseCounts - 1, 0)//2] +
+                                                   sortedNoisePowers[rowIndices, noiseCounts//2])/2, np.nan)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        SNRs = relevantPowers/medianNoisePowers
+
+    return peakPeriodicities, relevantPowers, SNRs
+
+
+# Returns the given number of null counts profiles (as rows) resampled from the given counts profile with the given method.
+def getResampledProfiles(counts: np.ndarray, resampleNum, resamplingMethod: ResamplingMethod, randomGenerator: np.random.Generator):
+
+    if resamplingMethod is ResamplingMethod.permutation:
+        return randomGenerator.permuted(np.tile(counts, (resampleNum, 1)), axis = 1)
+    else: return counts[randomGenerator.integers(0, len(counts), size = (resampleNum, len(counts)))]
+
+
+# For each of the given counts profiles (which share the given dyad positions and period range), resamples the given number of
+# null profiles using the profile's seed, and returns the number of them with an SNR at least as high as the profile's observed SNR.
+# If expected periodicities are given, null SNRs are taken at the expected periodicity, just like the observed SNRs.
+def countNullSNRExceedances(positions: np.ndarray, fromPeriod, toPeriod, countsProfiles: List[np.ndarray], observedSNRs: np.ndarray,
+                            seeds: List[np.random.SeedSequence], resampleNum, resamplingMethod: ResamplingMethod,
+                            expectedPeriodicities: np.ndarray = None):
+
+    frequencies = getScannedFrequencies(positions, fromPeriod, toPeriod)
+    resamplesPerBatch = max(1, MAX_NULL_POWERS_PER_BATCH//len(frequencies))
+    exceedances = np.zeros(len(countsProfiles), dtype = np.int64)
+
+    for i, (counts, seed) in enumerate(zip(countsProfiles, seeds)):
+
+        randomGenerator = np.random.default_rng(seed)
+        for batchStart in range(0, resampleNum, resamplesPerBatch):
+
+            batchSize = min(resamplesPerBatch, resampleNum - batchStart)
+            nullPowers = getLombScarglePowers(positions, getResampledProfiles(counts, batchSize, resamplingMethod, randomGenerator),
+                                              frequencies)
+            if expectedPeriodicities is None: nullSNRs = getPeriodicityStatistics(frequencies, nullPowers)[2]
+            else: nullSNRs = getPeriodicityStatistics(frequencies, nullPowers, np.full(batchSize, expectedPeriodicities[i]))[2]
+
+            exceedances[i] += np.count_nonzero(nullSNRs >= observedSNRs[i])
+
+    return exceedances
@@ -0,0 +1,135 @@
+# This script handles the "packed genome": a one-time uint8 copy of a genome fasta file with all of its sequences stored
+# back to back, alongside an index of where each chromosome starts and how long it is.  Bases are stored exactly as they
+# appear in the fasta file (soft-masked lowercase included), so lookups match bedtools getfasta.
+# The packed sequence file is memory-mapped, so sequence lookups are slices of the mapped array instead of
+# bedtools getfasta round trips through temporary bed and fasta files.
+import os
+from functools import lru_cache
+from typing import Dict, Tuple
+import numpy as np
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import generateFilePath, generationLock
+
+
+# Used to convert sequences to their complement before reversing them for the minus strand.  Like bedtools getfasta -s,
+# IUPAC ambiguity codes are complemented too, case is kept, and any other characters are left as they are.
+COMPLEMENT_TABLE = bytes.maketrans(b"ACGTRYKMBVDHSWNacgtrykmbvdhswn", b"TGCAYRMKVBHDSWNtgcayrmkvbhdswn")
+
+
+# Returns the paths to the packed sequence file and index file associated with the given genome fasta file.
+def getPackedGenomeFilePaths(genomeFilePath) -> Tuple[str, str]:
+
+    genomeName = os.path.basename(genomeFilePath).rsplit(".fa",1)[0]
+    packedSequenceFilePath = generateFilePath(directory = os.path.dirname(genomeFilePath), dataGroup = genomeName,
+                                              dataType = "packed_genome", fileExtension = ".bin")
+    packedIndexFilePath = generateFilePath(directory = os.path.dirname(genomeFilePath), dataGroup = genomeName,
+                                           dataType = "packed_genome_index", fileExtension = ".tsv")
+
+    return packedSequenceFilePath, packedIndexFilePath
+
+
+# Writes the packed sequence and index files for the given genome fasta file.
+# Each chromosome's sequence is written back to back to the sequence file, and each line of the index file
+# contains a chromosome name, the offset of its first base in the sequence file, and its length.
+# Chromosome names are defined the same way as in getAcceptableChromosomes.
+def generatePackedGenome(genomeFilePath):
+
+    packedSequenceFilePath, packedIndexFilePath = getPackedGenomeFilePaths(genomeFilePath)
+
+    print("Packing genome sequences from",os.path.basename(genomeFilePath),"for fast lookup...")
+
+    # Write to temporary files first so that a partially written packed genome is never mistaken for a complete one.
+    temporarySequenceFilePath = packedSequenceFilePath + ".tmp"
+    temporaryIndexFilePath = packedIndexFilePath + ".tmp"
+
+    with open(genomeFilePath, 'r') as genomeFile:
+        with open(temporarySequenceFilePath, "wb") as packedSequenceFile:
+            with open(temporaryIndexFilePath, 'w') as packedIndexFile:
+
+                chromosome = None
+                chromosomeOffset = 0
+                chromosomeLength = 0
+
+                for line in genomeFile:
+
+                    if line.startswith('>'):
+
+                        # Record the chromosome that just finished, and start on the next one.
+                        if chromosome is not None:
+                            packedIndexFile.write('\t'.join((chromosome, str(chromosomeOffset), str(chromosomeLength))) + '\n')
+
+                        chromosome = line[1:].split(maxsplit = 1)[0]
+                        chromosomeOffset += chromosomeLength
+                        chromosomeLength = 0
+
+                    elif chromosome is not None:
+                        sequence = line.strip().encode()
+                        packedSequenceFile.write(sequence)
+                        chromosomeLength += len(sequence)
+
+                if chromosome is not None:
+                    packedIndexFile.write('\t'.join((chromosome, str(chromosomeOffset), str(chromosomeLength))) + '\n')
+
+    os.replace(temporarySequenceFilePath, packedSequenceFilePath)
+    os.replace(temporaryIndexFilePath, packedIndexFilePath)
+
+
+class PackedGenome:
+
+    def __init__(self, packedSequenceFilePath, packedIndexFilePath):
+
+        # Read in the offset and length of every chromosome.
+        self.chromosomeIndex: Dict[str, Tuple[int, int]] = dict()
+        with open(packedIndexFilePath, 'r') as packedIndexFile:
+            for line in packedIndexFile:
+                chromosome, offset, length = line.strip().split('\t')
+                self.chromosomeIndex[chromosome] = (int(offset), int(length))
+
+        # Memory-map the sequences.  (Empty files can't be mapped, but then there's nothing to look up anyway.)
+        if os.path.getsize(packedSequenceFilePath) > 0:
+            self.sequences = np.memmap(packedSequenceFilePath, dtype = np.uint8, mode = 'r')
+        else: self.sequences = np.zeros(0, dtype = np.uint8)
+
+
+    # Returns the length of the given chromosome, or None if the chromosome is not in the genome.
+    def getChromosomeLength(self, chromosome):
+        if chromosome not in self.chromosomeIndex: return None
+        return self.chromosomeIndex[chromosome][1]
+
+
+    # Returns the plus strand sequence between the given 0-based start and 1-based end positions as a read-only
+    # uint8 array view of the mapped genome (no copying), or None if the positions are not valid for the chromosome.
+    def fetchArray(self, chromosome, start, end):
+
+        if chromosome not in self.chromosomeIndex: return None
+        offset, length = self.chromosomeIndex[chromosome]
+        if start < 0 or end > length or start > end: return None
+
+        return self.sequences[offset + start:offset + end]
+
+
+    # Returns the sequence between the given 0-based start and 1-based end positions on the given strand as a string,
+    # or None if the positions are not valid for the chromosome (mirroring bedtools getfasta, which skips such entries).
+    # Minus strand sequences are reverse complemented.
+    def fetch(self, chromosome, start, end, strand = '+'):
+
+        sequenceArray = self.fetchArray(chromosome, start, end)
+        if sequenceArray is None: return None
+
+        sequence = sequenceArray.tobytes()
+        if strand == '-': sequence = sequence.translate(COMPLEMENT_TABLE)[::-1]
+
+        return sequence.decode()
+
+
+# Returns the packed genome for the given genome fasta file, generating it first if necessary.
+# Packed genomes are cached so that each one is only opened once per process.
+@lru_cache(maxsize = None)
+def getPackedGenome(genomeFilePath) -> PackedGenome:
+
+    packedSequenceFilePath, packedIndexFilePath = getPackedGenomeFilePaths(genomeFilePath)
+
+    with generationLock(packedSequenceFilePath):
+        if not (os.path.exists(packedSequenceFilePath) and os.path.exists(packedIndexFilePath)):
+            generatePackedGenome(genomeFilePath)
+
+    return PackedGenome(packedSequenceFilePath, packedIndexFilePath)
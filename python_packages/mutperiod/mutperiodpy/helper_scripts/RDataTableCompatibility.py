@@ -0,0 +1,67 @@
+# This script reads and writes tab-separated tables the same way the R scripts do through data.table's fread and fwrite,
+# so that Python replacements for R steps produce interchangeable files.
+# Columns whose values are all whole numbers are read as integers (like fread), and doubles are written with up to
+# 15 significant digits in whichever of fixed or scientific notation is shorter, preferring fixed notation (like fwrite).
+import math
+from typing import Dict
+import numpy as np
+
+
+# Returns the given double as a string, formatted the way fwrite formats it.
+def formatDouble(value: float):
+
+    if math.isnan(value): return ''
+    if math.isinf(value): return "Inf" if value > 0 else "-Inf"
+    if value == 0: return '0'
+
+    sign = '-' if value < 0 else ''
+
+    # Get the (up to) 15 significant digits and the exponent.
+    mantissa, exponent = "{:.14e}".format(abs(value)).split('e')
+    digits = mantissa.replace('.', '').rstrip('0')
+    exponent = int(exponent)
+
+    # Determine the width of each notation.
+    if exponent >= 0: fixedWidth = max(len(digits), exponent + 1) + (len(digits) > exponent + 1)
+    else: fixedWidth = len(digits) - exponent + 1
+    scientificWidth = len(digits) + (len(digits) > 1) + 2 + max(2, len(str(abs(exponent))))
+
+    if fixedWidth <= scientificWidth:
+        if exponent >= 0:
+            if len(digits) > exponent + 1: return sign + digits[:exponent + 1] + '.' + digits[exponent + 1:]
+            else: return sign + digits + '0'*(exponent + 1 - len(digits))
+        else: return sign + "0." + '0'*(-exponent - 1) + digits
+
+    else:
+        scientificMantissa = digits[0] + ('.' + digits[1:] if len(digits) > 1 else '')
+        return sign + scientificMantissa + 'e' + ('-' if exponent < 0 else '+') + str(abs(exponent)).zfill(2)
+
+
+# Reads the given tab-separated table with a header line and returns its columns by header, in order.
+def readDataTable(filePath) -> Dict[str, np.ndarray]:
+
+    with open(filePath, 'r') as dataTableFile:
+        headers = dataTableFile.readline().rstrip('\r\n').split('\t')
+        rows = [line.rstrip('\r\n').split('\t') for line in dataTableFile if line.strip()]
+
+    columns = dict()
+    for i, header in enumerate(headers):
+        values = [row[i] for row in rows]
+        try: columns[header] = np.array([int(value) for value in values], dtype = np.int64)
+        except ValueError: columns[header] = np.array([float(value) for value in values], dtype = np.float64)
+
+    return columns
+
+
+# Writes the given columns (by header, in order) to a tab-separated table with a header line.
+# Integer and string columns are written as is.
+def writeDataTable(filePath, columns: Dict[str, np.ndarray]):
+
+    formattedColumns = list()
+    for column in columns.values():
+        if np.issubdtype(column.dtype, np.floating): formattedColumns.append([formatDouble(value) for value in column.tolist()])
+        else: formattedColumns.append([str(value) for value in column.tolist()])
+
+    with open(filePath, 'w') as dataTableFile:
+        dataTableFile.write('\t'.join(columns) + '\n')
+        for row in zip(*formattedColumns): dataTableFile.write('\t'.join(row) + '\n')
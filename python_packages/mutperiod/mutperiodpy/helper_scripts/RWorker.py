@@ -0,0 +1,175 @@
+# This script manages a persistent R worker: a long-lived Rscript session (running RWorker.R) which runs mutperiod's
+# R scripts as jobs, so that R's startup and package loading are only paid once per Python process.
+# Jobs are written to the worker's stdin as tab-separated lines (job ID, script path, arguments), and the worker reports
+# each job's status on stdout, on its own line containing the status prefix.  Everything else the scripts print is passed through.
+# If the worker stops unexpectedly while running a job, the job fails and the worker is restarted for the next job.
+# (Jobs that could not be sent to a stopped worker are sent again to the restarted worker.)
+# Each process gets its own worker, so jobs from parallel pipelines never share an R session.
+import os, sys, subprocess, tempfile, threading, queue, time, atexit
+from typing import Dict
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import rScriptsDirectory
+
+
+R_WORKER_STATUS_PREFIX = "<<mutperiod R worker>>"
+
+# How often (in seconds) to check that the worker is still alive while waiting for a job's output.
+LIVENESS_CHECK_INTERVAL = 5
+
+
+class RWorker:
+
+    def __init__(self):
+
+        self.process: subprocess.Popen = None
+        self.jobNum = 0
+        self.lock = threading.Lock()
+
+
+    # Starts a new Rscript session running the worker script, along with a thread which queues up its output lines.
+    def start(self):
+
+        self.process = subprocess.Popen(("Rscript", os.path.join(rScriptsDirectory, "RWorker.R")),
+                                        stdin = subprocess.PIPE, stdout = subprocess.PIPE, text = True, bufsize = 1)
+        self.outputLines = queue.Queue()
+        threading.Thread(target = self.queueOutputLines, args = (self.process.stdout, self.outputLines), daemon = True).start()
+
+
+    # Puts each of the given output lines in the given queue, followed by None once the output ends.
+    @staticmethod
+    def queueOutputLines(output, outputLines: queue.Queue):
+        for line in output: outputLines.put(line)
+        outputLines.put(None)
+
+
+    def isRunning(self):
+        return self.process is not None and self.process.poll() is None
+
+
+    # Reads the worker's output until the given job's status is reported, passing through any other output.
+    # (The worker starts each status on a new line, so output without a trailing newline is passed through ahead of it,
+    # and the empty line this leaves after output that did end in a newline is dropped.)
+    # Returns the status and error message, or None if the worker stopped first.
+    # If the job takes longer than the given timeout (in seconds), the worker is stopped and a TimeoutExpired error is raised.
+    def waitForJob(self, jobID, scriptFilePath, timeout = None):
+
+        startTime = time.monotonic()
+        heldBlankLine = False
+
+        while True:
+
+            if timeout is not None and time.monotonic() - startTime > timeout:
+                self.close()
+                raise subprocess.TimeoutExpired(("Rscript", scriptFilePath), timeout)
+
+            # Check that the worker is still alive whenever it goes quiet for a while.
+            try: line = self.outputLines.get(timeout = LIVENESS_CHECK_INTERVAL)
+            except queue.Empty:
+                if not self.isRunning() and self.outputLines.empty(): return None
+                continue
+
+            if line is None: return None
+
+            statusStart = line.find(R_WORKER_STATUS_PREFIX)
+            if statusStart == -1:
+                if heldBlankLine: print()
+                heldBlankLine = line == '\n'
+                if not heldBlankLine: print(line, end = '')
+                continue
+
+            if statusStart > 0: print(line[:statusStart])
+            heldBlankLine = False
+            status, statusJobID, errorMessage = line[statusStart + len(R_WORKER_STATUS_PREFIX):].rstrip('\n').split('\t', 2)
+            if statusJobID == jobID: return status, errorMessage
+
+
+    # Runs the given R script with the given arguments, the same way "Rscript scriptFilePath args..." would.
+    # Raises a CalledProcessError if the script fails (or the worker stops while running it), or a TimeoutExpired error
+    # if it takes longer than the given timeout (in seconds).
+    def runScript(self, scriptFilePath, *args: str, timeout = None):
+
+        job = (scriptFilePath,) + tuple(str(arg) for arg in args)
+        for field in job:
+            if '\t' in field or '\n' in field or field == '':
+                raise ValueError("R worker job arguments must be non-empty and cannot contain tabs or newlines.  Given: " + repr(field))
+
+        with self.lock:
+
+            for _ in range(2):
+
+                if not self.isRunning():
+                    self.close()
+                    self.start()
+
+                self.jobNum += 1
+                jobID = str(self.jobNum)
+                try:
+                    self.process.stdin.write('\t'.join((jobID,) + job) + '\n')
+                    self.process.stdin.flush()
+                except (BrokenPipeError, OSError):
+                    # The job never reached the worker, so it is safe to send it again after restarting.
+                    self.close()
+                    continue
+                break
+
+            else: raise subprocess.CalledProcessError(1, ("Rscript",) + job, output = "The R worker could not be started.")
+
+            result = self.waitForJob(jobID, scriptFilePath, timeout)
+
+            if result is None:
+                stoppedProcess = self.process
+                self.close()
+                exitStatus = stoppedProcess.wait()
+                errorMessage = (f"The R worker stopped (exit status {exitStatus}) while running {os.path.basename(scriptFilePath)}.  "
+                                "It will be restarted for the next job.")
+                sys.stderr.write(errorMessage + '\n')
+                raise subprocess.CalledProcessError(exitStatus, ("Rscript",) + job, output = errorMessage)
+
+            status, errorMessage = result
+            if status == "DONE": return
+
+            # Show the R error, like Rscript would have on stderr, before raising.
+            sys.stderr.write(f"Error in {os.path.basename(scriptFilePath)}: {errorMessage}\n")
+            raise subprocess.CalledProcessError(1, ("Rscript",) + job, output = errorMessage)
+
+
+    # Stops the worker (if it is running).
+    def close(self):
+
+        if self.process is None: return
+
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout = 10)
+        except (OSError, subprocess.TimeoutExpired): self.process.kill()
+        self.process = None
+
+
+# The R worker for each process (by process ID), so that forked processes never share their parent's worker.
+rWorkers: Dict[int, RWorker] = dict()
+
+
+# Returns the R worker for the current process, creating it if necessary.
+def getRWorker() -> RWorker:
+
+    processID = os.getpid()
+    if processID not in rWorkers:
+        rWorkers[processID] = RWorker()
+        atexit.register(rWorkers[processID].close)
+
+    return rWorkers[processID]
+
+
+# Runs the R script with the given name (in the run_mutperiodR directory) with the given arguments using this process's R worker.
+def runRScript(scriptName, *args, timeout = None):
+    getRWorker().runScript(os.path.join(rScriptsDirectory, scriptName), *args, timeout = timeout)
+
+
+# Returns the path to a new, uniquely named file for passing inputs to an R script.
+# (Unlike a single shared inputs file, this is safe when multiple pipelines run at once.)
+# The caller should remove the file when the script is finished with it.
+def getRInputsFilePath():
+
+    inputsFileDescriptor, inputsFilePath = tempfile.mkstemp(prefix = "R_inputs_", suffix = ".txt",
+                                                            dir = os.path.join(os.getenv("HOME"), ".mutperiod"))
+    os.close(inputsFileDescriptor)
+    return inputsFilePath
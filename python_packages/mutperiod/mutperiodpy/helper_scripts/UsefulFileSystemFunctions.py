@@ -1,10 +1,16 @@
 # This script contains various functions that I think will often be useful when managing filesystems for projects.
 
-import os, datetime, subprocess
+import os, datetime
+from contextlib import contextmanager
+from functools import lru_cache
 from enum import Enum
 from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs, getIsolatedParentDir
 from benbiohelpers.CustomErrors import UserInputError, InvalidPathError, MetadataPathError, checkIfPathExists
 
+# File locking is only available on Unix-like systems.  Elsewhere, generation locks do nothing.
+try: import fcntl
+except ImportError: fcntl = None
+
 
 # This function serves as the interface for the CLI to create a new data directory
 def parseArgsForNewDataDirectory(args):
@@ -168,6 +174,34 @@ def getAcceptableChromosomes(genomeFilePath: str, returnFilePathInstead = False)
             return [line.strip() for line in acceptableChromosomesFile]
 
 
+# A context manager that holds an exclusive lock tied to the given file path (through a ".lock" file beside it) so that
+# only one process at a time can generate that file.  Other processes wait for the lock to be released, so they should check
+# whether the file exists only after acquiring the lock.
+# The lock file is removed when the lock is released.  (A process that was waiting on a removed lock file finds that it is
+# no longer the one at the lock file path once it acquires it, and tries again with a new one.)
+@contextmanager
+def generationLock(filePath):
+
+    if fcntl is None:
+        yield
+        return
+
+    lockFilePath = filePath + ".lock"
+
+    while True:
+        lockFile = open(lockFilePath, 'w')
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try: lockedFileIsCurrent = os.path.samestat(os.fstat(lockFile.fileno()), os.stat(lockFilePath))
+        except FileNotFoundError: lockedFileIsCurrent = False
+        if lockedFileIsCurrent: break
+        lockFile.close()
+
+    try: yield
+    finally:
+        os.remove(lockFilePath)
+        lockFile.close()
+
+
 # Returns the context associated with a given file path as lowercase text (or an int if specified), or none if there is none.
 def getContext(filePath: str, asInt = False):
 
@@ -248,31 +282,52 @@ def checkForNucGroup(filePath: str):
     return "nuc-group" in fileName
 
 
-# Retrieve the expected periods for each of the given counts files, generating them as necessary.
-def getExpectedPeriod(nucleosomeMutationCountsFilePath):
+# Returns the base nucleosome map file path for the data group in the given directory.
+# Cached, since many counts files share a data group directory, and reading its metadata also means finding the data directory.
+@lru_cache(maxsize = None)
+def getDataGroupNucPosFilePath(dataGroupDirectory):
+    return Metadata(dataGroupDirectory).baseNucPosFilePath
 
-    # If this file uses a nuc-group radius (1000bp) the expected period must be determined empirically from the nucleosome map
-    if checkForNucGroup(nucleosomeMutationCountsFilePath):
 
-        nucMapFilePath = Metadata(nucleosomeMutationCountsFilePath).baseNucPosFilePath
-        nucMapRepeatLengthFilePath = nucMapFilePath.rsplit('.',1)[0] + "_repeat_length.txt"
+# Returns the nucleosome repeat length for the given nucleosome map, generating it first if necessary.
+# Repeat lengths are cached, so each nucleosome map's repeat length file is only read (or generated) once per process.
+@lru_cache(maxsize = None)
+def getNucleosomeRepeatLength(nucMapFilePath):
 
-        # If the file containing the nucleosome repeat length has not been generated, generate it!
+    nucMapRepeatLengthFilePath = nucMapFilePath.rsplit('.',1)[0] + "_repeat_length.txt"
+
+    # If the file containing the nucleosome repeat length has not been generated, generate it!
+    # (Only one process at a time should run the self-counting and R script for a given nucleosome map.)
+    with generationLock(nucMapRepeatLengthFilePath):
         if not os.path.exists(nucMapRepeatLengthFilePath):
 
-            # Import the counting function here.  (Importing at the top of the script creates a circular reference)
+            # Import the counting function and R worker here.  (Importing at the top of the script creates a circular reference)
             from mutperiodpy.CountNucleosomePositionMutations import countNucleosomePositionMutations
+            from mutperiodpy.helper_scripts.RWorker import runRScript
 
             print("No repeat length file found for nucleosome map ",os.path.basename(nucMapFilePath),".  Generating...", sep = '')
             nucMapSelfCountsFilePath = countNucleosomePositionMutations((nucMapFilePath,), (getIsolatedParentDir(nucMapFilePath),),
                                                                         None, None, None)[0]
-            subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"GetNucleosomeRepeatLength.R"),
-                            nucMapSelfCountsFilePath, nucMapRepeatLengthFilePath), check = True)
+            runRScript("GetNucleosomeRepeatLength.R", nucMapSelfCountsFilePath, nucMapRepeatLengthFilePath)
+
+    # Retrieve the repeat length for the nucleosome map.
+    with open(nucMapRepeatLengthFilePath, 'r') as nucMapRepeatLengthFile:
+        return float(nucMapRepeatLengthFile.readline().strip())
+
+
+# Retrieve the expected periods for each of the given counts files, generating them as necessary.
+def getExpectedPeriod(nucleosomeMutationCountsFilePath):
+
+    # If this file uses a nuc-group radius (1000bp) the expected period must be determined empirically from the nucleosome map
+    if checkForNucGroup(nucleosomeMutationCountsFilePath):
+
+        # Make sure the given file path exists (as Metadata would), since the metadata lookup may be cached.
+        if not os.path.exists(nucleosomeMutationCountsFilePath):
+            raise MetadataPathError(nucleosomeMutationCountsFilePath, "Given path to retrieve metadata from does not exist: ")
+
+        dataGroupDirectory = os.path.dirname(os.path.abspath(nucleosomeMutationCountsFilePath))
+        return getNucleosomeRepeatLength(getDataGroupNucPosFilePath(dataGroupDirectory))
 
-        # Retrieve the repeat length for the nucleosome map.
-        with open(nucMapRepeatLengthFilePath, 'r') as nucMapRepeatLengthFile:
-            return float(nucMapRepeatLengthFile.readline().strip())
-            
     # Otherwise, this file uses a single nucleosome radius, and the expected period is simply 10.2
     else: return 10.2
 
@@ -1,8 +1,8 @@
 # This script takes stratified mutation data and uses it to generate an input file for the MSIseq R package which
 # then generates a list of MSI cohorts.
 
-import subprocess, os
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import rScriptsDirectory
+import os
+from mutperiodpy.helper_scripts.RWorker import runRScript
 
 
 class MSIIdentifier:
@@ -48,8 +48,7 @@ class MSIIdentifier:
         self.MSISeqInputDataFile.close()
 
         if verbose: print("Calling MSIseq to generate MSI donor list...")
-        subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"FindMSIDonors.R"),
-                        self.MSISeqInputDataFilePath, self.MSICohortsFilePath), check = True)
+        runRScript("FindMSIDonors.R", self.MSISeqInputDataFilePath, self.MSICohortsFilePath)
 
         self.MSICohortsIdentified = True
     
@@ -1,8 +1,7 @@
 # This script takes stratified mutation data and uses it to generate an input file for the deconstructSigs R package which
 # then assigns the most prominent mutation signature(s) for each cohort.
 
-import subprocess, os
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import rScriptsDirectory
+from mutperiodpy.helper_scripts.RWorker import runRScript
 
 
 class MutSigIdentifier:
@@ -45,8 +44,7 @@ class MutSigIdentifier:
         self.deconstructSigsInputDataFile.close()
 
         if verbose: print("Calling deconstructSigs to identify mutation signatures")
-        subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"GetMutSigs.R"),
-                        self.deconstructSigsInputDataFilePath, self.deconstructSigsOutputFilePath), check = True)
+        runRScript("GetMutSigs.R", self.deconstructSigsInputDataFilePath, self.deconstructSigsOutputFilePath)
 
         self.mutSigsIdentified = True
     
@@ -0,0 +1,378 @@
+# This script contains a shared layer for reading input files, which may be plain text, gzipped, or BGZF-compressed
+# (bgzipped).  BGZF blocks are decompressed by multiple threads at once, and if a bgzipped file has a tabix index
+# alongside it (e.g. "mutations.vcf.gz.tbi"), only the lines on the requested chromosomes or regions are decompressed.
+
+import os, io, gzip, zlib, struct, shutil, signal, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple
+
+
+# Faster (e.g. multithreaded) gzip implementations which are used to decompress (non-BGZF) gzipped files if they are installed.
+FAST_DECOMPRESSORS = ("pigz", "igzip")
+
+# File extensions which denote compressed input.
+COMPRESSED_FILE_EXTENSIONS = (".gz", ".bgz")
+
+# The number of BGZF blocks (each holding up to 64 KB of data) that are read and decompressed together,
+# and the maximum number of threads used to decompress them by default.
+BGZF_BLOCK_BATCH_NUM = 64
+MAX_DEFAULT_DECOMPRESSION_THREADS = 4
+
+
+class Compression(Enum):
+
+    plain = "plain"
+    gzip = "gzip"
+    bgzf = "bgzf"
+
+
+# Determines how the given file is compressed from its first few bytes.
+def getCompression(filePath) -> Compression:
+
+    with open(filePath, "rb") as inputFile: header = inputFile.read(18)
+
+    if header[:2] != b"\x1f\x8b": return Compression.plain
+    # BGZF files are gzip files whose header has an "extra" field with a "BC" subfield.
+    elif len(header) == 18 and header[3] & 4 and header[12:14] == b"BC": return Compression.bgzf
+    else: return Compression.gzip
+
+
+# Returns the given file name with any compression extension (e.g. ".gz") removed.
+def getUncompressedFileName(filePath):
+
+    fileName = os.path.basename(filePath)
+    for compressedFileExtension in COMPRESSED_FILE_EXTENSIONS:
+        if fileName.endswith(compressedFileExtension): return fileName[:-len(compressedFileExtension)]
+    return fileName
+
+
+# Returns the path to the tabix index for the given file, or None if the file is not bgzipped or has no index.
+def getTabixIndexFilePath(filePath):
+
+    indexFilePath = filePath + ".tbi"
+    if os.path.exists(indexFilePath) and getCompression(filePath) == Compression.bgzf: return indexFilePath
+    else: return None
+
+
+def getDefaultDecompressionThreads():
+    return min(MAX_DEFAULT_DECOMPRESSION_THREADS, os.cpu_count() or 1)
+
+
+def decompressRawDeflate(compressedData: bytes):
+    return zlib.decompress(compressedData, -15)
+
+
+# Reads the blocks of a BGZF file, decompressing batches of blocks across multiple threads if requested.
+# Positions within the file are given as "virtual offsets": the offset of a block in the (compressed) file,
+# shifted 16 bits to the left, plus the offset within the block's decompressed data.
+class BGZFReader:
+
+    def __init__(self, filePath, threads = 1):
+
+        self.file = open(filePath, "rb")
+        if threads > 1: self.executor = ThreadPoolExecutor(max_workers = threads)
+        else: self.executor = None
+
+
+    # Functions for "with" compatibility.
+    def __enter__(self): return self
+
+    def __exit__(self, type, value, tb): self.close()
+
+
+    def close(self):
+        self.file.close()
+        if self.executor is not None: self.executor.shutdown()
+
+
+    # Reads the (compressed) block at the current position in the file.
+    # Returns the block's offset and its raw deflate data, or None at the end of the file.
+    def readRawBlock(self):
+
+        blockOffset = self.file.tell()
+        header = self.file.read(12)
+        if len(header) == 0: return None
+        if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+            raise ValueError(f"Invalid BGZF block header at byte {blockOffset} of {self.file.name}")
+
+        # Find the total block size in the "BC" subfield of the extra field.
+        extraLength = struct.unpack_from("<H", header, 10)[0]
+        extra = self.file.read(extraLength)
+        blockSize = None
+        subfieldPosition = 0
+        while subfieldPosition < extraLength:
+            subfieldLength = struct.unpack_from("<H", extra, subfieldPosition + 2)[0]
+            if extra[subfieldPosition:subfieldPosition + 2] == b"BC":
+                blockSize = struct.unpack_from("<H", extra, subfieldPosition + 4)[0] + 1
+            subfieldPosition += 4 + subfieldLength
+        if blockSize is None: raise ValueError(f"BGZF block at byte {blockOffset} of {self.file.name} has no size.")
+
+        # The remainder of the block is the compressed data, followed by the CRC32 and uncompressed size (4 bytes each).
+        return blockOffset, self.file.read(blockSize - 12 - extraLength)[:-8]
+
+
+    # Yields the offset and decompressed data of each block, starting with the block at the given offset.
+    def iterateBlocks(self, startBlockOffset = 0):
+
+        self.file.seek(startBlockOffset)
+
+        while True:
+
+            rawBlocks: List[Tuple[int, bytes]] = list()
+            for _ in range(BGZF_BLOCK_BATCH_NUM):
+                rawBlock = self.readRawBlock()
+                if rawBlock is None: break
+                rawBlocks.append(rawBlock)
+            if len(rawBlocks) == 0: return
+
+            compressedData = [rawBlock[1] for rawBlock in rawBlocks]
+            if self.executor is None: decompressedData = map(decompressRawDeflate, compressedData)
+            else: decompressedData = self.executor.map(decompressRawDeflate, compressedData)
+
+            yield from zip((rawBlock[0] for rawBlock in rawBlocks), decompressedData)
+
+
+    # Yields each line that starts at or after the given virtual offset and before the given end virtual offset
+    # (or the end of the file).
+    def iterateLines(self, startVirtualOffset = 0, endVirtualOffset = None):
+
+        startBlockOffset = startVirtualOffset >> 16
+        partialLine = b''
+        partialLineStart = None
+
+        for blockOffset, data in self.iterateBlocks(startBlockOffset):
+
+            if blockOffset == startBlockOffset: position = startVirtualOffset & 0xFFFF
+            else: position = 0
+
+            while True:
+
+                lineEnd = data.find(b'\n', position)
+                if lineEnd == -1: break
+
+                if len(partialLine) > 0: lineStart = partialLineStart
+                else: lineStart = blockOffset << 16 | position
+                if endVirtualOffset is not None and lineStart >= endVirtualOffset: return
+
+                yield (partialLine + data[position:lineEnd + 1]).decode()
+                partialLine = b''
+                position = lineEnd + 1
+
+            if position < len(data):
+                if len(partialLine) == 0: partialLineStart = blockOffset << 16 | position
+                partialLine += data[position:]
+
+        if len(partialLine) > 0 and (endVirtualOffset is None or partialLineStart < endVirtualOffset):
+            yield partialLine.decode()
+
+
+# A raw, readable stream of a BGZF file's decompressed data, which can be buffered and wrapped like any other binary file.
+class BGZFRawStream(io.RawIOBase):
+
+    def __init__(self, reader: BGZFReader):
+
+        self.reader = reader
+        self.blocks = (data for _, data in reader.iterateBlocks())
+        self.pendingData = memoryview(b'')
+
+
+    def readable(self): return True
+
+
+    def readinto(self, buffer):
+
+        while len(self.pendingData) == 0:
+            data = next(self.blocks, None)
+            if data is None: return 0
+            self.pendingData = memoryview(data)
+
+        size = min(len(buffer), len(self.pendingData))
+        buffer[:size] = self.pendingData[:size]
+        self.pendingData = self.pendingData[size:]
+        return size
+
+
+    def close(self):
+        if not self.closed: self.reader.close()
+        super().close()
+
+
+# This class reads a tabix index (.tbi file), which maps the chromosomes and regions of a sorted, bgzipped file
+# to the virtual offsets of the lines within them.
+class TabixIndex:
+
+    # The number of bases covered by each entry in a chromosome's linear index.
+    LINEAR_INDEX_WINDOW_SHIFT = 14
+
+    # A pseudo-bin which holds metadata (mapped/unmapped counts) instead of chunks.
+    METADATA_BIN = 37450
+
+    def __init__(self, indexFilePath):
+
+        with gzip.open(indexFilePath, "rb") as indexFile: indexData = indexFile.read()
+        if indexData[:4] != b"TBI\x01": raise ValueError(f"{indexFilePath} is not a tabix index.")
+
+        (referenceNum, self.format, self.sequenceColumn, self.beginColumn, self.endColumn,
+         metaCharacter, self.skippedLineNum, namesLength) = struct.unpack_from("<8i", indexData, 4)
+        self.metaCharacter = chr(metaCharacter)
+        self.isZeroBased = bool(self.format & 0x10000)
+        self.isVCF = self.format & 0xFFFF == 2
+
+        position = 36
+        self.referenceNames = indexData[position:position + namesLength].decode().split('\0')[:referenceNum]
+        position += namesLength
+
+        # For each reference (chromosome): a dictionary of bins to their chunks (pairs of virtual offsets),
+        # and a linear index of the lowest virtual offset in each window.
+        self.bins: Dict[str, Dict[int, List[Tuple[int, int]]]] = dict()
+        self.linearIndices: Dict[str, Tuple[int]] = dict()
+
+        for referenceName in self.referenceNames:
+
+            binNum = struct.unpack_from("<i", indexData, position)[0]
+            position += 4
+            referenceBins = dict()
+            for _ in range(binNum):
+                binID, chunkNum = struct.unpack_from("<Ii", indexData, position)
+                position += 8
+                chunkOffsets = struct.unpack_from(f"<{chunkNum*2}Q", indexData, position)
+                position += 16*chunkNum
+                if binID != self.METADATA_BIN: referenceBins[binID] = list(zip(chunkOffsets[::2], chunkOffsets[1::2]))
+            self.bins[referenceName] = referenceBins
+
+            intervalNum = struct.unpack_from("<i", indexData, position)[0]
+            position += 4
+            self.linearIndices[referenceName] = struct.unpack_from(f"<{intervalNum}Q", indexData, position)
+            position += 8*intervalNum
+
+
+    # Returns the bins that may contain features overlapping the given (0-based, half-open) region.
+    @staticmethod
+    def getRegionBins(start, end):
+
+        end -= 1
+        regionBins = [0]
+        for shift, firstBin in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+            regionBins += range(firstBin + (start >> shift), firstBin + (end >> shift) + 1)
+        return regionBins
+
+
+    # Returns the sorted, non-overlapping chunks (pairs of virtual offsets) that contain every line on the given chromosome
+    # overlapping the given (0-based, half-open) region.  If no end is given, the whole chromosome (from start) is covered.
+    def getChunks(self, chromosome, start = 0, end = None) -> List[Tuple[int, int]]:
+
+        if chromosome not in self.bins: return list()
+        referenceBins = self.bins[chromosome]
+
+        if end is None: candidateBins = referenceBins.keys()
+        else: candidateBins = self.getRegionBins(start, end)
+
+        # Chunks ending before the lowest offset in the region's linear index window can't overlap the region.
+        linearIndex = self.linearIndices[chromosome]
+        if len(linearIndex) == 0: minOffset = 0
+        else: minOffset = linearIndex[min(start >> self.LINEAR_INDEX_WINDOW_SHIFT, len(linearIndex) - 1)]
+
+        chunks = sorted(chunk for candidateBin in candidateBins for chunk in referenceBins.get(candidateBin, ())
+                        if chunk[1] > minOffset)
+
+        mergedChunks: List[Tuple[int, int]] = list()
+        for chunkStart, chunkEnd in chunks:
+            if len(mergedChunks) > 0 and chunkStart <= mergedChunks[-1][1]:
+                mergedChunks[-1] = (mergedChunks[-1][0], max(mergedChunks[-1][1], chunkEnd))
+            else: mergedChunks.append((chunkStart, chunkEnd))
+
+        return mergedChunks
+
+
+    # Determines whether or not the given line is on the given chromosome and overlaps the given (0-based, half-open) region.
+    def lineOverlapsRegion(self, line: str, chromosome, start = 0, end = None):
+
+        choppedUpLine = line.rstrip('\r\n').split('\t')
+        if choppedUpLine[self.sequenceColumn - 1] != chromosome: return False
+        if start == 0 and end is None: return True
+
+        lineStart = int(choppedUpLine[self.beginColumn - 1])
+        if not self.isZeroBased: lineStart -= 1
+
+        if self.isVCF: lineEnd = lineStart + len(choppedUpLine[3])
+        elif self.endColumn > 0: lineEnd = int(choppedUpLine[self.endColumn - 1])
+        else: lineEnd = lineStart + 1
+
+        return lineEnd > start and (end is None or lineStart < end)
+
+
+# Yields the lines in the given bgzipped file that are on the given chromosomes or overlap the given regions,
+# using the file's tabix index to find them.  Regions are given as (chromosome, 0-based start, end) tuples,
+# where an end of None denotes the rest of the chromosome.  Meta (header) lines are not included.
+def iterateIndexedLines(filePath, indexFilePath, chromosomes: Iterable[str] = None,
+                        regions: Iterable[Tuple[str, int, int]] = None, threads = 1):
+
+    tabixIndex = TabixIndex(indexFilePath)
+    if regions is None: regions = list()
+    else: regions = list(regions)
+    if chromosomes is not None:
+        chromosomes = set(chromosomes)
+        regions += [(chromosome, 0, None) for chromosome in tabixIndex.referenceNames if chromosome in chromosomes]
+
+    with BGZFReader(filePath, threads) as reader:
+        for chromosome, start, end in regions:
+            for chunkStart, chunkEnd in tabixIndex.getChunks(chromosome, start, end):
+                for line in reader.iterateLines(chunkStart, chunkEnd):
+                    if not line.startswith(tabixIndex.metaCharacter) and tabixIndex.lineOverlapsRegion(line, chromosome, start, end):
+                        yield line
+
+
+# Opens a binary stream of the given file's (decompressed) contents.
+# BGZF files are decompressed by the given number of threads (by default, up to MAX_DEFAULT_DECOMPRESSION_THREADS).
+# Other gzipped files are decompressed in a separate process if one of the FAST_DECOMPRESSORS is installed,
+# or by Python's gzip module otherwise.
+@contextmanager
+def openInputStream(filePath, threads = None):
+
+    if threads is None: threads = getDefaultDecompressionThreads()
+    compression = getCompression(filePath)
+
+    if compression == Compression.plain:
+        with open(filePath, "rb") as inputFile: yield inputFile
+
+    elif compression == Compression.bgzf:
+        with io.BufferedReader(BGZFRawStream(BGZFReader(filePath, threads)), buffer_size = 2**20) as inputFile:
+            yield inputFile
+
+    else:
+
+        decompressor = next((decompressor for decompressor in FAST_DECOMPRESSORS if shutil.which(decompressor) is not None), None)
+
+        if decompressor is None:
+            with gzip.open(filePath, "rb") as inputFile: yield inputFile
+
+        else:
+            with subprocess.Popen((decompressor, "-dc", filePath), stdout = subprocess.PIPE) as decompressionProcess:
+                yield decompressionProcess.stdout
+            # (The decompressor is terminated by SIGPIPE if its output isn't read to the end.)
+            if decompressionProcess.returncode not in (0, -signal.SIGPIPE):
+                raise subprocess.CalledProcessError(decompressionProcess.returncode, decompressionProcess.args)
+
+
+# Opens the given plain, gzipped, or bgzipped file for reading lines of text.  The result can be iterated over like a
+# file opened in text mode.  If the file is bgzipped and tabix-indexed, and chromosomes or regions are given
+# (see iterateIndexedLines), only the lines on those chromosomes or in those regions are read (excluding header lines).
+# Otherwise, chromosomes are ignored (every line is read), and regions cannot be given.
+@contextmanager
+def openInputFile(filePath, chromosomes: Iterable[str] = None, regions: Iterable[Tuple[str, int, int]] = None,
+                  threads = None):
+
+    if threads is None: threads = getDefaultDecompressionThreads()
+
+    if chromosomes is not None or regions is not None:
+        indexFilePath = getTabixIndexFilePath(filePath)
+        if indexFilePath is not None:
+            yield iterateIndexedLines(filePath, indexFilePath, chromosomes, regions, threads)
+            return
+        elif regions is not None:
+            raise ValueError(f"Regions can only be read from bgzipped, tabix-indexed files, but {filePath} has no tabix index.")
+
+    with openInputStream(filePath, threads) as inputStream:
+        with io.TextIOWrapper(inputStream, encoding = "utf-8") as inputFile: yield inputFile
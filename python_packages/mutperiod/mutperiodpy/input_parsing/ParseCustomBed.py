@@ -16,22 +16,39 @@
 #          in this column can be used to avoid assigning an entry to another cohort without breaking this rule.
 # The file is then converted to a format suitable for the rest of the package's analysis scripts.
 
-import os, subprocess, sys, shutil
+import os, re, subprocess, sys, shutil
+from contextlib import ExitStack
 from typing import List
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (getDataDirectory, getIsolatedParentDir, generateMetadata, checkDirs, 
-                                                                  DataTypeStr, InputFormat, getAcceptableChromosomes, generateFilePath,
-                                                                  rScriptsDirectory)
+                                                                  DataTypeStr, InputFormat, getAcceptableChromosomes, generateFilePath)
+from mutperiodpy.helper_scripts.RWorker import runRScript
 from mutperiodpy.helper_scripts.CustomErrors import *
+from mutperiodpy.helper_scripts.PackedGenome import getPackedGenome
 from benbiohelpers.FileSystemHandling.DirectoryHandling import getFilesInDirectory
-from benbiohelpers.FileSystemHandling.BedToFasta import bedToFasta
-from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
 from benbiohelpers.DNA_SequenceHandling import isPurine, reverseCompliment
 from mutperiodpy.input_parsing.WriteManager import WriteManager
+from mutperiodpy.input_parsing.IdentifyMSI import MSIIdentifier
+from mutperiodpy.input_parsing.IdentifyMutSigs import MutSigIdentifier
+from mutperiodpy.input_parsing.InputReading import openInputFile, getCompression, Compression, getUncompressedFileName
 from benbiohelpers.CustomErrors import *
 
 
+# Precompiled patterns for valid reference bases and mutations.  (Equivalent to checking that the given string is made up
+# of the given characters, so empty strings match too.)  The most common valid values are checked against a set first.
+REFERENCE_BASES_PATTERN = re.compile("[ACGTN]*")
+MUTATION_BASES_PATTERN = re.compile("[ACGT]*")
+COMMON_REFERENCE_BASES = frozenset(('A','C','G','T','N','*','.'))
+COMMON_MUTATIONS = frozenset(('A','C','G','T','*',"OTHER",'.'))
+
+# When input is trusted, the first TRUSTED_INPUT_CHECKED_LINE_NUM lines are checked for errors,
+# followed by one out of every TRUSTED_INPUT_SAMPLING_INTERVAL lines after that.
+TRUSTED_INPUT_CHECKED_LINE_NUM = 10000
+TRUSTED_INPUT_SAMPLING_INTERVAL = 100
+
+
 # Checks for common errors in a line of input.
+# acceptableChromosomes should be a set (or other quickly searchable container) of chromosome identifiers.
 def checkForErrors(choppedUpLine: List[str], cohortDesignationPresent, acceptableChromosomes, acceptableChromosomesFilePath):
 
     if len(choppedUpLine) < 6 or len(choppedUpLine) > 7:
@@ -39,34 +56,33 @@ def checkForErrors(choppedUpLine: List[str], cohortDesignationPresent, acceptabl
                          "Each entry should contain either 6 tab separated arguments or 7 (if a cohort designation is present. "
                          f"The line in question is:\n{chr(9).join(choppedUpLine)}")
 
-    if choppedUpLine[0] not in acceptableChromosomes:
-        raise UserInputError("Invalid chromosome identifier \"" + choppedUpLine[0] + "\" found.  "
+    chromosome, startPos, endPos, referenceBases, mutation, strand = choppedUpLine[:6]
+
+    if chromosome not in acceptableChromosomes:
+        raise UserInputError("Invalid chromosome identifier \"" + chromosome + "\" found.  "
                          "Expected chromosome in the set at: " + acceptableChromosomesFilePath)
 
     try:
-        float(choppedUpLine[1])
-        float(choppedUpLine[2])
+        regionLength = float(endPos) - float(startPos)
     except ValueError:
         raise UserInputError("Base positions should be numeric values.  "
-                         "The given coordinate pair, " + choppedUpLine[1] + ", " + choppedUpLine[2] + ' '
+                         "The given coordinate pair, " + startPos + ", " + endPos + ' '
                          "does not satisfy this condition.")
 
-    if float(choppedUpLine[2]) - float(choppedUpLine[1]) < 1:
+    if regionLength < 1:
         raise UserInputError("Base positions should specify a minimum range of 1 base.  "
                          "The first base coordinate should be 0-based and the second should be 1-based.  " 
-                         "The given coordinate pair, " + choppedUpLine[1] + ", " + choppedUpLine[2] + ' '
+                         "The given coordinate pair, " + startPos + ", " + endPos + ' '
                          "does not satisfy these conditions.")
 
-    if not {'A','C','G','T','N'}.issuperset(choppedUpLine[3]) and not choppedUpLine[3] in ('*','.'):
-        raise UserInputError("Invalid reference base(s): \"" + choppedUpLine[3] + "\".  Should be a string made up of the four DNA bases "
+    if (referenceBases not in COMMON_REFERENCE_BASES and REFERENCE_BASES_PATTERN.fullmatch(referenceBases) is None):
+        raise UserInputError("Invalid reference base(s): \"" + referenceBases + "\".  Should be a string made up of the four DNA bases "
                          "or \".\" to auto acquire the base(s) from the corresponding genome, or \"*\" to denote an insertion.")
 
-    regionLength = float(choppedUpLine[2]) - float(choppedUpLine[1])
-
     # Cases where insertion...
-    if choppedUpLine[3] == '*':
+    if referenceBases == '*':
 
-        if choppedUpLine[4] == '*':
+        if mutation == '*':
             raise UserInputError("The reference base and mutation columns are both set to \"*\".  "
                              "(Entry cannot be insertion and deletion simultaneously)")
 
@@ -77,16 +93,16 @@ def checkForErrors(choppedUpLine: List[str], cohortDesignationPresent, acceptabl
     # Cases where not insertion...
     else:
 
-        if choppedUpLine[3] != '.' and len(choppedUpLine[3]) < regionLength:
-            raise UserInputError("References base(s): \"" + choppedUpLine[3] + "\" do not at least span the given region from "
-                             "positions " + choppedUpLine[1] + " to " + choppedUpLine[2] + '.')
+        if referenceBases != '.' and len(referenceBases) < regionLength:
+            raise UserInputError("References base(s): \"" + referenceBases + "\" do not at least span the given region from "
+                             "positions " + startPos + " to " + endPos + '.')
 
-    if not {'A','C','G','T'}.issuperset(choppedUpLine[4]) and not choppedUpLine[4] in ('*',"OTHER", '.'):
-        raise UserInputError("Invalid mutation designation: \"" + choppedUpLine[3] + "\".  Should be a string made up of the four DNA bases "
+    if mutation not in COMMON_MUTATIONS and MUTATION_BASES_PATTERN.fullmatch(mutation) is None:
+        raise UserInputError("Invalid mutation designation: \"" + referenceBases + "\".  Should be a string made up of the four DNA bases "
                          "or \"*\" to denote a deletion, or \"OTHER\" or \'.\' to denote an some other alteration.")
 
-    if choppedUpLine[5] not in ('+','-','.'):
-        raise UserInputError("Invalid strand designation: \"" + choppedUpLine[5] + "\".  Should be \"+\" or \"-\", or \".\" "
+    if strand not in ('+','-','.'):
+        raise UserInputError("Invalid strand designation: \"" + strand + "\".  Should be \"+\" or \"-\", or \".\" "
                          "to auto acquire the base if possible.")
 
     if cohortDesignationPresent and len(choppedUpLine) == 6:
@@ -104,37 +120,113 @@ def checkForErrors(choppedUpLine: List[str], cohortDesignationPresent, acceptabl
                          "Use \".\" to denote an entry that does not belong to a cohort.")
 
 
-def equivalentEntries(fastaEntry: FastaFileIterator.FastaEntry, choppedUpLine):
+def isSingleBaseSubstitution(choppedUpLine):
+    return float(choppedUpLine[2]) - float(choppedUpLine[1]) == 1 and choppedUpLine[4] in ('A','C','G','T')
 
-    return(fastaEntry.chromosome == choppedUpLine[0] and
-           fastaEntry.startPos == choppedUpLine[1] and
-           fastaEntry.endPos == choppedUpLine[2] and
-           fastaEntry.strand == choppedUpLine[5])
+# Checks lines of custom bed input for errors and auto-acquires bases/strand designations where requested.
+# Also keeps track of the numerical nucleotide context of the features.
+# If the input is trusted, only a sample of lines is checked for errors (see TRUSTED_INPUT_CHECKED_LINE_NUM).
+class CustomBedLineChecker:
 
+    def __init__(self, genomeFilePath, onlySingleBaseSubs, includeIndels, trustedInput = False):
+
+        self.genomeFilePath = genomeFilePath
+        self.onlySingleBaseSubs = onlySingleBaseSubs
+        self.trustedInput = trustedInput
+        self.checkedLineNum = 0
+
+        # To start, assume that no sequences need to be acquired, and do it on the fly if need be.
+        self.autoAcquiring = False
+        self.packedGenome = None
+        self.cohortDesignationPresent = None
+
+        # Unless indels are included, determine the context of the feqtures in the file.
+        if includeIndels: self.context = 0
+        else: self.context = None
+
+        # Get the set of acceptable chromosomes
+        self.acceptableChromosomes = frozenset(getAcceptableChromosomes(genomeFilePath))
+        self.acceptableChromosomesFilePath = getAcceptableChromosomes(genomeFilePath, True)
+
+
+    # Retrieves the genome sequence for the given line, on its given strand (or the plus strand if none is given).
+    def fetchSequence(self, choppedUpLine):
+
+        try: sequence = self.packedGenome.fetch(choppedUpLine[0], int(choppedUpLine[1]), int(choppedUpLine[2]), choppedUpLine[5])
+        except ValueError: sequence = None
+
+        if sequence is None:
+            raise UserInputError("The given custom bed file has lines with auto-acquire requested "
+                                 "(symbolized by a '.' character), but the sequence for the following line could not be "
+                                 "retrieved from the given genome:\n" + '\t'.join(choppedUpLine))
+
+        return sequence
+
+
+    # Checks the format of the given entry and fills in any auto-acquire requests in place.
+    def checkLine(self, choppedUpLine: List[str]):
+
+        # If it isn't already, initialize the cohortDesignationPresent variable.
+        if self.cohortDesignationPresent is None: self.cohortDesignationPresent = len(choppedUpLine) == 7
+
+        # Check for possible error states.  (Only for a sample of lines if the input is trusted.)
+        self.checkedLineNum += 1
+        if (not self.trustedInput or self.checkedLineNum <= TRUSTED_INPUT_CHECKED_LINE_NUM or
+            self.checkedLineNum % TRUSTED_INPUT_SAMPLING_INTERVAL == 0):
+            checkForErrors(choppedUpLine, self.cohortDesignationPresent, self.acceptableChromosomes, self.acceptableChromosomesFilePath)
+
+        # If this is the first entry requiring auto-acquiring, retrieve the packed genome.
+        if (not self.autoAcquiring and (choppedUpLine[3] == '.' or choppedUpLine[4] == '.' or 
+            (choppedUpLine[5] == '.' and choppedUpLine[3] != '*'))):
+            print("Found line with auto-acquire requested.  Retrieving packed genome...")
+            self.autoAcquiring = True
+            self.packedGenome = getPackedGenome(self.genomeFilePath)
+            print("Continuing...")
+
+        # Check for any base identities that need to be auto-acquired.
+        if choppedUpLine[3] == '.':
+            choppedUpLine[3] = self.fetchSequence(choppedUpLine)
+
+        # Check for any strand designations that need to be auto-acquired.
+        # Also, make sure this isn't an insertion, in which case the strand designation cannot be determined.
+        if choppedUpLine[5] == '.' and choppedUpLine[3] != '*':
+
+            # Determine which strand is represented.
+            sequence = self.fetchSequence(choppedUpLine)
+            if sequence == choppedUpLine[3]: choppedUpLine[5] = '+'
+            elif sequence == reverseCompliment(choppedUpLine[3]): choppedUpLine[5] = '-'
+            else: assert False, ("The given sequence " + choppedUpLine[3] + " for location " + 
+                                 choppedUpLine[0] + ':' + choppedUpLine[1] + '-' + choppedUpLine[2] + ' ' +
+                                 "does not match the corresponding sequence in the given genome, or its reverse compliment.")
+
+        # Change any '.' characters in the "altered to" column to "OTHER"
+        if choppedUpLine[4] == '.': choppedUpLine[4] = "OTHER"
+
+        # Determine the sequence context of the line and whether or not it matches the sequence context for other.
+        # Skip this if the file is "mixed", this line is an indel, or only single base substitutions are allowed and this line isn't one.
+        if (not self.context == 0 and 
+            not (choppedUpLine[3] == '*' or choppedUpLine[4] == '*') and 
+            (not self.onlySingleBaseSubs or isSingleBaseSubstitution(choppedUpLine))):
+
+            thisContext = len(choppedUpLine[3])
+            if self.context is None: self.context = thisContext
+            elif thisContext != self.context: self.context = 0
+
+
+    # Returns the context of all the lines checked so far.
+    def getContext(self):
+        if self.context is not None and self.context > 6: return float("inf")
+        else: return self.context
 
-def isSingleBaseSubstitution(choppedUpLine):
-    return float(choppedUpLine[2]) - float(choppedUpLine[1]) == 1 and choppedUpLine[4] in ('A','C','G','T')
 
 # Checks each line for errors and auto acquire bases/strand designations where requested. 
 # Overwrites the original bed file if auto-acquiring occurred.
 # Also returns the numerical nucleotide context of the features.
-def autoAcquireAndQACheck(bedInputFilePath: str, genomeFilePath, autoAcquiredFilePath, onlySingleBaseSubs, includeIndels):
+def autoAcquireAndQACheck(bedInputFilePath: str, genomeFilePath, onlySingleBaseSubs, includeIndels, trustedInput = False):
 
     print("Checking custom bed file for formatting and auto-acquire requests...")
 
-    # To start, assume that no sequences need to be acquired, and do it on the fly if need be.
-    autoAcquiring = False
-    autoAcquireFastaIterator = None
-    fastaEntry = None
-    cohortDesignationPresent = None
-
-    # Unless indels are included, determine the context of the feqtures in the file.
-    if includeIndels: context = 0
-    else: context = None
-
-    # Get the list of acceptable chromosomes
-    acceptableChromosomes = getAcceptableChromosomes(genomeFilePath)
-    acceptableChromosomesFilePath = getAcceptableChromosomes(genomeFilePath, True)
+    lineChecker = CustomBedLineChecker(genomeFilePath, onlySingleBaseSubs, includeIndels, trustedInput)
 
     # Create a temporary file to write the data to (potentially after auto-acquiring).  
     # Will replace original file at the end if auto-acquiring occurred.
@@ -146,86 +238,50 @@ def autoAcquireAndQACheck(bedInputFilePath: str, genomeFilePath, autoAcquiredFil
             for line in bedInputFile:
 
                 choppedUpLine = str(line).strip().split('\t')
-
-                # If it isn't already, initialize the cohortDesignationPresent variable.
-                if cohortDesignationPresent is None: cohortDesignationPresent = len(choppedUpLine) == 7
-
-                # Check for possible error states.
-                checkForErrors(choppedUpLine, cohortDesignationPresent, acceptableChromosomes, acceptableChromosomesFilePath)
-
-                # If this is the first entry requiring auto-acquiring, generate the required fasta file.
-                if (not autoAcquiring and (choppedUpLine[3] == '.' or choppedUpLine[4] == '.' or 
-                    (choppedUpLine[5] == '.' and choppedUpLine[3] != '*'))):
-                    print("Found line with auto-acquire requested.  Generating fasta...")
-                    autoAcquiring = True
-                    failedAutoAcquire = False
-                    try:
-                        bedToFasta(bedInputFilePath, genomeFilePath, autoAcquiredFilePath)
-                    except subprocess.CalledProcessError:
-                        failedAutoAcquire = True
-                    if failedAutoAcquire:
-                        raise UserInputError("The given custom bed file has lines with auto-acquire requested "
-                                             "(symbolized by a '.' character), but a fasta file could not be generated from "
-                                             "the given bed file.")
-                    autoAcquiredFile = open(autoAcquiredFilePath, 'r')
-                    autoAcquireFastaIterator = FastaFileIterator(autoAcquiredFile)
-                    fastaEntry = autoAcquireFastaIterator.readEntry()
-                    print("Continuing...")
-
-                # Check for any base identities that need to be auto-acquired.
-                if choppedUpLine[3] == '.':
-
-                    # Find the equivalent fasta entry.
-                    while not equivalentEntries(fastaEntry, choppedUpLine):
-                        assert not autoAcquireFastaIterator.eof, (
-                            "Reached end of fasta file without finding a match for: ",' '.join(choppedUpLine))
-                        fastaEntry = autoAcquireFastaIterator.readEntry()
-
-                    # Set the sequence.
-                    choppedUpLine[3] = fastaEntry.sequence
-
-                # Check for any strand designations that need to be auto-acquired.
-                # Also, make sure this isn't an insertion, in which case the strand designation cannot be determined.
-                if choppedUpLine[5] == '.' and choppedUpLine[3] != '*':
-
-                    # Find the equivalent fasta entry.
-                    while not equivalentEntries(fastaEntry, choppedUpLine):
-                        assert not autoAcquireFastaIterator.eof, (
-                            "Reached end of fasta file without finding a match for: ",' '.join(choppedUpLine))
-                        fastaEntry = autoAcquireFastaIterator.readEntry()
-
-                    # Determine which strand is represented.
-                    if fastaEntry.sequence == choppedUpLine[3]: choppedUpLine[5] = '+'
-                    elif fastaEntry.sequence == reverseCompliment(choppedUpLine[3]): choppedUpLine[5] = '-'
-                    else: assert False, ("The given sequence " + choppedUpLine[3] + " for location " + fastaEntry.sequenceName + ' ' +
-                                         "does not match the corresponding sequence in the given genome, or its reverse compliment.")
-
-                # Change any '.' characters in the "altered to" column to "OTHER"
-                if choppedUpLine[4] == '.': choppedUpLine[4] = "OTHER"
-
-                # Determine the sequence context of the line and whether or not it matches the sequence context for other.
-                # Skip this if the file is "mixed", this line is an indel, or only single base substitutions are allowed and this line isn't one.
-                if (not context == 0 and 
-                    not (choppedUpLine[3] == '*' or choppedUpLine[4] == '*') and 
-                    (not onlySingleBaseSubs or isSingleBaseSubstitution(choppedUpLine))):
-
-                    thisContext = len(choppedUpLine[3])
-                    if context is None: context = thisContext
-                    elif thisContext != context: context = 0
+                lineChecker.checkLine(choppedUpLine)
 
                 # Write the current line to the temporary bed file.
                 temporaryBedFile.write('\t'.join(choppedUpLine) + '\n')
 
     # If any lines were auto-acquired, replace the input bed file with the temporary bed file. (Which has auto-acquires)
-    if autoAcquiring:
+    if lineChecker.autoAcquiring:
         print("Overwriting custom bed input with auto-acquired bases/strand designations.")
         os.replace(temporaryBedFilePath, bedInputFilePath)
     # Otherwise, just delete the temporary file.
     else: os.remove(temporaryBedFilePath)
 
-    if context > 6: context = float("inf")
-    return context
-    
+    return lineChecker.getContext()
+
+
+# Converts a checked line of custom bed input to the format used further down the pipeline (in place).
+# Returns None if the line should be excluded from the output.
+def convertLine(choppedUpLine: List[str], onlySingleBaseSubs, includeIndels):
+
+    # Is this an SNP from a purine?  If so, flip the strand to the pyrimidine containing strand.
+    if isPurine(choppedUpLine[3]) and choppedUpLine[4].upper() in ('A','C','G','T'):
+
+        choppedUpLine[3] = reverseCompliment(choppedUpLine[3])
+        choppedUpLine[4] = reverseCompliment(choppedUpLine[4])
+        if choppedUpLine[5] == '+': choppedUpLine[5] = '-'
+        elif choppedUpLine[5] == '-': choppedUpLine[5] = '+'
+
+    # Is this an indel, and are those included?
+    if choppedUpLine[3] == '*' or choppedUpLine[4] == '*':
+        if not includeIndels: return None
+
+    # Is this a single base substitution, and if not, should it even be included?
+    if not isSingleBaseSubstitution(choppedUpLine):
+        if onlySingleBaseSubs: return None
+
+        # Center features greater than a single nucleotide so that they occur at a single nucleotide position (or half position)
+        else: 
+            center = (float(choppedUpLine[1])+float(choppedUpLine[2])-1)/2
+            if int(center) == center: center = int(center) # Remove the decimal from the float if possible.
+            choppedUpLine[1] = str(center)
+            choppedUpLine[2] = str(center + 1)
+
+    return choppedUpLine
+
 
 # Converts the custom bed input into the singlenuc context format acceptable for analysis further down the pipeline.
 def convertToStandardInput(bedInputFilePath, writeManager: WriteManager, onlySingleBaseSubs, includeIndels):
@@ -233,43 +289,42 @@ def convertToStandardInput(bedInputFilePath, writeManager: WriteManager, onlySin
     print("Converting custom bed file to standard bed input...")
 
     # Iterate through the input file one line at a time, converting each line to an acceptable format for the rest of the pipeline.
-    with open(bedInputFilePath,'r') as bedInputFile:
+    def getConvertedRows(bedInputFile):
         for line in bedInputFile:
-            
-            choppedUpLine = str(line).strip().split('\t')
+            choppedUpLine = convertLine(str(line).strip().split('\t'), onlySingleBaseSubs, includeIndels)
+            if choppedUpLine is not None: yield choppedUpLine
+
+    # Call on the write manager to handle the rest!
+    with open(bedInputFilePath,'r') as bedInputFile:
+        writeManager.writeBatch(getConvertedRows(bedInputFile))
+
 
-            # Is this an SNP from a purine?  If so, flip the strand to the pyrimidine containing strand.
-            if isPurine(choppedUpLine[3]) and choppedUpLine[4].upper() in ('A','C','G','T'):
+# Passes the given (checked) line to the MSIIdentifier if it is relevant to MSI identification.
+def addMSIData(myMSIIdentifier: MSIIdentifier, choppedUpLine: List[str]):
 
-                choppedUpLine[3] = reverseCompliment(choppedUpLine[3])
-                choppedUpLine[4] = reverseCompliment(choppedUpLine[4])
-                if choppedUpLine[5] == '+': choppedUpLine[5] = '-'
-                elif choppedUpLine[5] == '-': choppedUpLine[5] = '+'
+    if choppedUpLine[4] == "OTHER" or choppedUpLine[6] == '.': return
 
-            # Is this an indel, and are those included?
-            if choppedUpLine[3] == '*' or choppedUpLine[4] == '*':
-                if not includeIndels: continue
+    if choppedUpLine[3] == '*':
+        mutType = "INS"
+    elif choppedUpLine[4] == '*':
+        mutType = "DEL"
+    else: mutType = "SNP"
+
+    myMSIIdentifier.addData(choppedUpLine[0], str(int(choppedUpLine[1]) + 1), choppedUpLine[2],
+                            mutType, choppedUpLine[6])
+
+
+# Passes the given (checked) line to the MutSigIdentifier if it is relevant to mutation signature identification.
+def addMutSigData(mutSigIdentifier: MutSigIdentifier, choppedUpLine: List[str]):
 
-            # Is this a single base substitution, and if not, should it even be included?
-            if not isSingleBaseSubstitution(choppedUpLine):
-                if onlySingleBaseSubs: continue
+    # Only use SNP's.  Skip this entry if it does not represent an SNP.
+    if choppedUpLine[3] not in ('A','C','G','T') or choppedUpLine[4] not in ('A','C','G','T'): return
 
-                # Center features greater than a single nucleotide so that they occur at a single nucleotide position (or half position)
-                else: 
-                    center = (float(choppedUpLine[1])+float(choppedUpLine[2])-1)/2
-                    if int(center) == center: center = int(center) # Remove the decimal from the float if possible.
-                    choppedUpLine[1] = str(center)
-                    choppedUpLine[2] = str(center + 1)
-            
+    # Skip any entries that are independent of cohorts.
+    if choppedUpLine[6] == '.': return
 
-            # Call on the write manager to handle the rest!
-            if len(choppedUpLine) == 7:
-                writeManager.writeData(choppedUpLine[0], choppedUpLine[1], choppedUpLine[2],
-                                       choppedUpLine[3], choppedUpLine[4], choppedUpLine[5],
-                                       choppedUpLine[6])
-            else:
-                writeManager.writeData(choppedUpLine[0], choppedUpLine[1], choppedUpLine[2],
-                                       choppedUpLine[3], choppedUpLine[4], choppedUpLine[5])
+    mutSigIdentifier.addData(choppedUpLine[6], choppedUpLine[0], choppedUpLine[2], 
+                             choppedUpLine[3], choppedUpLine[4])
 
 
 # Set up the WriteManager to stratify by microsatellite stability by identifiying MSI cohorts.
@@ -280,25 +335,8 @@ def setUpForMSStratification(writeManager: WriteManager, bedInputFilePath):
     # Get the MSIIdentifier from the write manager and complete its process.
     with writeManager.setUpForMSStratification() as myMSIIdentifier:
         with open(bedInputFilePath, 'r') as bedInputFile:
-
-            mutType = None # Either SNP, INS, or DEL
-
             for line in bedInputFile:
-
-                choppedUpLine: List[str] = line.strip().split('\t')
-
-                if choppedUpLine[4] != "OTHER" and choppedUpLine[6] != '.':
-
-                    if choppedUpLine[3] == '*':
-                        mutType = "INS"
-                    elif choppedUpLine[4] == '*':
-                        mutType = "DEL"
-                    else: mutType = "SNP"
-
-                else: continue
-                
-                myMSIIdentifier.addData(choppedUpLine[0], str(int(choppedUpLine[1]) + 1), choppedUpLine[2],
-                                        mutType, choppedUpLine[6])
+                addMSIData(myMSIIdentifier, line.strip().split('\t'))
 
         myMSIIdentifier.identifyMSICohorts()
 
@@ -311,28 +349,176 @@ def setUpForMutSigStratification(writeManager: WriteManager, bedInputFilePath):
     # Get the MutSigIdentifier from the write manager and complete its process.
     with writeManager.setUpForMutSigStratification() as mutSigIdentifier:
         with open(bedInputFilePath, 'r') as bedInputFile:
-
             for line in bedInputFile:
+                addMutSigData(mutSigIdentifier, line.strip().split('\t'))
 
-                choppedUpLine: List[str] = line.strip().split('\t')
+        mutSigIdentifier.identifyMutSigs()
 
-                # Only use SNP's.  Skip this entry if it does not represent an SNP.
-                if choppedUpLine[3] not in ('A','C','G','T') or choppedUpLine[4] not in ('A','C','G','T'): continue
 
-                # Skip any entries that are independent of cohorts.
-                if choppedUpLine[6] == '.': continue
+# Checks the first line of the given input file for a cohort designation and prepares the WriteManager for individual cohorts
+# if they are requested.  Raises an error if stratification was requested without cohort designations.
+# Returns whether or not cohort designations are present.
+def checkForCohortDesignation(bedInputFilePath, writeManager: WriteManager, stratifyByMS, stratifyByMutSig, separateIndividualCohorts):
 
-                mutSigIdentifier.addData(choppedUpLine[6], choppedUpLine[0], choppedUpLine[2], 
-                                         choppedUpLine[3], choppedUpLine[4])
+    with openInputFile(bedInputFilePath) as bedInputFile:
+        line = next(iter(bedInputFile), '')
 
-        mutSigIdentifier.identifyMutSigs()
+    # Is the cohort designation present?
+    if len(line.strip().split('\t')) == 7: 
+
+        # Prepare the write manager for individual cohorts if desired.
+        if separateIndividualCohorts: writeManager.setUpForIndividualCohorts()
+        return True
+
+    elif stratifyByMS or stratifyByMutSig: 
+        raise UserInputError("Additional stratification given, but no cohort designation given.")
+    elif separateIndividualCohorts:
+        raise UserInputError("Separation by individual cohorts requested, but no cohort designation given.")
+    else: return False
+
+
+# Returns the key that custom bed input is sorted on: the cohort (if present), then the chromosome, then the start
+# and end positions.  (Equivalent to the order given by sortCustomBedInput.)
+def getCustomBedSortKey(choppedUpLine: List[str]):
+    return (choppedUpLine[6:], choppedUpLine[0], float(choppedUpLine[1]), float(choppedUpLine[2]))
+
+
+# Sorts the given custom bed input (which may be compressed) into the given file, which may be the input file itself.
+# Cohorts and chromosomes are compared byte by byte (in the C locale) so that the order matches getCustomBedSortKey.
+def sortCustomBedInput(bedInputFilePath, sortedFilePath, cohortDesignationPresent):
+
+    if cohortDesignationPresent: optionalArgument = ("-k7,7",)
+    else: optionalArgument = tuple()
+    sortCommand = ("sort", "-t", '\t', "-s") + optionalArgument + ("-k1,1", "-k2,2n", "-k3,3n", "-o", sortedFilePath)
+    sortEnvironment = dict(os.environ, LC_ALL = 'C')
+
+    if getCompression(bedInputFilePath) == Compression.plain:
+        subprocess.run(sortCommand + (bedInputFilePath,), env = sortEnvironment, check = True)
+    else:
+        with openInputFile(bedInputFilePath) as bedInputFile:
+            sortProcess = subprocess.Popen(sortCommand, stdin = subprocess.PIPE, env = sortEnvironment, text = True)
+            shutil.copyfileobj(bedInputFile, sortProcess.stdin)
+            sortProcess.stdin.close()
+            if sortProcess.wait() != 0: raise subprocess.CalledProcessError(sortProcess.returncode, sortCommand)
+
+
+# Checks, auto-acquires, and converts the given custom bed input in a single pass, passing MSI and mutation signature
+# data to the given identifiers (if any) and the converted rows to the given WriteManager (if any) along the way.
+# If there is a WriteManager, reading stops at the first line that is out of order (by getCustomBedSortKey), since
+# the input will need to be sorted and written again anyway.
+# Returns whether or not the input is sorted.
+def checkAndConvertInOnePass(bedInputFilePath, lineChecker: CustomBedLineChecker, onlySingleBaseSubs, includeIndels,
+                             writeManager: WriteManager = None,
+                             myMSIIdentifier: MSIIdentifier = None, mutSigIdentifier: MutSigIdentifier = None):
+
+    print("Checking and converting custom bed file in a single pass...")
+
+    isSorted = True
+
+    def getConvertedRows(bedInputFile):
+
+        nonlocal isSorted
+        lastSortKey = None
+
+        for line in bedInputFile:
+
+            choppedUpLine = str(line).strip().split('\t')
+            lineChecker.checkLine(choppedUpLine)
+
+            if isSorted:
+                sortKey = getCustomBedSortKey(choppedUpLine)
+                if lastSortKey is not None and sortKey < lastSortKey:
+                    isSorted = False
+                    if writeManager is not None: return
+                lastSortKey = sortKey
+
+            # Collect MSI and mutation signature data before the line is converted.
+            if myMSIIdentifier is not None: addMSIData(myMSIIdentifier, choppedUpLine)
+            if mutSigIdentifier is not None: addMutSigData(mutSigIdentifier, choppedUpLine)
+
+            if writeManager is not None:
+                choppedUpLine = convertLine(choppedUpLine, onlySingleBaseSubs, includeIndels)
+                if choppedUpLine is not None: yield choppedUpLine
+
+    with openInputFile(bedInputFilePath) as bedInputFile:
+        if writeManager is None:
+            for _ in getConvertedRows(bedInputFile): pass
+        else: writeManager.writeBatch(getConvertedRows(bedInputFile))
+
+    return isSorted
+
+
+# Parses a single custom bed file while reading through it as few times as possible.  Unlike the default parsing steps,
+# the input file is never copied, decompressed, or overwritten (auto-acquired bases/strands are not written back to it).
+# Instead, rows are converted and streamed straight to the WriteManager as the input is read, and the output files are
+# given their final names once the data's context is known.  If the input turns out not to be sorted, a sorted copy
+# is made and written instead.  Stratifying by microsatellite stability or mutation signature requires a first pass over
+# the input, since the designations depend on all of it.  The output is identical to that of the default parsing steps.
+# Returns the path to the root output file.
+def parseCustomBedInOnePass(bedInputFilePath, genomeFilePath, dataDirectory,
+                            stratifyByMS, stratifyByMutSig, separateIndividualCohorts,
+                            onlySingleBaseSubs, includeIndels, trustedInput = False):
+
+    sortedInputFilePath = generateFilePath(directory = os.path.join(dataDirectory,"intermediate_files"),
+                                           dataGroup = os.path.basename(dataDirectory),
+                                           dataType = "sorted_custom_input", fileExtension = ".bed")
+    lineChecker = CustomBedLineChecker(genomeFilePath, onlySingleBaseSubs, includeIndels, trustedInput)
+
+    # The manager's context (and therefore the names of its output files) is set once the input has been written.
+    with WriteManager(dataDirectory) as writeManager:
+
+        cohortDesignationPresent = checkForCohortDesignation(bedInputFilePath, writeManager, stratifyByMS,
+                                                             stratifyByMutSig, separateIndividualCohorts)
+
+        if stratifyByMS or stratifyByMutSig:
+
+            with ExitStack() as identifierStack:
+
+                myMSIIdentifier = None
+                mutSigIdentifier = None
+                if stratifyByMS: myMSIIdentifier = identifierStack.enter_context(writeManager.setUpForMSStratification())
+                if stratifyByMutSig: mutSigIdentifier = identifierStack.enter_context(writeManager.setUpForMutSigStratification())
+
+                isSorted = checkAndConvertInOnePass(bedInputFilePath, lineChecker, onlySingleBaseSubs, includeIndels,
+                                                    None, myMSIIdentifier, mutSigIdentifier)
+
+                if stratifyByMS: myMSIIdentifier.identifyMSICohorts()
+                if stratifyByMutSig: mutSigIdentifier.identifyMutSigs()
+
+            if not isSorted:
+                print("Input is not sorted.  Sorting a copy of the input...")
+                sortCustomBedInput(bedInputFilePath, sortedInputFilePath, cohortDesignationPresent)
+                bedInputFilePath = sortedInputFilePath
+
+            print("Writing converted data...")
+            writeManager.deferContext()
+            checkAndConvertInOnePass(bedInputFilePath, lineChecker, onlySingleBaseSubs, includeIndels, writeManager)
+
+        else:
+
+            writeManager.deferContext()
+            if not checkAndConvertInOnePass(bedInputFilePath, lineChecker, onlySingleBaseSubs, includeIndels, writeManager):
+
+                print("Input is not sorted.  Sorting a copy of the input and writing it instead...")
+                writeManager.discardOutput()
+                sortCustomBedInput(bedInputFilePath, sortedInputFilePath, cohortDesignationPresent)
+
+                lineChecker = CustomBedLineChecker(genomeFilePath, onlySingleBaseSubs, includeIndels, trustedInput)
+                writeManager.deferContext()
+                checkAndConvertInOnePass(sortedInputFilePath, lineChecker, onlySingleBaseSubs, includeIndels, writeManager)
+
+        writeManager.setContext(lineChecker.getContext())
+
+    if os.path.exists(sortedInputFilePath): os.remove(sortedInputFilePath)
+
+    return writeManager.rootOutputFilePath
 
 
 # Handles the scripts main functionality.
 def parseCustomBed(bedInputFilePaths, genomeFilePath,
                    stratifyByMS = False, stratifyByMutSig = False, separateIndividualCohorts = False,
                    onlySingleBaseSubs = False, includeIndels = False,
-                   simpleParsing = False):
+                   simpleParsing = False, streaming = False, trustedInput = False):
 
     # This needs to be here to avoid a circular reference.
     from mutperiodpy.input_parsing.ParseStandardBed import parseStandardBed
@@ -341,14 +527,14 @@ def parseCustomBed(bedInputFilePaths, genomeFilePath,
     if stratifyByMS:
         failedToLoadMSISeq = False
         print("Verifying MSIseq installation...")
-        try: subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"TestMSIseq.R")), check = True)
+        try: runRScript("TestMSIseq.R")
         except subprocess.CalledProcessError: failedToLoadMSISeq = True
         if failedToLoadMSISeq: raise MissingMSISeqError
 
     if stratifyByMutSig:
         failedToLoadDeconstructSigs = False
         print("Verifying deconstructSigs installation...")
-        try: subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"TestDeconstructSigs.R")), check = True)
+        try: runRScript("TestDeconstructSigs.R")
         except subprocess.CalledProcessError: failedToLoadDeconstructSigs = True
         if failedToLoadDeconstructSigs: raise MissingDeconstructSigsError
 
@@ -378,9 +564,22 @@ def parseCustomBed(bedInputFilePaths, genomeFilePath,
 
         intermediateFilesDir = os.path.join(dataDirectory,"intermediate_files")
         checkDirs(intermediateFilesDir)
-        autoAcquiredFilePath = os.path.join(intermediateFilesDir,"auto_acquire.fa")
 
-        context = autoAcquireAndQACheck(bedInputFilePath, genomeFilePath, autoAcquiredFilePath, onlySingleBaseSubs, includeIndels)
+        if streaming:
+            outputFilePaths.append(parseCustomBedInOnePass(bedInputFilePath, genomeFilePath, dataDirectory, stratifyByMS,
+                                                           stratifyByMutSig, separateIndividualCohorts,
+                                                           onlySingleBaseSubs, includeIndels, trustedInput))
+            continue
+
+        # The default parsing steps modify the input file in place, so compressed input is decompressed to a plain copy first.
+        if getCompression(bedInputFilePath) != Compression.plain:
+            decompressedInputFilePath = os.path.join(intermediateFilesDir, getUncompressedFileName(bedInputFilePath))
+            print("Decompressing input to:", decompressedInputFilePath)
+            with openInputFile(bedInputFilePath) as bedInputFile, open(decompressedInputFilePath, 'w') as decompressedInputFile:
+                shutil.copyfileobj(bedInputFile, decompressedInputFile)
+            bedInputFilePath = decompressedInputFilePath
+
+        context = autoAcquireAndQACheck(bedInputFilePath, genomeFilePath, onlySingleBaseSubs, includeIndels, trustedInput)
 
         # Make sure the input file is not named the same as what will become the output file.  If it is, it needs to be copied
         # to the intermediate_files directory so it is available to be read from as the new output file is being written.
@@ -399,27 +598,12 @@ def parseCustomBed(bedInputFilePaths, genomeFilePath,
         with WriteManager(dataDirectory, context) as writeManager:
 
             # Check to see if cohort designations are present to see if preparations need to be made.
-            optionalArgument = tuple()
-            with open(bedInputFilePath, 'r') as bedInputFile:
-                line = bedInputFile.readline()
-
-                # Is the cohort designation present?
-                if len(line.strip().split('\t')) == 7: 
-
-                    # Include in sort function
-                    optionalArgument = ("-k7,7",)
-
-                    # Prepare the write manager for individual cohorts if desired.
-                    if separateIndividualCohorts: writeManager.setUpForIndividualCohorts()
-
-                elif stratifyByMS or stratifyByMutSig: 
-                    raise UserInputError("Additional stratification given, but no cohort designation given.")
-                elif separateIndividualCohorts:
-                    raise UserInputError("Separation by individual cohorts requested, but no cohort designation given.")
+            # If so, include them in the sort function.
+            cohortDesignationPresent = checkForCohortDesignation(bedInputFilePath, writeManager, stratifyByMS,
+                                                                 stratifyByMutSig, separateIndividualCohorts)
 
             # Sort the input data (should also ensure that the output data is sorted)
-            subprocess.run(("sort",) + optionalArgument + 
-                            ("-k1,1","-k2,2n", "-k3,3n",bedInputFilePath,"-s","-o",bedInputFilePath), check = True)
+            sortCustomBedInput(bedInputFilePath, bedInputFilePath, cohortDesignationPresent)
 
             # If requested, also prepare for stratification by microsatellite stability.
             if stratifyByMS:             
@@ -449,22 +633,24 @@ def parseArgs(args):
 
     # If the coerce_bed argument has bee passed, make sure that no other incompatible arguments were passed.
     if args.coerce_bed and (args.stratify_by_microsatellite or args.stratify_by_mut_sigs or 
-                            args.stratify_by_cohorts or args.only_sbs or args.include_indels):
+                            args.stratify_by_cohorts or args.only_sbs or args.include_indels or args.streaming or
+                            args.trusted_input):
         raise UserInputError("When coercing bed input to custom input, the following options cannot be used: "
                              "stratify-by-microsatellite, stratify-by-mut-sigs, stratify-by-cohorts, "
-                             "only-sbs, include-indels")
+                             "only-sbs, include-indels, streaming, trusted-input")
 
     # Get the custom bed files from the given paths, searching directories if necessary.
     finalCustomBedPaths = list()
     for bedFilePath in args.bedFilePaths:
         if os.path.isdir(bedFilePath):
             finalCustomBedPaths += [os.path.abspath(filePath) for filePath in getFilesInDirectory(bedFilePath, "custom_input.bed")]
+            finalCustomBedPaths += [os.path.abspath(filePath) for filePath in getFilesInDirectory(bedFilePath, "custom_input.bed.gz")]
         elif checkIfPathExists(bedFilePath): finalCustomBedPaths.append(os.path.abspath(bedFilePath))
 
     # Run the parser.
     parseCustomBed(list(set(finalCustomBedPaths)), genomeFilePath, args.stratify_by_microsatellite, 
                    args.stratify_by_mut_sigs, args.stratify_by_cohorts, args.only_sbs, args.include_indels,
-                   args.coerce_bed)
+                   args.coerce_bed, args.streaming, args.trusted_input)
 
 
 def main():
@@ -483,6 +669,8 @@ def main():
         fullCustomDialog.createCheckbox("Separate individual cohorts?", 1, 0)
         fullCustomDialog.createCheckbox("Only use single nucleotide substitutions?", 2, 0)
         fullCustomDialog.createCheckbox("Include indels in output?", 2, 1)
+        fullCustomDialog.createCheckbox("Parse each file in a single pass (streaming)?", 3, 0)
+        fullCustomDialog.createCheckbox("Trust input? (Only check a sample of lines for errors)", 3, 1)
 
     # Run the UI
     dialog.mainloop()
@@ -506,8 +694,11 @@ def main():
         separateIndividualCohorts = selections.getToggleStates(FULL_CUSTOM)[2]
         onlySingleBaseSubs = selections.getToggleStates(FULL_CUSTOM)[3]
         includeIndels = selections.getToggleStates(FULL_CUSTOM)[4]
+        streaming = selections.getToggleStates(FULL_CUSTOM)[5]
+        trustedInput = selections.getToggleStates(FULL_CUSTOM)[6]
 
         parseCustomBed(bedInputFilePaths, genomeFilePath, stratifyByMS, 
-                       stratifyByMutSig, separateIndividualCohorts, onlySingleBaseSubs, includeIndels)
+                       stratifyByMutSig, separateIndividualCohorts, onlySingleBaseSubs, includeIndels,
+                       streaming = streaming, trustedInput = trustedInput)
 
 if __name__ == "__main__": main()
@@ -1,18 +1,28 @@
 # This script reads one or more "simple somatic mutation" data file(s) from ICGC and 
 # writes information on single base substitution mutations to a new bed file or files for further analysis.
 
-import os, gzip, sys, subprocess
-from typing import IO, List
+import os, sys, subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterable, List
 
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (DataTypeStr, generateFilePath, getDataDirectory, checkDirs,
-                                                                  generateMetadata, getIsolatedParentDir, rScriptsDirectory,
+                                                                  generateMetadata, getIsolatedParentDir,
                                                                   InputFormat, getAcceptableChromosomes)
+from mutperiodpy.helper_scripts.RWorker import runRScript
 from mutperiodpy.helper_scripts.CustomErrors import *
 from benbiohelpers.FileSystemHandling.DirectoryHandling import getFilesInDirectory                                                                  
 from mutperiodpy.input_parsing.ParseCustomBed import parseCustomBed
+from mutperiodpy.input_parsing.InputReading import openInputStream
 from benbiohelpers.CustomErrors import *
 
+
+# The size of the blocks read from decompressed ICGC files and the minimum size of the shards of donor blocks
+# that are parsed (in parallel, if requested).
+ICGC_READ_SIZE = 2**22
+ICGC_SHARD_SIZE = 2**25
+
 # This class represents the mutation data obtained from ICGC in a more precise form.
 # It also contains functions to represent that data in the exact format required for bed files or MSIseq, if they are valid.
 class ICGCMutation:
@@ -36,16 +46,33 @@ class ICGCMutation:
                                "or \"0\" for minus strand.  Found \"" + str(choppedUpLine[11]) + "\" instead.")
 
 
-# This class takes an ICGCFile object and, when iterated over, returns exactly once each mutation present in a donor that is
-# the result of whole genome sequencing using GRCh37 as the reference genome.
+    # Returns the mutation as a line of custom bed input.
+    def getCustomBedLine(self):
+
+        # Change the formatting if a deletion or insertion is given.              
+        if self.mutatedFrom == '-': 
+            self.mutatedFrom = '*'
+            # NOTE: We are making the assumption that the given base pos (1-based) is after the insertion, not before.
+            self.startPos = str(int(self.startPos) - 1) 
+
+        elif self.mutatedTo == '-': 
+            self.mutatedTo = '*'
+
+        return '\t'.join((self.chromosome, self.startPos, self.endPos, self.mutatedFrom,
+                          self.mutatedTo, self.strand, self.donorID)) + '\n'
+
+
+# This class takes the lines of an ICGC file (as strings) and, when iterated over, returns exactly once each mutation present
+# in a donor that is the result of whole genome sequencing using GRCh37 as the reference genome.
 # The mutation is returned as an ICGCMutation object.
 class ICGCIterator:
 
-    def __init__(self, ICGCFile: IO, genomeFilePath):
+    def __init__(self, ICGCLines: Iterable[str], genomeFilePath):
         
-        self.ICGCFile = ICGCFile # The file containing the ICGC data
-        self.acceptableChromosomes = getAcceptableChromosomes(genomeFilePath)
-        self.finishedDonors = list() # A list of donors to make sure we don't encounter one more than once.
+        self.ICGCLines = iter(ICGCLines) # The lines of ICGC data
+        self.acceptableChromosomes = frozenset(getAcceptableChromosomes(genomeFilePath))
+        self.finishedDonors = set() # A set of donors to make sure we don't encounter one more than once.
+        self.donors: List[str] = list() # The donors encountered, in order.
         self.currentDonor = '' # The donorID currently being read for mutation data.
         self.currentDonorMutations = dict() # A dictionary of mutations unique to the current donor, to avoid writing duplicate mutations.
         self.previousDonorMutations: List[ICGCMutation] = list() # A list that keeps the last donor's mutations in order to write data on individual donors all at once.
@@ -59,7 +86,7 @@ class ICGCIterator:
         while(True):
 
             # Read in the next line in the file.
-            line = self.ICGCFile.readline()
+            line = next(self.ICGCLines, '')
             # Split the line into its individual data components.  The relevant components (with indices) are:
             #   0: mutation ID
             #   1: donor ID
@@ -72,7 +99,7 @@ class ICGCIterator:
             #   11: strand
             #   12: reference genome version
             #   33: sequencing method
-            choppedUpLine = str(line,"utf-8").strip().split('\t')
+            choppedUpLine = line.strip().split('\t')
             if len(choppedUpLine) < 34: raise StopIteration # Check to see if we have reached the end of the file.
 
 
@@ -82,12 +109,13 @@ class ICGCIterator:
 
                 # Is this a new donor?
                 if choppedUpLine[1] != self.currentDonor:
-                    self.finishedDonors.append(self.currentDonor)
+                    self.finishedDonors.add(self.currentDonor)
                     self.currentDonor = choppedUpLine[1]
                     self.previousDonorMutations = list(self.currentDonorMutations.values())
                     self.currentDonorMutations.clear()
                     if self.currentDonor in self.finishedDonors:
                         raise UserInputError("Donor " + self.currentDonor + " is present in more than one block of data!")
+                    self.donors.append(self.currentDonor)
                     print("Reading and writing from donor",self.currentDonor)
 
                 # Have we seen this mutation in this donor?
@@ -97,22 +125,125 @@ class ICGCIterator:
                     return newMutation
 
 
+# Returns the byte position of the start of the last line in the given buffer whose donor (2nd column) differs from the
+# donor of the line before it, or None if there is no such line after the given position.
+# Only complete lines (ending in a newline) are considered.
+def findLastDonorBoundary(buffer: bytearray, searchStart = 0):
+
+    # Retrieves the donor ID for the line starting at the given position.
+    def getDonor(lineStart):
+        donorStart = buffer.find(b'\t', lineStart) + 1
+        return buffer[donorStart:buffer.find(b'\t', donorStart)]
+
+    lastNewlinePos = buffer.rfind(b'\n')
+    if lastNewlinePos == -1: return None
+    lineStart = buffer.rfind(b'\n', 0, lastNewlinePos) + 1
+    donor = getDonor(lineStart)
+
+    while lineStart > searchStart:
+        previousLineStart = buffer.rfind(b'\n', 0, lineStart - 1) + 1
+        if getDonor(previousLineStart) != donor: return lineStart
+        lineStart = previousLineStart
+
+    return None
+
+
+# Reads the given binary stream of ICGC data in blocks and yields it in shards of at least ICGC_SHARD_SIZE bytes (except the last)
+# made up of whole donor blocks, so that each shard can be parsed independently.
+def readDonorShards(ICGCFile: IO):
+
+    buffer = bytearray()
+    searchStart = 0 # Every line before this position is known to belong to the same donor.
+
+    while True:
+
+        block = ICGCFile.read(ICGC_READ_SIZE)
+        if not block: break
+        buffer += block
+        if len(buffer) < ICGC_SHARD_SIZE: continue
+
+        shardEnd = findLastDonorBoundary(buffer, searchStart)
+        if shardEnd is None:
+            searchStart = buffer.rfind(b'\n', 0, buffer.rfind(b'\n')) + 1
+        else:
+            yield bytes(buffer[:shardEnd])
+            del buffer[:shardEnd]
+            searchStart = 0
+
+    if len(buffer) > 0: yield bytes(buffer)
+
+
+# Parses the given shard of ICGC data, returning the custom bed output for its mutations, the donors it contains (in order),
+# and whether or not parsing stopped before the end of the shard (at a line that is too short to be ICGC data).
+def parseICGCShard(shard: bytes, genomeFilePath):
+
+    ICGCLines = iter(shard.decode("utf-8").split('\n'))
+    myICGCIterator = ICGCIterator(ICGCLines, genomeFilePath)
+    customBedOutput = ''.join([mutation.getCustomBedLine() for mutation in myICGCIterator])
+    stoppedEarly = next(ICGCLines, None) is not None
+
+    return customBedOutput, myICGCIterator.donors, stoppedEarly
+
+
+# Parses the given shards of ICGC data across the given number of processes, yielding the results in order.
+# Only a limited number of shards are held in memory at once.
+def parseICGCShardsInParallel(shards: Iterable[bytes], genomeFilePath, jobs):
+
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        pendingResults = deque()
+        for shard in shards:
+            pendingResults.append(executor.submit(parseICGCShard, shard, genomeFilePath))
+            if len(pendingResults) >= 2*jobs: yield pendingResults.popleft().result()
+        while len(pendingResults) > 0: yield pendingResults.popleft().result()
+
+
+# Writes the relevant information from the given ICGC file to the given custom bed file, parsing shards of donor blocks
+# in parallel if more than one job is requested.
+def writeICGCFileAsCustomBed(ICGCFilePath, outputBedFilePath, genomeFilePath, jobs = 1):
+
+    # (Make sure the acceptable chromosomes file exists before any parallel jobs look for it.)
+    getAcceptableChromosomes(genomeFilePath)
+
+    finishedDonors = set()
+    lastDonor = None
+
+    with openInputStream(ICGCFilePath) as ICGCFile:
+        with open(outputBedFilePath, 'w') as outputBedFile:
+
+            shards = readDonorShards(ICGCFile)
+            if jobs == 1: shardResults = (parseICGCShard(shard, genomeFilePath) for shard in shards)
+            else: shardResults = parseICGCShardsInParallel(shards, genomeFilePath, jobs)
+
+            for customBedOutput, donors, stoppedEarly in shardResults:
+
+                # Make sure no donor shows up in more than one shard.
+                # (The last donor in one shard can only continue into the next if the lines between them were all skipped.)
+                for donor in donors:
+                    if donor != lastDonor and donor in finishedDonors:
+                        raise UserInputError("Donor " + donor + " is present in more than one block of data!")
+                    finishedDonors.add(donor)
+                    lastDonor = donor
+
+                outputBedFile.write(customBedOutput)
+                if stoppedEarly: break
+
+
 # Handles the basic parsing of the script.
 def parseICGC(ICGCFilePaths: List[str], genomeFilePath, separateDonors, 
-              stratifyByMS, stratifyByMutSig):
+              stratifyByMS, stratifyByMutSig, jobs = 1):
 
     # Make sure suggested dependencies are installed as necessary.
     if stratifyByMS:
         failedToLoadMSISeq = False
         print("Verifying MSIseq installation...")
-        try: subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"TestMSIseq.R")), check = True)
+        try: runRScript("TestMSIseq.R")
         except subprocess.CalledProcessError: failedToLoadMSISeq = True
         if failedToLoadMSISeq: raise MissingMSISeqError
 
     if stratifyByMutSig:
         failedToLoadDeconstructSigs = False
         print("Verifying deconstructSigs installation...")
-        try: subprocess.run(("Rscript",os.path.join(rScriptsDirectory,"TestDeconstructSigs.R")), check = True)
+        try: runRScript("TestDeconstructSigs.R")
         except subprocess.CalledProcessError: failedToLoadDeconstructSigs = True
         if failedToLoadDeconstructSigs: raise MissingDeconstructSigsError
 
@@ -146,21 +277,7 @@ def parseICGC(ICGCFilePaths: List[str], genomeFilePath, separateDonors,
 
         # Write the relevant information from the ICGC file to the output file.
         print("Writing data to custom bed format.")
-        with gzip.open(ICGCFilePath, 'r') as ICGCFile:
-            with open(outputBedFilePath, 'w') as outputBedFile:
-                for mutation in ICGCIterator(ICGCFile, genomeFilePath):
-
-                    # Change the formatting if a deletion or insertion is given.              
-                    if mutation.mutatedFrom == '-': 
-                        mutation.mutatedFrom = '*'
-                        # NOTE: We are making the assumption that the given base pos (1-based) is after the insertion, not before.
-                        mutation.startPos = str(int(mutation.startPos) - 1) 
-
-                    elif mutation.mutatedTo == '-': 
-                        mutation.mutatedTo = '*'
-
-                    outputBedFile.write('\t'.join((mutation.chromosome, mutation.startPos, mutation.endPos, mutation.mutatedFrom,
-                                                   mutation.mutatedTo, mutation.strand, mutation.donorID)) + '\n')
+        writeICGCFileAsCustomBed(ICGCFilePath, outputBedFilePath, genomeFilePath, jobs)
 
         outputBedFilePaths.append(outputBedFilePath)  
 
@@ -188,9 +305,11 @@ def parseArgs(args):
             finalICGCPaths += [os.path.abspath(filePath) for filePath in getFilesInDirectory(ICGCFilePath, ".tsv.gz")]
         elif checkIfPathExists(ICGCFilePath): finalICGCPaths.append(os.path.abspath(ICGCFilePath))
 
+    if args.jobs < 1: raise UserInputError("The number of jobs must be at least 1.")
+
     # Run the parser.
     parseICGC(list(set(finalICGCPaths)), genomeFilePath, args.stratify_by_donors, 
-              args.stratify_by_microsatellite, args.stratify_by_mut_sigs)
+              args.stratify_by_microsatellite, args.stratify_by_mut_sigs, args.jobs)
 
 
 def main():
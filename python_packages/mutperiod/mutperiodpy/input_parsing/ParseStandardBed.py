@@ -10,6 +10,7 @@ from benbiohelpers.TkWrappers.TkinterDialog import Selections, TkinterDialog
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (getIsolatedParentDir, generateFilePath, getDataDirectory,
                                                                   DataTypeStr, generateMetadata, InputFormat, checkDirs,
                                                                   getAcceptableChromosomes)
+from mutperiodpy.input_parsing.InputReading import openInputFile, getUncompressedFileName
 from benbiohelpers.CustomErrors import *
 
 
@@ -24,7 +25,7 @@ def parseStandardBed(standardBedFilePaths: List[str], genomeFilePath):
     for standardBedFilePath in standardBedFilePaths:
 
         print("\nWorking in:",os.path.basename(standardBedFilePath))
-        if not os.path.basename(standardBedFilePath).endswith(".bed"):
+        if not getUncompressedFileName(standardBedFilePath).endswith(".bed"):
             raise InvalidPathError(standardBedFilePath, 
                                    "Given file does not appear to be in bed format. (missing \".bed\" extension)")
 
@@ -45,8 +46,9 @@ def parseStandardBed(standardBedFilePaths: List[str], genomeFilePath):
         acceptableChromosomes = getAcceptableChromosomes(genomeFilePath)
 
         # Iterate through the standard bed file entries preparing them for custom-bed input.
+        # (If the bed file is bgzipped and tabix-indexed, only acceptable chromosomes are read.)
         print("Converting entries for custom bed input...")
-        with open(standardBedFilePath, 'r') as standardBedFile:
+        with openInputFile(standardBedFilePath, chromosomes = acceptableChromosomes) as standardBedFile:
             with open(customBedOutputFilePath, 'w') as customBedOutputFile:
 
                 for line in standardBedFile:
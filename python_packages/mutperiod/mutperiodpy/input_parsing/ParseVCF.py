@@ -1,72 +1,280 @@
 # This script takes VCF files and parses them into a format acceptable for the rest of the pipeline.
+# If the VCF files contain samples (genotype columns), each sample is treated as its own cohort, and each variant is
+# written once for every sample that carries it.  Otherwise, every variant is written without a cohort designation.
+# (Records without a genotype field, like those in some somatic VCFs, are written once with the "." cohort.)
+# Substitutions are written as is, and insertions and deletions are written using the custom bed "*" conventions.
+# Symbolic alleles (e.g. "<DEL>") and breakends are skipped.
 
-import os
+import os, sys, re, shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, List, Tuple
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
+from benbiohelpers.CustomErrors import UserInputError, checkIfPathExists
+from benbiohelpers.FileSystemHandling.DirectoryHandling import getFilesInDirectory
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (generateFilePath, generateMetadata, DataTypeStr, InputFormat,
-                                                                  checkDirs, getIsolatedParentDir, getDataDirectory, 
+                                                                  checkDirs, getIsolatedParentDir, getDataDirectory,
                                                                   getAcceptableChromosomes)
 from mutperiodpy.input_parsing.ParseCustomBed import parseCustomBed
+from mutperiodpy.input_parsing.InputReading import openInputFile, getTabixIndexFilePath, TabixIndex
 
 
-def parseVCF (vcfInputFilePaths, genomeFilePath):
+# The number of VCF lines converted together when conversion is split across processes without a tabix index.
+VCF_LINE_BLOCK_SIZE = 50000
+
+# Genotypes that don't carry any alternate allele, which can be skipped without looking at their alleles.
+NON_VARIANT_GENOTYPES = frozenset(("0/0", "0|0", "./.", ".|.", "0", '.'))
+GENOTYPE_SEPARATOR_PATTERN = re.compile("[/|]")
+
+
+# Returns the names of the samples in the given VCF file's header (an empty list if it has none).
+def getVCFSampleNames(vcfInputFilePath) -> List[str]:
+
+    with openInputFile(vcfInputFilePath) as vcfInputFile:
+        for line in vcfInputFile:
+            if line.startswith("#CHROM"): return line.rstrip('\r\n').split('\t')[9:]
+            if not line.startswith('#'): break
+
+    return list()
+
+
+# Returns the custom bed columns (start, end, reference bases, mutation) for the given alternate allele at the given
+# (1-based) position, or None if the allele can't be represented in custom bed format.
+# Bases shared by the reference and alternate alleles (e.g. the anchor base of VCF indels) are trimmed first.
+def convertVCFAllele(position: int, reference: str, alternate: str):
+
+    if alternate in ('.', '*') or alternate.startswith('<') or '[' in alternate or ']' in alternate: return None
+
+    # Trim shared bases from the end, then from the start, of both alleles.
+    while len(reference) > 1 and len(alternate) > 1 and reference[-1] == alternate[-1]:
+        reference = reference[:-1]
+        alternate = alternate[:-1]
+    sharedPrefixLength = 0
+    while (sharedPrefixLength < min(len(reference), len(alternate)) and
+           reference[sharedPrefixLength] == alternate[sharedPrefixLength]):
+        sharedPrefixLength += 1
+    reference = reference[sharedPrefixLength:]
+    alternate = alternate[sharedPrefixLength:]
+    startPos = position - 1 + sharedPrefixLength # 0-based
+
+    # Insertion: The given positions should flank the insertion site.
+    if len(reference) == 0:
+        if len(alternate) == 0: return None
+        return (str(startPos - 1), str(startPos + 1), '*', alternate.upper())
+
+    # Deletion
+    elif len(alternate) == 0: return (str(startPos), str(startPos + len(reference)), reference.upper(), '*')
+
+    # Substitution (single or multiple bases)
+    else: return (str(startPos), str(startPos + len(reference)), reference.upper(), alternate.upper())
+
+
+# Converts the given VCF data lines to custom bed lines.  If sample names are given, each alternate allele is written
+# once for every sample whose genotype carries it, with the sample name as the cohort designation.  Lines without a GT
+# format field are written once with the "." cohort designation, since the samples carrying them can't be determined.
+# Returns the custom bed lines as a single string and the number of alleles that could not be converted.
+def convertVCFLines(lines: Iterable[str], acceptableChromosomes, sampleNames: List[str]) -> Tuple[str, int]:
+
+    customBedLines = list()
+    skippedAlleleNum = 0
+
+    for line in lines:
+
+        # Skip header lines.
+        if line.startswith('#'): continue
+
+        choppedUpLine = line.rstrip('\r\n').split('\t')
+
+        # Make sure we have a valid chromosome.
+        if choppedUpLine[0] not in acceptableChromosomes: continue
+
+        position = int(choppedUpLine[1])
+        convertedAlleles = list()
+        for alternate in choppedUpLine[4].split(','):
+            convertedAllele = convertVCFAllele(position, choppedUpLine[3], alternate)
+            if convertedAllele is None:
+                skippedAlleleNum += 1
+                convertedAlleles.append(None) # (Keeps the allele indices aligned with the genotypes.)
+            else:
+                strand = '+' if convertedAllele[2] == '*' else '.' # (Insertions can't have their strand auto-acquired.)
+                convertedAlleles.append('\t'.join((choppedUpLine[0],) + convertedAllele + (strand,)))
+
+        # Without samples, just write each allele.
+        if len(sampleNames) == 0:
+            customBedLines += [convertedAllele + '\n' for convertedAllele in convertedAlleles if convertedAllele is not None]
+            continue
+
+        # Otherwise, find the samples carrying each allele from their genotypes.
+        formatKeys = choppedUpLine[8].split(':')
+        if "GT" not in formatKeys:
+            customBedLines += [convertedAllele + "\t.\n" for convertedAllele in convertedAlleles if convertedAllele is not None]
+            continue
+        genotypeIndex = formatKeys.index("GT")
+
+        for sampleName, sampleData in zip(sampleNames, choppedUpLine[9:]):
+
+            if genotypeIndex == 0: genotype = sampleData.partition(':')[0]
+            else: genotype = (sampleData.split(':') + [''])[genotypeIndex]
+            if genotype in NON_VARIANT_GENOTYPES: continue
+
+            for alleleNumber in sorted(set(GENOTYPE_SEPARATOR_PATTERN.split(genotype))):
+                if alleleNumber in ('0', '.', ''): continue
+                alleleIndex = int(alleleNumber) - 1
+                if alleleIndex < len(convertedAlleles) and convertedAlleles[alleleIndex] is not None:
+                    customBedLines.append(convertedAlleles[alleleIndex] + '\t' + sampleName + '\n')
+
+    return ''.join(customBedLines), skippedAlleleNum
+
+
+# Converts the lines on a single chromosome of a tabix-indexed VCF file to custom bed lines, writing them to the given file.
+# Returns the number of alleles that could not be converted.
+def convertVCFChromosome(vcfInputFilePath, chromosome, outputFilePath, sampleNames: List[str]):
+
+    with openInputFile(vcfInputFilePath, chromosomes = (chromosome,), threads = 1) as vcfInputFile:
+        with open(outputFilePath, 'w') as outputFile:
+            skippedAlleleNum = 0
+            while True:
+                lines = list(islice(vcfInputFile, VCF_LINE_BLOCK_SIZE))
+                if len(lines) == 0: return skippedAlleleNum
+                customBedLines, blockSkippedAlleleNum = convertVCFLines(lines, (chromosome,), sampleNames)
+                outputFile.write(customBedLines)
+                skippedAlleleNum += blockSkippedAlleleNum
+
+
+# Converts the given VCF file to custom bed format, splitting the work across the given number of processes.
+# Tabix-indexed files are split into chromosome shards, which are written to separate files and then merged in order.
+# Other files are split into blocks of lines.
+# Returns the number of alleles that could not be converted.
+def writeVCFFileAsCustomBed(vcfInputFilePath, outputBedFilePath, acceptableChromosomes, jobs = 1):
+
+    sampleNames = getVCFSampleNames(vcfInputFilePath)
+    indexFilePath = getTabixIndexFilePath(vcfInputFilePath)
+
+    if jobs > 1 and indexFilePath is not None:
+
+        chromosomes = [chromosome for chromosome in TabixIndex(indexFilePath).referenceNames if chromosome in acceptableChromosomes]
+        shardFilePaths = [outputBedFilePath + '.' + chromosome + ".tmp" for chromosome in chromosomes]
+
+        with ProcessPoolExecutor(max_workers = jobs) as executor:
+            futures = [executor.submit(convertVCFChromosome, vcfInputFilePath, chromosome, shardFilePath, sampleNames)
+                       for chromosome, shardFilePath in zip(chromosomes, shardFilePaths)]
+            skippedAlleleNum = sum(future.result() for future in futures)
+
+        with open(outputBedFilePath, 'w') as outputBedFile:
+            for shardFilePath in shardFilePaths:
+                with open(shardFilePath, 'r') as shardFile: shutil.copyfileobj(shardFile, outputBedFile)
+                os.remove(shardFilePath)
+
+        return skippedAlleleNum
+
+    # If the VCF file is bgzipped and tabix-indexed, only acceptable chromosomes are read.
+    with openInputFile(vcfInputFilePath, chromosomes = acceptableChromosomes) as vcfInputFile:
+        with open(outputBedFilePath, 'w') as outputBedFile:
+
+            lineBlocks = iter(lambda: list(islice(vcfInputFile, VCF_LINE_BLOCK_SIZE)), list())
+
+            if jobs == 1:
+                results = (convertVCFLines(lineBlock, acceptableChromosomes, sampleNames) for lineBlock in lineBlocks)
+                skippedAlleleNum = 0
+                for customBedLines, blockSkippedAlleleNum in results:
+                    outputBedFile.write(customBedLines)
+                    skippedAlleleNum += blockSkippedAlleleNum
+                return skippedAlleleNum
+
+            # Only a limited number of blocks are held in memory at once.
+            skippedAlleleNum = 0
+            with ProcessPoolExecutor(max_workers = jobs) as executor:
+                pendingResults = deque()
+                for lineBlock in lineBlocks:
+                    pendingResults.append(executor.submit(convertVCFLines, lineBlock, acceptableChromosomes, sampleNames))
+                    while len(pendingResults) >= 2*jobs or (len(pendingResults) > 0 and pendingResults[0].done()):
+                        customBedLines, blockSkippedAlleleNum = pendingResults.popleft().result()
+                        outputBedFile.write(customBedLines)
+                        skippedAlleleNum += blockSkippedAlleleNum
+                while len(pendingResults) > 0:
+                    customBedLines, blockSkippedAlleleNum = pendingResults.popleft().result()
+                    outputBedFile.write(customBedLines)
+                    skippedAlleleNum += blockSkippedAlleleNum
+
+            return skippedAlleleNum
+
+
+def parseVCF(vcfInputFilePaths, genomeFilePath, stratifyByMS = False, stratifyByMutSig = False,
+             separateIndividualCohorts = False, includeIndels = False, jobs = 1):
 
     outputBedFilePaths = list()
 
+    # Get the set of acceptable chromosomes
+    acceptableChromosomes = frozenset(getAcceptableChromosomes(genomeFilePath))
+
     for vcfInputFilePath in vcfInputFilePaths:
 
         print("\nWorking in:",os.path.basename(vcfInputFilePath))
 
         # Get some important file system paths for the rest of the function and generate metadata.
         dataDirectory = os.path.dirname(vcfInputFilePath)
-        generateMetadata(os.path.basename(dataDirectory), getIsolatedParentDir(genomeFilePath), 
+        generateMetadata(os.path.basename(dataDirectory), getIsolatedParentDir(genomeFilePath),
                          os.path.basename(vcfInputFilePath), InputFormat.vcf, os.path.dirname(vcfInputFilePath))
 
         intermediateFilesDir = os.path.join(dataDirectory,"intermediate_files")
         checkDirs(intermediateFilesDir)
 
-        # Get the list of acceptable chromosomes
-        acceptableChromosomes = getAcceptableChromosomes(genomeFilePath)
-
         # Generate the output file.
         outputBedFilePath = generateFilePath(directory = intermediateFilesDir, dataGroup = getIsolatedParentDir(vcfInputFilePath),
                                              dataType = DataTypeStr.customInput, fileExtension = ".bed")
 
         # Write data to the output file.
-        with open(vcfInputFilePath, 'r') as vcfInputFile:
-            with open(outputBedFilePath, 'w') as outputBedFile:
-
-                for line in vcfInputFile:
-                    
-                    # Skip header lines.
-                    if line.startswith("#"): continue
-
-                    choppedUpLine = str(line).strip().split('\t')
-
-                    # Make sure we have a valid chromosome.
-                    if choppedUpLine[0] in acceptableChromosomes:
-                    
-                        # NOTE: Currently only knows how to handle SBSs. Will need to revise for more complicated VCF files.
-                        if not (choppedUpLine[3].upper() in ('A','C','G','T') and choppedUpLine[4].upper() in ('A','C','G','T')):
-                            print(f"Warning: line with non-SBS variant call encountered:\n{line}\nThe pipeline is not currently set up to handle this.")
-
-                        # Convert the line to custom bed format.
-                        outputBedFile.write('\t'.join((choppedUpLine[0], str(int(choppedUpLine[1])-1), choppedUpLine[1], 
-                                                    choppedUpLine[3], choppedUpLine[4], '.')) + '\n')
+        skippedAlleleNum = writeVCFFileAsCustomBed(vcfInputFilePath, outputBedFilePath, acceptableChromosomes, jobs)
+        if skippedAlleleNum > 0:
+            print(f"Warning: {skippedAlleleNum} symbolic or breakend alleles were encountered and skipped.  "
+                  "The pipeline is not currently set up to handle these.")
 
         # Add the output file to the list.
         outputBedFilePaths.append(outputBedFilePath)
 
     # Pass the data to the custome bed parser.
     print("\nPassing data to custom bed parser.\n")
-    return parseCustomBed(outputBedFilePaths, genomeFilePath, onlySingleBaseSubs = True)
+    return parseCustomBed(outputBedFilePaths, genomeFilePath, stratifyByMS, stratifyByMutSig, separateIndividualCohorts,
+                          onlySingleBaseSubs = not includeIndels, includeIndels = includeIndels)
+
 
+def parseArgs(args):
 
-if __name__ == "__main__":
+    # If only the subcommand was given, run the UI.
+    if len(sys.argv) == 2:
+        main(); return
+
+    # Otherwise, check to make sure valid arguments were passed:
+    if args.genome_file is None: raise UserInputError("No genome file was given.")
+    checkIfPathExists(args.genome_file)
+    genomeFilePath = os.path.abspath(args.genome_file)
+    if args.jobs < 1: raise UserInputError("The number of jobs must be at least 1.")
+
+    # Get the VCF files from the given paths, searching directories if necessary.
+    finalVCFPaths = list()
+    for vcfFilePath in args.vcfFilePaths:
+        if os.path.isdir(vcfFilePath):
+            finalVCFPaths += [os.path.abspath(filePath) for filePath in getFilesInDirectory(vcfFilePath, ".vcf")]
+            finalVCFPaths += [os.path.abspath(filePath) for filePath in getFilesInDirectory(vcfFilePath, ".vcf.gz")]
+        elif checkIfPathExists(vcfFilePath): finalVCFPaths.append(os.path.abspath(vcfFilePath))
+
+    # Run the parser.
+    parseVCF(list(set(finalVCFPaths)), genomeFilePath, args.stratify_by_microsatellite, args.stratify_by_mut_sigs,
+             args.stratify_by_cohorts, args.include_indels, args.jobs)
+
+
+def main():
 
     #Create the Tkinter UI
-    dialog = TkinterDialog(workingDirectory=getDataDirectory())
-    dialog.createMultipleFileSelector("Input Files:",0,".vcf",("VCF files",".vcf"))
+    dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Parse VCF Data")
+    dialog.createMultipleFileSelector("Input Files:",0,".vcf",("VCF files",".vcf"), additionalFileEndings = (".vcf.gz",))
     dialog.createFileSelector("Genome Fasta File:",1,("Fasta Files",".fa"))
+    dialog.createCheckbox("Separate individual samples?", 2, 0)
+    dialog.createCheckbox("Stratify data by microsatellite stability?", 3, 0)
+    dialog.createCheckbox("Stratify by mutation signature?", 3, 1)
+    dialog.createCheckbox("Include indels in output?", 4, 0)
+    dialog.createTextField("Number of parallel jobs: ", 5, 0, defaultText = "1")
 
     # Run the UI
     dialog.mainloop()
@@ -76,7 +284,14 @@ if __name__ == "__main__":
 
     # Get the user's input from the dialog.
     selections: Selections = dialog.selections
-    bedInputFilePaths = list(selections.getFilePathGroups())[0]
+    vcfInputFilePaths = list(selections.getFilePathGroups())[0]
     genomeFilePath = list(selections.getIndividualFilePaths())[0]
+    separateIndividualCohorts, stratifyByMS, stratifyByMutSig, includeIndels = list(selections.getToggleStates())[:4]
+    try: jobs = int(selections.getTextEntries()[0])
+    except ValueError: raise UserInputError("The number of jobs must be an integer.")
+    if jobs < 1: raise UserInputError("The number of jobs must be at least 1.")
+
+    parseVCF(vcfInputFilePaths, genomeFilePath, stratifyByMS, stratifyByMutSig, separateIndividualCohorts, includeIndels, jobs)
+
 
-    parseVCF(bedInputFilePaths, genomeFilePath)
\ No newline at end of file
+if __name__ == "__main__": main()
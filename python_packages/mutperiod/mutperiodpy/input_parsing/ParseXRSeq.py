@@ -4,11 +4,12 @@
 from typing import List
 import os, subprocess
 from enum import Enum
+from itertools import islice
+import numpy as np
 from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
-from benbiohelpers.FileSystemHandling.BedToFasta import bedToFasta
-from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (getIsolatedParentDir, generateFilePath, getDataDirectory,
                                                                   DataTypeStr, generateMetadata, InputFormat, getAcceptableChromosomes)
+from mutperiodpy.helper_scripts.PackedGenome import PackedGenome, getPackedGenome, COMPLEMENT_TABLE
 from benbiohelpers.CustomErrors import *
 from mutperiodpy.input_parsing.ParseCustomBed import parseCustomBed
 
@@ -21,81 +22,122 @@ class PresetCallParams(Enum):
     HUMAN_UV_DIMER = "human_UV_dimer_call_params.tsv"
 
 
-# Estimates (Most likely with perfect accuracy) the minimum adjusted counts value that is then assumed to represent one count.
-def getMinAdjustedCountValue(xRSeqBedGraphReadsFilePath):
+# The number of bedGraph entries trimmed together.
+TRIMMING_BLOCK_SIZE = 2**18
 
-    # Keep track of how many rows have been read since the last minimum was set.
-    rowsSinceLastMin = 0
-    minAdjustedCountValue = None
+# The number of reads from the trimmed reads file that are searched for lesions together.
+LESION_CALLING_BLOCK_SIZE = 2**18
 
-    with open(xRSeqBedGraphReadsFilePath, 'r') as xRSeqReadsFile:
-        for line in xRSeqReadsFile:
+# Used to complement whole arrays of uint8 sequences at once.
+COMPLEMENT_ARRAY = np.frombuffer(COMPLEMENT_TABLE, dtype = np.uint8)
 
-            # Split each line on tab characters.
-            choppedUpLine = line.strip().split("\t")
 
-            # Check for a new min.
-            if minAdjustedCountValue is None or float(choppedUpLine[3]) < minAdjustedCountValue:
-                rowsSinceLastMin = 0
-                minAdjustedCountValue = float(choppedUpLine[3])
-            else: rowsSinceLastMin += 1
+# Finds the normalized (adjusted) counts value that represents one count in bedGraph data, given all of its values
+# (a block at a time) as they are read.  Only the distinct values are kept, so the true minimum is always known.
+# The minimum represents one count, and every other value must be evenly divisible by it.
+# The first line found with each distinct value is also kept so that improperly formatted lines can be reported.
+class CountUnitEstimator:
 
-            # If we've gone 1,000 lines without finding a new min, we've probably got the true min.
-            # (Experimentally, it looks like the reads with the minimum value encompass over half of the reads, so...)
-            if rowsSinceLastMin >= 1000:
-                break
+    def __init__(self, roundingErrorLeniency = 0.01):
 
-    return minAdjustedCountValue
+        self.roundingErrorLeniency = roundingErrorLeniency
+        self.distinctValues = np.zeros(0)
+        self.linesByValue = dict()
+
+
+    # Adds a block of values, along with the lines they came from.
+    # (Values of zero or less don't represent any counts and are ignored.)
+    def addValues(self, values: np.ndarray, lines: List[str]):
+
+        uniqueValues, firstIndices = np.unique(values[values > 0], return_index = True)
+        positiveIndices = np.flatnonzero(values > 0)
+        isNew = ~np.isin(uniqueValues, self.distinctValues)
+        for value, index in zip(uniqueValues[isNew].tolist(), firstIndices[isNew].tolist()):
+            self.linesByValue[value] = lines[positiveIndices[index]]
+
+        self.distinctValues = np.union1d(self.distinctValues, uniqueValues)
+
+
+    # Returns the value which represents one count: the minimum value.
+    def getCountUnit(self):
+
+        if len(self.distinctValues) == 0: raise UserInputError("No positive adjusted count values were found in the bedGraph data.")
+
+        minAdjustedCountValue = self.distinctValues[0]
+
+        # Make sure the conversion to actual counts produces reasonably whole numbers.
+        # (i.e. The minimum is the greatest common divisor of all the values.)
+        counts = self.distinctValues / minAdjustedCountValue
+        roundingErrors = np.abs(np.round(counts) - counts)
+        if np.any(roundingErrors > self.roundingErrorLeniency):
+            value = self.distinctValues[np.argmax(roundingErrors)]
+            raise UserInputError("The following line is improperly formatted: " + self.linesByValue[value.item()].rstrip('\n') + '\n' +
+                                 str(value) + " cannot be converted to actual counts as it is not evenly divisible by the minimum " +
+                                 "adjusted counts value, " + str(minAdjustedCountValue) +
+                                 ". (Rounding error > " + str(self.roundingErrorLeniency) + ")")
+
+        return minAdjustedCountValue
 
 
 # Create a new reads file which filters out any reads with a length greater than 28 or less than 26.
 # Combine + and - reads into one file with a +/- column
-# Also, convert normalized counts to actual counts and swap out the counts column for duplicated entries with multiple counts.
+# Also, keep the normalized counts in the score column (rather than duplicating entries by their actual counts), and
+# find the value which represents one count while reading them.  This value is returned.
 # The input format should be a bedGraph file.
-def trimBedGraphXRSeqData(xRSeqBedGraphReadsFilePathPair: List[str], trimmedReadsFilePath, minAdjustedCountValue, 
-                           acceptableLengths, acceptableChromosomes, roundingErrorLeniency = 0.01):
-    
-   with open(trimmedReadsFilePath, 'w') as trimmedReadsFile:
+def trimBedGraphXRSeqData(xRSeqBedGraphReadsFilePathPair: List[str], trimmedReadsFilePath,
+                          acceptableLengths, acceptableChromosomes, roundingErrorLeniency = 0.01):
 
-       # Trim/Modify all the entries from the file path pair.
-       for xRSeqBedGraphReadsFilePath in xRSeqBedGraphReadsFilePathPair:
+    countUnitEstimator = CountUnitEstimator(roundingErrorLeniency)
+    acceptableLengths = np.array(list(acceptableLengths))
+    acceptableChromosomes = np.array(list(acceptableChromosomes))
 
-           plusOrMinus = xRSeqBedGraphReadsFilePath.rsplit('.',1)[0][-1] # '+' or '-'
+    with open(trimmedReadsFilePath, 'w') as trimmedReadsFile:
 
-           with open(xRSeqBedGraphReadsFilePath, 'r') as xRSeqReadsFile:
-               for line in xRSeqReadsFile:
+        # Trim/Modify all the entries from the file path pair.
+        for xRSeqBedGraphReadsFilePath in xRSeqBedGraphReadsFilePathPair:
 
-                    choppedUpLine = line.strip().split("\t")
+            plusOrMinus = xRSeqBedGraphReadsFilePath.rsplit('.',1)[0][-1] # '+' or '-'
 
-                    # Make sure the lesion is in a valid chromosome.  Otherwise, skip it.
-                    if not choppedUpLine[0] in acceptableChromosomes: continue
+            with open(xRSeqBedGraphReadsFilePath, 'r') as xRSeqReadsFile:
+                while True:
 
-                    # Make sure we have a valid read length
-                    readLength = int(choppedUpLine[2]) - int(choppedUpLine[1])
-                    if readLength in acceptableLengths:
+                    lines = list(islice(xRSeqReadsFile, TRIMMING_BLOCK_SIZE))
+                    if len(lines) == 0: break
 
-                        # determine the actual counts for the current entry to enter it that many times in the output file.
-                        counts = float(choppedUpLine[3]) / minAdjustedCountValue
+                    chromosomes, startPositions, endPositions, values = zip(*[line.strip().split("\t") for line in lines])
+                    valuesArray = np.fromiter(map(float, values), dtype = np.float64, count = len(lines))
 
-                        # Make sure the conversion to actual counts produced a reasonably whole number.
-                        if abs(round(counts) - counts) > roundingErrorLeniency:
-                            raise UserInputError("The following line is improperly formatted: " + line + '\n' +
-                                             choppedUpLine[3] + " cannot be converted to actual counts as it is not evenly divisible by" +
-                                             str(minAdjustedCountValue) + ". (Rounding error > " + str(roundingErrorLeniency) + ")")
-                        
-                        # Write the data
-                        for _ in range(round(counts)):
-                            trimmedReadsFile.write('\t'.join((choppedUpLine[0],choppedUpLine[1],choppedUpLine[2],'NA','NA',plusOrMinus)) + '\n')
+                    # Make sure each read is in a valid chromosome, has a valid read length, and has counts.
+                    readLengths = (np.fromiter(map(int, endPositions), dtype = np.int64, count = len(lines)) -
+                                   np.fromiter(map(int, startPositions), dtype = np.int64, count = len(lines)))
+                    validReads = (np.isin(np.array(chromosomes), acceptableChromosomes) &
+                                  np.isin(readLengths, acceptableLengths) & (valuesArray > 0))
+                    validIndices = np.flatnonzero(validReads).tolist()
+
+                    # Only the values from valid reads are used to find the value representing one count.
+                    countUnitEstimator.addValues(valuesArray[validReads], [lines[i] for i in validIndices])
+
+                    # Write the data
+                    trimmedReadsFile.write(''.join(['\t'.join((chromosomes[i],startPositions[i],endPositions[i],
+                                                               'NA',values[i],plusOrMinus)) + '\n'
+                                                    for i in validIndices]))
+
+    return countUnitEstimator.getCountUnit()
 
 
 # Create a new reads file which filters out reads that do not conform to the call params file.
-# Also, replace the columns with the read ID and score with NA.
+# Also, replace the column with the read ID with NA, and collapse consecutive identical reads into a single entry,
+# with the number of reads in the score column.
 # The input format should be a bed file.
 def trimBedXRSeqData(xRSeqBedReadsFilePath: str, trimmedReadsFilePath, acceptableLengths, acceptableChromosomes):
     
    with open(trimmedReadsFilePath, 'w') as trimmedReadsFile:
 
-       # Trim/Modify all the entries from the file path.
+        # Keep track of the most recent read and how many times it has been seen in a row.
+        lastRead = None
+        lastReadCounts = 0
+
+        # Trim/Modify all the entries from the file path.
         with open(xRSeqBedReadsFilePath, 'r') as xRSeqReadsFile:
             for line in xRSeqReadsFile:
 
@@ -107,9 +149,20 @@ def trimBedXRSeqData(xRSeqBedReadsFilePath: str, trimmedReadsFilePath, acceptabl
                 # Make sure we have a valid read length
                 readLength = int(choppedUpLine[2]) - int(choppedUpLine[1])
                 if readLength in acceptableLengths:
-                    
-                    # Write the data
-                    trimmedReadsFile.write('\t'.join((choppedUpLine[0],choppedUpLine[1],choppedUpLine[2],'NA','NA',choppedUpLine[5])) + '\n')
+
+                    read = (choppedUpLine[0],choppedUpLine[1],choppedUpLine[2],choppedUpLine[5])
+                    if read == lastRead:
+                        lastReadCounts += 1
+                        continue
+
+                    # Write the data for the previous read.
+                    if lastRead is not None:
+                        trimmedReadsFile.write('\t'.join(lastRead[:3] + ('NA',str(lastReadCounts),lastRead[3])) + '\n')
+                    lastRead = read
+                    lastReadCounts = 1
+
+        if lastRead is not None:
+            trimmedReadsFile.write('\t'.join(lastRead[:3] + ('NA',str(lastReadCounts),lastRead[3])) + '\n')
 
 
 # Given a nucleotide sequence, do the conditions suggest a lesion is present?
@@ -118,66 +171,162 @@ def trimBedXRSeqData(xRSeqBedReadsFilePath: str, trimmedReadsFilePath, acceptabl
 #   If no end value is given, just the base at the start value is used.
 #   e.g. A start value of -3 and an end value of -1 would search the last two 
 # The function outputs a tuple of the start and end indicies for the lesion in the input sequence in bed format (0-based:1-based).
-# NOTE: Lots of assert statements here that are actually more closely related to file inputs.  
-#       If this code is ever used more publicly, maybe convert these to custom errors and also 
-#       only invoke them once when the original file is read.
 def searchForLesion(sequence, expectedLocationStart, expectedLocationEnd, acceptableBases):
 
+    lesionStartIndex, lesionEndIndex = getLesionIndices(len(sequence), expectedLocationStart, expectedLocationEnd)
+
+    # If a specific sequence is expected, make sure it is present.
+    if not 'N' in acceptableBases and sequence[lesionStartIndex:lesionEndIndex] not in acceptableBases: return None
+
+    return (lesionStartIndex, lesionEndIndex)
+
+
+# Converts an expected location (formatted as described for searchForLesion) to the start and end indices of the lesion
+# within a sequence of the given length, in bed format (0-based:1-based).
+# NOTE: Lots of assert statements here that are actually more closely related to file inputs.  
+#       If this code is ever used more publicly, maybe convert these to custom errors.
+def getLesionIndices(sequenceLength, expectedLocationStart, expectedLocationEnd):
+
     expectedLocationEnd += 1
     assert expectedLocationEnd > expectedLocationStart
 
     assert expectedLocationStart != 0
-    assert abs(expectedLocationStart) <= len(sequence), ("Sequence of length {} does not have a {} position.".
-                                                    format(len(sequence), expectedLocationStart))
+    assert abs(expectedLocationStart) <= sequenceLength, ("Sequence of length {} does not have a {} position.".
+                                                          format(sequenceLength, expectedLocationStart))
 
     if expectedLocationStart > 0: 
         expectedLocationStart -= 1
         expectedLocationEnd -= 1
 
-    assert abs(expectedLocationEnd) <= len(sequence), ("Sequence of length {} does not have a {} position.".
-                                                    format(len(sequence), expectedLocationEnd))
-
-    # If a specific sequence is expected, make sure it is present.
-    if not 'N' in acceptableBases:
-        if expectedLocationEnd == 0: checkSequence = sequence[expectedLocationStart:]
-        else: checkSequence = sequence[expectedLocationStart:expectedLocationEnd]
-
-        if checkSequence not in acceptableBases: return None
+    assert abs(expectedLocationEnd) <= sequenceLength, ("Sequence of length {} does not have a {} position.".
+                                                        format(sequenceLength, expectedLocationEnd))
 
     if expectedLocationStart >= 0: return (expectedLocationStart, expectedLocationEnd)
-    else: return (len(sequence) + expectedLocationStart, len(sequence) + expectedLocationEnd)
-
-
-# From a given fasta file of reads, find likely BPDE-dG lesions and write their
-# location to a bed file.
-def writeLesions(fastaReadsFilePath, lesionsBedFilePath, expectedLocationsByLength, acceptableBasesByLength):
+    else: return (sequenceLength + expectedLocationStart, sequenceLength + expectedLocationEnd)
+
+
+# Searches a block of reads (lines from a trimmed reads file) for lesions all at once and returns the resulting lesion
+# bed entries as a single string, in the same order they would be found by searching each read individually.
+# Reads are grouped by length and strand, and each group's sequences are retrieved from the packed genome as a
+# matrix so that the bases at every expected location can be checked for the whole group at once.
+# The lesion indices and acceptable base arrays (None if any bases are acceptable) are given by read length.
+# Each read's score is divided by the count unit to get the number of reads it represents.
+def callLesionsInReads(lines: List[str], packedGenome: PackedGenome, lesionIndicesByLength, acceptableBaseArraysByLength,
+                       countUnit = 1):
+
+    # Split the reads into their columns.
+    chromosomeColumn, readStartColumn, readEndColumn, _, readScoreColumn, strandColumn = zip(*[line.rstrip('\n').split('\t')
+                                                                                               for line in lines])
+    chromosomes = np.array(chromosomeColumn)
+    readStartPositions = np.fromiter(map(int, readStartColumn), dtype = np.int64, count = len(lines))
+    readEndPositions = np.fromiter(map(int, readEndColumn), dtype = np.int64, count = len(lines))
+    readLengths = readEndPositions - readStartPositions
+
+    # Find where each read starts in the packed genome.  Reads that extend past the end of their chromosome are skipped.
+    genomeStartPositions = np.zeros(len(lines), dtype = np.int64)
+    validReads = np.zeros(len(lines), dtype = bool)
+    for chromosome in np.unique(chromosomes):
+        if chromosome not in packedGenome.chromosomeIndex: continue
+        chromosomeOffset, chromosomeLength = packedGenome.chromosomeIndex[chromosome]
+        onChromosome = chromosomes == chromosome
+        genomeStartPositions[onChromosome] = readStartPositions[onChromosome] + chromosomeOffset
+        validReads[onChromosome] = ((readStartPositions[onChromosome] >= 0) & (readEndPositions[onChromosome] <= chromosomeLength) &
+                                    (readLengths[onChromosome] > 0))
+
+    # Search each group of reads, recording the read and expected location for each lesion found so that
+    # the lesions can be returned in their original order.
+    readIndices = list()
+    locationIndices = list()
+    lesionStartPositions = list()
+    lesionEndPositions = list()
+    lesionSequences = list()
+
+    isMinusStrand = np.array(strandColumn) == '-'
+    for readLength in np.unique(readLengths[validReads]):
+        for minusStrand in (False, True):
+
+            groupIndices = np.flatnonzero(validReads & (readLengths == readLength) & (isMinusStrand == minusStrand))
+            if len(groupIndices) == 0: continue
+
+            sequenceMatrix = packedGenome.sequences[genomeStartPositions[groupIndices,None] + np.arange(readLength)]
+            if minusStrand: sequenceMatrix = COMPLEMENT_ARRAY[sequenceMatrix][:,::-1]
+
+            acceptableBaseArrays = acceptableBaseArraysByLength[readLength]
+            for locationIndex, (lesionStartIndex, lesionEndIndex) in enumerate(lesionIndicesByLength[readLength]):
+
+                lesionSequenceMatrix = sequenceMatrix[:,lesionStartIndex:lesionEndIndex]
+
+                # If a specific sequence is expected, make sure it is present.
+                if acceptableBaseArrays is None: matches = np.ones(len(groupIndices), dtype = bool)
+                else:
+                    matches = np.zeros(len(groupIndices), dtype = bool)
+                    for acceptableBaseArray in acceptableBaseArrays:
+                        if len(acceptableBaseArray) == lesionEndIndex - lesionStartIndex:
+                            matches |= np.all(lesionSequenceMatrix == acceptableBaseArray, axis = 1)
+
+                # IMPORTANT: If the sequence is on the minus strand, the location needs to be inverted with respect to the fragment
+                # because reverse complement and stuff.
+                matchIndices = groupIndices[matches]
+                if minusStrand:
+                    lesionStartPositions.append(readStartPositions[matchIndices] + readLength - lesionEndIndex)
+                    lesionEndPositions.append(readStartPositions[matchIndices] + readLength - lesionStartIndex)
+                else:
+                    lesionStartPositions.append(readStartPositions[matchIndices] + lesionStartIndex)
+                    lesionEndPositions.append(readStartPositions[matchIndices] + lesionEndIndex)
+
+                lesionSequenceLength = lesionEndIndex - lesionStartIndex
+                lesionSequences += (np.ascontiguousarray(lesionSequenceMatrix[matches]).view('S' + str(lesionSequenceLength))
+                                    .ravel().astype(str).tolist())
+
+                readIndices.append(matchIndices)
+                locationIndices.append(np.full(len(matchIndices), locationIndex))
+
+    if len(readIndices) == 0: return ''
+
+    # Write the lesions in order of their reads, and then their expected locations.
+    readIndices = np.concatenate(readIndices)
+    lesionOrder = np.lexsort((np.concatenate(locationIndices), readIndices))
+
+    bedEntries = list()
+    for readIndex, lesionStartPosition, lesionEndPosition, lesionIndex in zip(
+        readIndices[lesionOrder].tolist(), np.concatenate(lesionStartPositions)[lesionOrder].tolist(),
+        np.concatenate(lesionEndPositions)[lesionOrder].tolist(), lesionOrder.tolist()
+    ):
+        bedEntry = '\t'.join((chromosomeColumn[readIndex], str(lesionStartPosition), str(lesionEndPosition),
+                              lesionSequences[lesionIndex], "OTHER", strandColumn[readIndex])) + '\n'
+        bedEntries.append(bedEntry*round(float(readScoreColumn[readIndex])/countUnit))
+
+    return ''.join(bedEntries)
+
+
+# From a given bed file of reads and the packed genome, find likely BPDE-dG lesions and write their
+# location to a bed file.  The score column of the reads file, divided by the count unit, gives the number of reads each
+# entry represents, and each lesion is written once for each of these reads (so that each unique read is only fetched
+# and searched once).
+# Reads are searched in blocks (see callLesionsInReads).
+def writeLesions(readsBedFilePath, packedGenome: PackedGenome, lesionsBedFilePath, expectedLocationsByLength, acceptableBasesByLength,
+                 countUnit = 1):
+
+    # Convert (and validate) the expected locations and acceptable bases once for each read length.
+    lesionIndicesByLength = dict()
+    acceptableBaseArraysByLength = dict()
+    for readLength in expectedLocationsByLength:
+        lesionIndicesByLength[readLength] = [getLesionIndices(readLength, expectedLocationStart, expectedLocationEnd)
+                                             for expectedLocationStart, expectedLocationEnd in expectedLocationsByLength[readLength]]
+        if 'N' in acceptableBasesByLength[readLength]: acceptableBaseArraysByLength[readLength] = None
+        else:
+            acceptableBaseArraysByLength[readLength] = [np.frombuffer(acceptableBases.encode(), dtype = np.uint8)
+                                                        for acceptableBases in acceptableBasesByLength[readLength]]
 
-    with open(fastaReadsFilePath, 'r') as fastaReadsFile:
+    with open(readsBedFilePath, 'r') as readsBedFile:
         with open(lesionsBedFilePath, 'w') as lesionsBedFile:
 
-            # Look for lesions in each fasta entry and write them to the bed file.
-            for fastaEntry in FastaFileIterator(fastaReadsFile):
-                for expectedLocation in expectedLocationsByLength[len(fastaEntry.sequence)]:
-
-                    lesionLocation = searchForLesion(fastaEntry.sequence, expectedLocation[0], expectedLocation[1], acceptableBasesByLength[len(fastaEntry.sequence)])
-
-                    if lesionLocation is not None:
-                        
-                        lesionStartLocation, lesionEndLocation = lesionLocation
-                        sequence = fastaEntry.sequence[lesionStartLocation:lesionEndLocation]
-
-                        # IMPORTANT: If the sequence is on the minus strand, the location needs to be inverted with respect to the fragment
-                        # because reverse complement and stuff.
-                        if fastaEntry.strand == '-': 
-                            tempLesionStartLocation = lesionStartLocation # To avoid bugs when switching around values in two variables
-                            lesionStartLocation = len(fastaEntry.sequence) - lesionEndLocation
-                            lesionEndLocation = len(fastaEntry.sequence) - tempLesionStartLocation
-
-                        bedEntry = '\t'.join((fastaEntry.sequenceLocation[0],
-                                                str(int(fastaEntry.sequenceLocation[1]) + lesionStartLocation),
-                                                str(int(fastaEntry.sequenceLocation[1]) + lesionEndLocation),
-                                                sequence, "OTHER", fastaEntry.strand)) + '\n'
-                        lesionsBedFile.write(bedEntry)
+            # Look for lesions in each block of reads and write them to the bed file.
+            while True:
+                lines = list(islice(readsBedFile, LESION_CALLING_BLOCK_SIZE))
+                if len(lines) == 0: break
+                lesionsBedFile.write(callLesionsInReads(lines, packedGenome, lesionIndicesByLength,
+                                                                  acceptableBaseArraysByLength, countUnit))
 
 
 # Given a file path, looks for the complementary file path (with the opposite strand designation) and returns both as a tuple.
@@ -201,6 +350,38 @@ def getFilePathPair(filePath: str) -> str:
     return (filePath, complementaryPath)
 
 
+# Reads the given call params file and returns dictionaries of the expected lesion locations
+# and acceptable bases at those locations for each read length.
+def readCallParams(callParamsFilePath):
+
+    expectedLocationsByLength = dict()
+    acceptableBasesByLength = dict()
+
+    with open(callParamsFilePath, 'r') as callParamsFile:
+        for line in callParamsFile:
+
+            choppedUpLine: List[str] = line.split()
+
+            sequenceLength = int(choppedUpLine[0])
+            assert sequenceLength not in expectedLocationsByLength
+
+            expectedLocationsByLength[sequenceLength] = list()
+            expectedLocations = choppedUpLine[1].split(',')
+            for expectedLocation in expectedLocations:
+                if ':' not in expectedLocation:
+                    expectedLocationsByLength[sequenceLength].append((int(expectedLocation),int(expectedLocation)))
+                else:
+                    expectedLocationStart, expectedLocationEnd = expectedLocation.split(':')
+                    if int(expectedLocationStart) > int(expectedLocationEnd):
+                        expectedLocationsByLength[sequenceLength].append((int(expectedLocationEnd),int(expectedLocationStart)))
+                    else:
+                        expectedLocationsByLength[sequenceLength].append((int(expectedLocationStart),int(expectedLocationEnd)))
+
+            acceptableBasesByLength[sequenceLength] = choppedUpLine[2].split(',')
+
+    return expectedLocationsByLength, acceptableBasesByLength
+
+
 # A class which stores all the relevant info for XR-Seq data as it is parsed from a variety of input formats,
 # and converts them to the output format.
 class XRSeqInputDataPipeline:
@@ -215,30 +396,7 @@ class XRSeqInputDataPipeline:
 
         # Read in information from the callParams File.
         self.callParamsFilePath = callParamsFilePath
-        self.expectedLocationsByLength = dict()
-        self.acceptableBasesByLength = dict()
-
-        with open(self.callParamsFilePath, 'r') as callParamsFile:
-            for line in callParamsFile:
-
-                choppedUpLine: List[str] = line.split()
-
-                sequenceLength = int(choppedUpLine[0])
-                assert sequenceLength not in self.expectedLocationsByLength
-
-                self.expectedLocationsByLength[sequenceLength] = list()
-                expectedLocations = choppedUpLine[1].split(',')
-                for expectedLocation in expectedLocations:
-                    if ':' not in expectedLocation:
-                        self.expectedLocationsByLength[sequenceLength].append((int(expectedLocation),int(expectedLocation)))
-                    else:
-                        expectedLocationStart, expectedLocationEnd = expectedLocation.split(':')
-                        if int(expectedLocationStart) > int(expectedLocationEnd):
-                            self.expectedLocationsByLength[sequenceLength].append((int(expectedLocationEnd),int(expectedLocationStart)))
-                        else:
-                            self.expectedLocationsByLength[sequenceLength].append((int(expectedLocationStart),int(expectedLocationEnd)))
-
-                self.acceptableBasesByLength[sequenceLength] = choppedUpLine[2].split(',')
+        self.expectedLocationsByLength, self.acceptableBasesByLength = readCallParams(self.callParamsFilePath)
 
         # Initialize these values as empty until we know what form the input data is in.
         self.bigWigReadsFilePathPair = None
@@ -248,6 +406,9 @@ class XRSeqInputDataPipeline:
         # Initialize a variable to keep track of whether or not the input reads have been trimmed.
         self.readsHaveBeenTrimmed = False
 
+        # The score value which represents a single read in the trimmed reads file.  (Only bedGraph data needs a different value.)
+        self.countUnit = 1
+
         # Determine what form the input data is in and assign it accordingly.
         if self.inputDataFilePath.endswith(".bigWig"):
             self.bigWigReadsFilePathPair = getFilePathPair(self.inputDataFilePath)
@@ -283,9 +444,8 @@ class XRSeqInputDataPipeline:
                 self.bedGraphReadsFilePathPair.append(os.path.join(intermediateFilesDirectory,
                                                                    os.path.basename(bigWigReadsFilePath).rsplit('.',1)[0]+".bedGraph"))
 
-        # Generate the trimmed reads output, the fasta output, and bed output file paths.
+        # Generate the trimmed reads output and bed output file paths.
         self.trimmedReadsFilePath = os.path.join(intermediateFilesDirectory,dataGroupName+"_trimmed_reads.bed")
-        self.fastaReadsFilePath = os.path.join(intermediateFilesDirectory,dataGroupName+"_trimmed_reads.fa")
         self.lesionsBedFilePath = generateFilePath(directory = intermediateFilesDirectory, dataGroup = dataGroupName,
                                                    dataType = DataTypeStr.customInput, fileExtension = ".bed") 
 
@@ -313,9 +473,8 @@ class XRSeqInputDataPipeline:
                                     self.bedGraphReadsFilePathPair[i]), check = True)
 
             # Generate the trimmed reads.
-            trimBedGraphXRSeqData(self.bedGraphReadsFilePathPair, self.trimmedReadsFilePath, 
-                                   getMinAdjustedCountValue(self.bedGraphReadsFilePathPair[0]),
-                                   self.acceptableBasesByLength.keys(), self.acceptableChromosomes)
+            self.countUnit = trimBedGraphXRSeqData(self.bedGraphReadsFilePathPair, self.trimmedReadsFilePath,
+                                                   self.acceptableBasesByLength.keys(), self.acceptableChromosomes)
 
         self.readsHaveBeenTrimmed = True
 
@@ -325,12 +484,10 @@ class XRSeqInputDataPipeline:
 
         if not self.readsHaveBeenTrimmed: raise ValueError("Trying to generate final output without trimmed reads.")
 
-        # Convert the trimmed file to fasta format to get the sequences associated with each read.
-        bedToFasta(self.trimmedReadsFilePath, self.genomeFilePath, self.fastaReadsFilePath)
-
-        # Find the lesions and write them to the final output file.
-        writeLesions(self.fastaReadsFilePath, self.lesionsBedFilePath, 
-                     self.expectedLocationsByLength, self.acceptableBasesByLength)
+        # Find the lesions (using the packed genome to get the sequences associated with each read)
+        # and write them to the final output file.
+        writeLesions(self.trimmedReadsFilePath, getPackedGenome(self.genomeFilePath), self.lesionsBedFilePath, 
+                     self.expectedLocationsByLength, self.acceptableBasesByLength, self.countUnit)
 
         return self.lesionsBedFilePath
 
@@ -1,8 +1,8 @@
 # This script contains a class for managing the writing of input data to various stratified data files.
 # Once set up, it only needs to be passed data one line at a time.
 
-import os, subprocess
-from typing import IO
+import os, heapq
+from typing import List, Tuple
 from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (Metadata, checkDirs, DataTypeStr, generateFilePath,
                                                                   generateMetadata)
 from mutperiodpy.input_parsing.IdentifyMSI import MSIIdentifier
@@ -10,22 +10,136 @@ from mutperiodpy.input_parsing.IdentifyMutSigs import MutSigIdentifier
 from benbiohelpers.CustomErrors import *
 
 
+# How many lines each output file holds in memory before writing them out.
+OUTPUT_BUFFER_LINE_NUM = 8192
+
+# The most sorted runs that are merged at once.  (Keeps the number of simultaneously open files reasonable.)
+MAX_MERGED_RUNS = 256
+
+
+# Returns the key that output lines are sorted on: the chromosome, then the (numeric) start position.
+# (Equivalent to "sort -k1,1 -k2,2n -s" with byte-wise comparison of chromosomes.)
+def getSortKey(line: bytes):
+    choppedUpLine = line.split(b'\t', 2)
+    return (choppedUpLine[0], float(choppedUpLine[1]))
+
+
+# Yields the lines of the given binary file from the start position (inclusive) to the end position (exclusive).
+def readRun(runFile, start, end):
+    runFile.seek(start)
+    position = start
+    for line in runFile:
+        if position >= end: return
+        position += len(line)
+        yield line
+
+
+# Sorts the given file, which is made up of sorted runs beginning at the given byte positions, by merging the runs.
+# Merging is stable, so lines with equal keys keep their original order.  If there are too many runs to merge at once,
+# they are merged in groups over multiple passes.
+def mergeSortedRuns(filePath, runStarts: List[int]):
+
+    runBounds = list(zip(runStarts, runStarts[1:] + [os.path.getsize(filePath)]))
+    currentFilePath = filePath
+    mergePass = 0
+
+    while True:
+
+        mergePass += 1
+        mergedFilePath = filePath + ".merge" + str(mergePass) + ".tmp"
+        mergedRunStarts = list()
+
+        with open(mergedFilePath, "wb") as mergedFile:
+            for i in range(0, len(runBounds), MAX_MERGED_RUNS):
+                mergedRunStarts.append(mergedFile.tell())
+                runFiles = [open(currentFilePath, "rb") for _ in runBounds[i:i+MAX_MERGED_RUNS]]
+                try:
+                    mergedFile.writelines(heapq.merge(*(readRun(runFile, start, end) for runFile, (start, end)
+                                                        in zip(runFiles, runBounds[i:i+MAX_MERGED_RUNS])), key = getSortKey))
+                finally:
+                    for runFile in runFiles: runFile.close()
+
+        if currentFilePath != filePath: os.remove(currentFilePath)
+        currentFilePath = mergedFilePath
+        if len(mergedRunStarts) == 1: break
+        runBounds = list(zip(mergedRunStarts, mergedRunStarts[1:] + [os.path.getsize(currentFilePath)]))
+
+    os.replace(currentFilePath, filePath)
+
+
+# An output file that keeps track of its mutation counts and of the sorted "runs" of lines written to it.
+# Data passed to the WriteManager is sorted within each cohort, so most output files are either already sorted
+# or are made up of a handful of sorted runs that can be merged, instead of needing to be sorted from scratch.
+# Lines are buffered and written out in blocks of OUTPUT_BUFFER_LINE_NUM.
+class SortedRunsOutputFile:
+
+    def __init__(self, filePath):
+
+        self.filePath = filePath
+        self.file = open(filePath, 'w')
+        self.buffer: List[str] = list()
+        self.mutCounts = 0
+
+        self.runStarts = [0] # The byte positions where each sorted run of lines starts.
+        self.lastSortKey = None
+
+
+    # Writes the given line, starting a new run if it doesn't sort after the last line.
+    def write(self, outputLine, sortKey):
+
+        if self.lastSortKey is not None and sortKey < self.lastSortKey:
+            self.flush()
+            self.runStarts.append(self.file.tell())
+        self.lastSortKey = sortKey
+
+        self.buffer.append(outputLine)
+        if len(self.buffer) >= OUTPUT_BUFFER_LINE_NUM: self.flush()
+
+
+    # Writes out any buffered lines.
+    def flush(self):
+
+        self.file.write(''.join(self.buffer))
+        self.mutCounts += len(self.buffer)
+        self.buffer.clear()
+
+
+    # Closes the file, sorts it if it isn't sorted already, and records its mutation counts in the metadata.
+    def closeAndSort(self):
+
+        self.flush()
+        self.file.close()
+        if len(self.runStarts) > 1: mergeSortedRuns(self.filePath, self.runStarts)
+        Metadata(self.filePath).addMetadata(Metadata.AddableKeys.mutCounts, self.mutCounts)
+
+
+    # Moves the file (open or closed) to the given path.
+    def moveTo(self, filePath):
+        os.replace(self.filePath, filePath)
+        self.filePath = filePath
+
+
+    # Closes and deletes the file without sorting it or recording its mutation counts.
+    def discard(self):
+        self.file.close()
+        os.remove(self.filePath)
+
+
+# If the context is not known when the manager is created, it can be given later with setContext, which opens the output files.
+# If the data needs to be written before its context is known (e.g. when the context is determined in the same pass over
+# the input that writes it), deferContext opens the output files under provisional names, which are replaced once the
+# context is set.
 class WriteManager:
 
-    def __init__(self, rootDataDir, context):
+    def __init__(self, rootDataDir, context = None):
 
         # Get the metadata from the given directory
         self.rootDataDir = rootDataDir
         self.rootMetadata = Metadata(self.rootDataDir)
-
-        # Record the data's context.
-        self.context = context
-
-        # create and open the output file in the same directory as the root data.
-        self.rootOutputFilePath = generateFilePath(directory = self.rootDataDir, dataGroup = self.rootMetadata.dataGroupName,
-                                                   context = self.context, dataType = DataTypeStr.mutations, fileExtension = ".bed")
-        self.rootOutputFile = open(self.rootOutputFilePath, 'w')
-        self.rootMutCounts = 0
+        self.context = None
+        self.requiredMutFromLength = None
+        self.outputFilesOpen = False
+        self.provisionalOutputFiles: List[Tuple[SortedRunsOutputFile, str, str]] = list() # Each file's directory and data group.
 
         # By default, all other write options are off unless otherwise specified.
         self.stratifyByIndividualCohorts = False
@@ -33,6 +147,97 @@ class WriteManager:
         self.stratifyByMutSig = False
         self.stratifyBySignature = False
 
+        # The stratified output files that each cohort's data is written to.  Determined once per cohort,
+        # after MSI and mutation signature identification have been completed.
+        self.cohortRoutingPrepared = False
+        self.cohortDestinations = dict()
+
+        if context is not None: self.setContext(context)
+
+
+    # Records the data's context and opens the output files whose names depend on it.
+    # If the output files were already opened by deferContext, they are moved to their final paths instead.
+    def setContext(self, context):
+
+        assert self.context is None, "The manager's context has already been set."
+
+        # Record the data's context.
+        self.context = context
+        if self.context == float("inf") or self.context == 0: self.requiredMutFromLength = None
+        else: self.requiredMutFromLength = self.context
+
+        if not self.outputFilesOpen:
+            self.openOutputFiles()
+            return
+
+        for outputFile, directory, dataGroup in self.provisionalOutputFiles:
+            outputFile.moveTo(self.getOutputFilePath(directory, dataGroup))
+        self.provisionalOutputFiles.clear()
+
+        self.rootOutputFilePath = self.rootOutputFile.filePath
+        if self.stratifyByMS:
+            self.aggregateMSSFilePath = self.aggregateMSSFile.filePath
+            self.aggregateMSIFilePath = self.aggregateMSIFile.filePath
+        if self.stratifyByMutSig:
+            self.mutSigFilePaths = {mutSig: mutSigFile.filePath for mutSig, mutSigFile in self.mutSigFiles.items()}
+        if self.stratifyByIndividualCohorts and self.currentIndividualCohortFile is not None:
+            self.individualCohortFilePath = self.currentIndividualCohortFile.filePath
+
+
+    # Opens the output files before the data's context is known.  They are given provisional names until setContext is called.
+    def deferContext(self):
+
+        assert self.context is None, "The manager's context has already been set."
+        assert not self.outputFilesOpen, "The manager's output files are already open."
+        self.openOutputFiles()
+
+
+    # Closes and deletes all the output files opened since deferContext was called, so that the data can be written again.
+    def discardOutput(self):
+
+        assert self.context is None, "Output can only be discarded before the manager's context is set."
+
+        for outputFile, _, _ in self.provisionalOutputFiles: outputFile.discard()
+        self.provisionalOutputFiles.clear()
+        self.cohortDestinations.clear()
+
+        if self.stratifyByIndividualCohorts:
+            self.currentIndividualCohortID = None
+            self.currentIndividualCohortFile = None
+            self.completedIndividualCohorts.clear()
+
+        self.outputFilesOpen = False
+
+
+    # Returns the path to the output file for the given data group in the given directory.
+    def getOutputFilePath(self, directory, dataGroup):
+        return generateFilePath(directory = directory, dataGroup = dataGroup, context = self.context,
+                                dataType = DataTypeStr.mutations, fileExtension = ".bed")
+
+
+    # Opens an output file for the given data group in the given directory.
+    # If the context hasn't been set, the file is given a provisional name until it is.
+    def openOutputFile(self, directory, dataGroup) -> SortedRunsOutputFile:
+
+        if self.context is not None: return SortedRunsOutputFile(self.getOutputFilePath(directory, dataGroup))
+
+        outputFile = SortedRunsOutputFile(generateFilePath(directory = directory, dataGroup = dataGroup,
+                                                           dataType = DataTypeStr.mutations, fileExtension = ".bed.tmp"))
+        self.provisionalOutputFiles.append((outputFile, directory, dataGroup))
+        return outputFile
+
+
+    # Opens the root output file (in the same directory as the root data) and any stratified output files set up so far.
+    def openOutputFiles(self):
+
+        self.rootOutputFile = self.openOutputFile(self.rootDataDir, self.rootMetadata.dataGroupName)
+        self.rootOutputFilePath = self.rootOutputFile.filePath
+
+        if self.stratifyByMS: self.openMSStratificationFiles()
+        if self.stratifyByMutSig: self.openMutSigFiles()
+
+        self.outputFilesOpen = True
+
 
     # Create the necessary functions to use the class with the "with" keyword.
     def __enter__(self): return self
@@ -49,7 +254,7 @@ class WriteManager:
         self.stratifyByIndividualCohorts = True
 
         self.currentIndividualCohortID = None # The cohort being written to at a point in time.
-        self.currentIndividualCohortFile: IO = None # The open file for the current cohort.
+        self.currentIndividualCohortFile: SortedRunsOutputFile = None # The open file for the current cohort.
         self.completedIndividualCohorts = dict() # A hashtable of cohorts that have been seen before and should NOT be revisited/rewritten.        
 
         # Create the directory.
@@ -75,15 +280,10 @@ class WriteManager:
                          os.path.join('..','..',self.rootMetadata.localParentDataPath), self.rootMetadata.inputFormat, aggregateMSSDirectory, "MSS")
         generateMetadata("MSI_" + self.rootMetadata.dataGroupName, self.rootMetadata.genomeName,
                          os.path.join('..','..',self.rootMetadata.localParentDataPath), self.rootMetadata.inputFormat, aggregateMSIDirectory, "MSI")
-        self.aggregateMSSMutCounts = 0
-        self.aggregateMSIMutCounts = 0
 
-        self.aggregateMSSFilePath = generateFilePath(directory = aggregateMSSDirectory, dataGroup = "MSS_" + self.rootMetadata.dataGroupName,
-                                                     context = self.context, dataType = DataTypeStr.mutations, fileExtension = ".bed")
-        self.aggregateMSSFile = open(self.aggregateMSSFilePath, 'w')
-        self.aggregateMSIFilePath = generateFilePath(directory = aggregateMSIDirectory, dataGroup = "MSI_" + self.rootMetadata.dataGroupName,
-                                                     context = self.context, dataType = DataTypeStr.mutations, fileExtension = ".bed")
-        self.aggregateMSIFile = open(self.aggregateMSIFilePath, 'w')
+        self.aggregateMSSDirectory = aggregateMSSDirectory
+        self.aggregateMSIDirectory = aggregateMSIDirectory
+        if self.outputFilesOpen: self.openMSStratificationFiles()
 
         # Set up the MSIIdentifier to be returned.
         intermediateFilesDir = os.path.join(self.rootDataDir,"intermediate_files")
@@ -97,6 +297,15 @@ class WriteManager:
         return(self.myMSIIdentifier)
 
 
+    # Opens the aggregate MSS and MSI output files.
+    def openMSStratificationFiles(self):
+
+        self.aggregateMSSFile = self.openOutputFile(self.aggregateMSSDirectory, "MSS_" + self.rootMetadata.dataGroupName)
+        self.aggregateMSSFilePath = self.aggregateMSSFile.filePath
+        self.aggregateMSIFile = self.openOutputFile(self.aggregateMSIDirectory, "MSI_" + self.rootMetadata.dataGroupName)
+        self.aggregateMSIFilePath = self.aggregateMSIFile.filePath
+
+
     # Prepares the manager to separate cohorts by microsatellite stability.
     # Returns a MutSigIdentifier object to be "completed" by the function caller.
     def setUpForMutSigStratification(self) -> MutSigIdentifier:
@@ -108,9 +317,7 @@ class WriteManager:
 
         # Create the necessary directories, file paths, and metadata.
         parentMutSigDirectory = os.path.join(self.rootMetadata.directory, "mut_sig_analysis")
-        self.mutSigFilePaths = dict()
-        self.mutSigFiles = dict()
-        self.mutSigMutCounts = dict()
+        self.mutSigDataGroupDirectories = dict()
 
         for mutSig in mutSigs:
 
@@ -125,13 +332,9 @@ class WriteManager:
                              os.path.join('..','..',self.rootMetadata.localParentDataPath), 
                              self.rootMetadata.inputFormat, thisMutSigDirectory, "mutSig" + mutSig)
 
-            # Mutation Counter
-            self.mutSigMutCounts[mutSig] = 0
+            self.mutSigDataGroupDirectories[mutSig] = (thisMutSigDataGroup, thisMutSigDirectory)
 
-            # File path
-            self.mutSigFilePaths[mutSig] = generateFilePath(directory = thisMutSigDirectory, dataGroup = thisMutSigDataGroup, 
-                                                            context = self.context, dataType = DataTypeStr.mutations, fileExtension = ".bed")
-            self.mutSigFiles[mutSig] = open(self.mutSigFilePaths[mutSig], 'w')
+        if self.outputFilesOpen: self.openMutSigFiles()
 
         # Set up the MutSigIdentifier object to be returned.
         intermediateFilesDir = os.path.join(self.rootDataDir,"intermediate_files")
@@ -146,14 +349,22 @@ class WriteManager:
         return(self.mutSigIdentifier)
 
 
+    # Opens the output files for each mutation signature.
+    def openMutSigFiles(self):
+
+        self.mutSigFilePaths = dict()
+        self.mutSigFiles = dict()
+
+        for mutSig, (thisMutSigDataGroup, thisMutSigDirectory) in self.mutSigDataGroupDirectories.items():
+            self.mutSigFiles[mutSig] = self.openOutputFile(thisMutSigDirectory, thisMutSigDataGroup)
+            self.mutSigFilePaths[mutSig] = self.mutSigFiles[mutSig].filePath
+
+
     # Open a new individual cohort file for writing (and close the last one, if applicable.)
     def setUpNewIndividualCohort(self, cohortID):
 
         # If this isn't the first opened cohort file, close and sort the last one.
-        if self.currentIndividualCohortFile is not None: 
-            self.currentIndividualCohortFile.close()
-            subprocess.run(("sort","-k1,1","-k2,2n",self.individualCohortFilePath,"-s","-o",self.individualCohortFilePath), check = True)
-            Metadata(self.individualCohortFilePath).addMetadata(Metadata.AddableKeys.mutCounts, self.currentIndividualCohortMutCounts)
+        if self.currentIndividualCohortFile is not None: self.currentIndividualCohortFile.closeAndSort()
 
         # Make sure this is actually a new cohort.
         if cohortID in self.completedIndividualCohorts:
@@ -180,110 +391,128 @@ class WriteManager:
                 
 
         # Generate the file path and metadata file and open the file for writing.
-        self.individualCohortFilePath = generateFilePath(directory = individualCohortDirectory, dataGroup = individualCohortDataGroup, 
-                                                         context = self.context, dataType = DataTypeStr.mutations, fileExtension = ".bed")
-        self.currentIndividualCohortFile = open(self.individualCohortFilePath, 'w')
+        self.currentIndividualCohortFile = self.openOutputFile(individualCohortDirectory, individualCohortDataGroup)
+        self.individualCohortFilePath = self.currentIndividualCohortFile.filePath
         generateMetadata(individualCohortDataGroup, self.rootMetadata.genomeName,
                          os.path.join("..",self.rootMetadata.localParentDataPath),
                          self.rootMetadata.inputFormat, individualCohortDirectory, *cohortMembership)
-        self.currentIndividualCohortMutCounts = 0
 
 
-    # Writes the given data to all the relevant files based on how the manager was set up.
-    def writeData(self, chromosome, startPos, endPos, mutFrom, alteration, strand, cohortID = '.'):
-
-        # Make sure we were passed a line that matches the manager's context.
-        assert self.context == float("inf") or self.context == 0 or self.context == len(mutFrom), ("mutFrom: \"" + mutFrom + "\" does not " +
-            "fit within the manager's context: " + str(self.context))
+    # Reads in the results of MSI and mutation signature identification, which determine where each cohort's data is written.
+    # Called once, the first time data with a cohort is written.
+    def prepareCohortRouting(self):
 
-        # Then, format it for output.
-        outputLine = '\t'.join((chromosome, startPos, endPos, mutFrom, alteration, strand)) + '\n'
+        if self.stratifyByMS:
+            if not self.myMSIIdentifier.MSICohortsIdentified:
+                raise ValueError("MSIIdentifier protocol was never completed.")
+            with open(self.MSICohortsFilePath, 'r') as MSICohortsFile:
+                for line in MSICohortsFile:
+                    self.MSICohorts[line.strip()] = None
 
-        # Write data to the root output file.
-        self.rootOutputFile.write(outputLine)
-        self.rootMutCounts += 1
+        if self.stratifyByMutSig:
+            if not self.mutSigIdentifier.mutSigsIdentified:
+                raise ValueError("MutSigIdentifier protocol was never completed.")
+            with open(self.mutSigDesignationsFilePath, 'r') as mutSigDesignationsFile:
+                for line in mutSigDesignationsFile:
 
-        # Write to microsatellite designation if it was set up.
-        if self.stratifyByMS and cohortID != '.':
+                    mutSigsCohortID = str(line).strip().split('\t')[0]
+                    mutSigs = str(line).strip().split('\t')[1].split(',')
 
-            # Make sure the MSICohorts hashtable has actually been propogated.
-            if len(self.MSICohorts) == 0:
-                if not self.myMSIIdentifier.MSICohortsIdentified:
-                    raise ValueError("MSIIdentifier protocol was never completed.")
-                else:
-                    with open(self.MSICohortsFilePath, 'r') as MSICohortsFile:
-                        for line in MSICohortsFile:
-                            self.MSICohorts[line.strip()] = None
+                    if mutSigs[0] == "None": continue
+                    else: self.mutSigDesignations[mutSigsCohortID] = mutSigs
 
-            if cohortID in self.MSICohorts:
-                self.aggregateMSIFile.write(outputLine)
-                self.aggregateMSIMutCounts += 1
-            else:
-                self.aggregateMSSFile.write(outputLine)
-                self.aggregateMSSMutCounts += 1
+        self.cohortRoutingPrepared = True
 
-        # Write to signature designations if it was set up.
-        if self.stratifyByMutSig and cohortID != '.':
 
-            # Propogate the mutSigDesignations dictionary if it hasn't been.
-            if len(self.mutSigDesignations) == 0:
-                if not self.mutSigIdentifier.mutSigsIdentified:
-                    raise ValueError("MutSigIdentifier protocol was never completed.")
-                else:
+    # Returns the microsatellite stability and mutation signature output files that the given cohort's data is written to.
+    def getCohortDestinations(self, cohortID) -> Tuple[SortedRunsOutputFile]:
 
-                    with open(self.mutSigDesignationsFilePath, 'r') as mutSigDesignationsFile:
-                        for line in mutSigDesignationsFile:
+        if cohortID not in self.cohortDestinations:
 
-                            mutSigsCohortID = str(line).strip().split('\t')[0]
-                            mutSigs = str(line).strip().split('\t')[1].split(',')
+            if not self.cohortRoutingPrepared: self.prepareCohortRouting()
+            destinations = list()
 
-                            if mutSigs[0] == "None": continue
-                            else: self.mutSigDesignations[mutSigsCohortID] = mutSigs
+            if self.stratifyByMS:
+                if cohortID in self.MSICohorts: destinations.append(self.aggregateMSIFile)
+                else: destinations.append(self.aggregateMSSFile)
 
-            # Write the data to its appropriate mutsig file(s) if its cohort has mutsig designations.
-            if cohortID in self.mutSigDesignations:
-                
+            if self.stratifyByMutSig and cohortID in self.mutSigDesignations:
                 for mutSig in self.mutSigDesignations[cohortID]:
-                    self.mutSigFiles[mutSig].write(outputLine)
-                    self.mutSigMutCounts[mutSig] += 1
+                    destinations.append(self.mutSigFiles[mutSig])
+
+            self.cohortDestinations[cohortID] = tuple(destinations)
+
+        return self.cohortDestinations[cohortID]
+
 
+    # Writes the given data to all the relevant files based on how the manager was set up.
+    def writeData(self, chromosome, startPos, endPos, mutFrom, alteration, strand, cohortID = '.'):
+        self.writeBatch(((chromosome, startPos, endPos, mutFrom, alteration, strand, cohortID),))
+
+
+    # Writes each of the given rows of data to all the relevant files based on how the manager was set up.
+    # Each row is a tuple of the chromosome, start pos, end pos, mutFrom, alteration, strand, and (optionally) cohort ID.
+    # Rows can be given as any iterable, including a generator.
+    def writeBatch(self, rows):
+
+        assert self.outputFilesOpen, "The manager's context must be set (or deferred) before writing data."
+        rootOutputFile = self.rootOutputFile
+        cohortDestinations = self.cohortDestinations
+
+        for row in rows:
+
+            # Make sure we were passed a line that matches the manager's context.
+            assert self.requiredMutFromLength is None or self.requiredMutFromLength == len(row[3]), (
+                "mutFrom: \"" + row[3] + "\" does not fit within the manager's context: " + str(self.context))
 
-        # Write to individual cohorts if desired.
-        if self.stratifyByIndividualCohorts and cohortID != '.':
-            
-            # Check to see if we've reached a new cohortID .
-            if self.currentIndividualCohortID is None or self.currentIndividualCohortID != cohortID:
-                self.completedIndividualCohorts[self.currentIndividualCohortID] = None
-                self.setUpNewIndividualCohort(cohortID)
+            # Format the row for output once, and reuse it for every relevant file.
+            outputLine = '\t'.join(row[:6]) + '\n'
+            sortKey = (row[0], float(row[1])) # (Comparing strings is equivalent to comparing their UTF-8 bytes.)
 
-            # Write to the current individual cohort.
-            self.currentIndividualCohortFile.write(outputLine)
-            self.currentIndividualCohortMutCounts += 1
+            # Write data to the root output file.
+            rootOutputFile.write(outputLine, sortKey)
+
+            # Everything else depends on the cohort.
+            if len(row) < 7 or row[6] == '.': continue
+            cohortID = row[6]
+
+            # Write to microsatellite stability and signature designations if they were set up.
+            destinations = cohortDestinations.get(cohortID)
+            if destinations is None: destinations = self.getCohortDestinations(cohortID)
+            for destination in destinations: destination.write(outputLine, sortKey)
+
+            # Write to individual cohorts if desired.
+            if self.stratifyByIndividualCohorts:
+
+                # Check to see if we've reached a new cohortID.
+                if self.currentIndividualCohortID != cohortID:
+                    self.completedIndividualCohorts[self.currentIndividualCohortID] = None
+                    self.setUpNewIndividualCohort(cohortID)
+
+                # Write to the current individual cohort.
+                self.currentIndividualCohortFile.write(outputLine, sortKey)
 
 
     # Closes open files to clean up the class after it's done being used.
+    # Any output files that didn't receive their data in sorted order are sorted by merging their sorted runs.
     def cleanupAndSort(self):
 
-        self.rootOutputFile.close()
-        subprocess.run(("sort","-k1,1","-k2,2n",self.rootOutputFilePath,"-s","-o",self.rootOutputFilePath), check = True)
-        Metadata(self.rootOutputFilePath).addMetadata(Metadata.AddableKeys.mutCounts, self.rootMutCounts)
-        
+        # If no output files were opened, there's nothing to do.  If the context was never set, the provisionally named
+        # output files are incomplete, so they are discarded.
+        if not self.outputFilesOpen: return
+        if self.context is None:
+            self.discardOutput()
+            return
+
+        self.rootOutputFile.closeAndSort()
 
         if self.stratifyByMS:
-            self.aggregateMSIFile.close()
-            subprocess.run(("sort","-k1,1","-k2,2n",self.aggregateMSIFilePath,"-s","-o",self.aggregateMSIFilePath), check = True)
-            Metadata(self.aggregateMSIFilePath).addMetadata(Metadata.AddableKeys.mutCounts, self.aggregateMSIMutCounts)
-            self.aggregateMSSFile.close()
-            subprocess.run(("sort","-k1,1","-k2,2n",self.aggregateMSSFilePath,"-s","-o",self.aggregateMSSFilePath), check = True)
-            Metadata(self.aggregateMSSFilePath).addMetadata(Metadata.AddableKeys.mutCounts, self.aggregateMSSMutCounts)
+            self.aggregateMSIFile.closeAndSort()
+            self.aggregateMSSFile.closeAndSort()
 
         if self.stratifyByMutSig:
             for mutSig in self.mutSigFiles:
-                self.mutSigFiles[mutSig].close()
-                subprocess.run(("sort","-k1,1","-k2,2n",self.mutSigFilePaths[mutSig],"-s","-o",self.mutSigFilePaths[mutSig]), check = True)
-                Metadata(self.mutSigFilePaths[mutSig]).addMetadata(Metadata.AddableKeys.mutCounts, self.mutSigMutCounts[mutSig])
+                self.mutSigFiles[mutSig].closeAndSort()
 
         if self.stratifyByIndividualCohorts and self.currentIndividualCohortFile is not None:
-            self.currentIndividualCohortFile.close()
-            subprocess.run(("sort","-k1,1","-k2,2n",self.individualCohortFilePath,"-s","-o",self.individualCohortFilePath), check = True)
-            Metadata(self.individualCohortFilePath).addMetadata(Metadata.AddableKeys.mutCounts, self.currentIndividualCohortMutCounts)
\ No newline at end of file
+            self.currentIndividualCohortFile.closeAndSort()
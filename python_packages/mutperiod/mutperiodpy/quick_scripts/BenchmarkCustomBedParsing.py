@@ -0,0 +1,67 @@
+# This script benchmarks the conversion step of custom bed parsing (convertToStandardInput and the WriteManager),
+# which is where each mutation is formatted and written to the root and stratified output files.
+# A random custom bed file with cohort designations (already sorted, as parseCustomBed would leave it) is generated
+# in a temporary data group directory, and the conversion's throughput is reported.  Run this script on two
+# revisions of mutperiod to compare their throughput before and after a change.
+# NOTE: Requires mutperiod's data directory to be set up, since the WriteManager reads data group metadata.
+import os, time, random, tempfile, argparse
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import generateMetadata, InputFormat
+from mutperiodpy.input_parsing.ParseCustomBed import convertToStandardInput
+from mutperiodpy.input_parsing.WriteManager import WriteManager
+
+
+# Writes a random custom bed file with the given number of rows spread across the given number of cohorts.
+# Rows are sorted by cohort, then chromosome, then position.
+def writeSyntheticCustomBed(customBedFilePath, rowNum, cohortNum, seed = 0):
+
+    randomGenerator = random.Random(seed)
+    chromosomes = sorted("chr" + str(i) for i in range(1,23))
+
+    with open(customBedFilePath, 'w') as customBedFile:
+        for cohort in range(cohortNum):
+
+            cohortRowNum = rowNum//cohortNum + (cohort < rowNum%cohortNum)
+            cohortRows = sorted((randomGenerator.choice(chromosomes), randomGenerator.randrange(100000000))
+                                for _ in range(cohortRowNum))
+
+            for chromosome, position in cohortRows:
+                mutFrom, mutTo = randomGenerator.choice(("CT", "CA", "TG", "GA", "AC"))
+                customBedFile.write('\t'.join((chromosome, str(position), str(position + 1), mutFrom, mutTo,
+                                               randomGenerator.choice("+-"), "cohort_" + str(cohort).zfill(4))) + '\n')
+
+
+def benchmarkCustomBedParsing(rowNum, cohortNum, separateIndividualCohorts):
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        dataDirectory = os.path.join(tempDir, "benchmark_data_group")
+        os.mkdir(dataDirectory)
+        customBedFilePath = os.path.join(dataDirectory, "benchmark_data_group_custom_input.bed")
+        generateMetadata("benchmark_data_group", "hg19", os.path.basename(customBedFilePath),
+                         InputFormat.customBed, dataDirectory)
+
+        print("Generating a custom bed file with", rowNum, "rows across", cohortNum, "cohorts...")
+        writeSyntheticCustomBed(customBedFilePath, rowNum, cohortNum)
+
+        print("Converting to standard input...")
+        startTime = time.perf_counter()
+        with WriteManager(dataDirectory, 1) as writeManager:
+            if separateIndividualCohorts: writeManager.setUpForIndividualCohorts()
+            convertToStandardInput(customBedFilePath, writeManager, True, False)
+        conversionTime = time.perf_counter() - startTime
+
+        print(f"Conversion (including sorting): {conversionTime:.3f}s   ({rowNum/conversionTime:,.0f} rows/s)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmark custom bed conversion throughput.")
+    parser.add_argument("-r", "--rows", type = int, default = 10000000, help = "The number of rows in the custom bed file.")
+    parser.add_argument("-c", "--cohorts", type = int, default = 100, help = "The number of cohorts the rows are spread across.")
+    parser.add_argument("-i", "--individual-cohorts", action = "store_true", help = "Also write each cohort to its own file.")
+    args = parser.parse_args()
+
+    benchmarkCustomBedParsing(args.rows, args.cohorts, args.individual_cohorts)
+
+
+if __name__ == "__main__": main()
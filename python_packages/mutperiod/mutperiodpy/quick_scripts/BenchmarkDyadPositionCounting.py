@@ -0,0 +1,99 @@
+# This script benchmarks the NumPy and multiplexed dyad position counting engines against the object-based
+# ThisInThatCounter counters, and checks that every engine produces identical nucleosome mutation counts files.
+# If no mutation file and nucleosome map are given, random synthetic ones are generated and used instead.
+import os, time, random, tempfile, filecmp, argparse
+from mutperiodpy.CountNucleosomePositionMutations import MutationsInNucleosomesCounter, MutationsInStrandedNucleosomesCounter
+from mutperiodpy.helper_scripts.DyadPositionCounting import (DyadPositionCountingTask, countMutationsInNucleosomeMaps,
+                                                             countMutationsInNucleosomeMapsWithNumPy)
+
+
+# Writes a sorted, random mutation file and nucleosome map to the given file paths.
+# Mutation and nucleosome strands are chosen from the given strand designations.
+def writeSyntheticData(mutationFilePath, nucleosomeMapFilePath, chromosomeLength, mutationNum, nucleosomeNum, seed = 0,
+                       mutationStrands = "+-", nucleosomeStrands = "+-"):
+
+    randomGenerator = random.Random(seed)
+    chromosomes = ("chr1", "chr2")
+
+    with open(mutationFilePath, 'w') as mutationFile:
+        for chromosome in chromosomes:
+            for position in sorted(randomGenerator.randrange(chromosomeLength) for _ in range(mutationNum//len(chromosomes))):
+                mutationFile.write('\t'.join((chromosome, str(position), str(position+1), 'C', 'T',
+                                              randomGenerator.choice(mutationStrands))) + '\n')
+
+    with open(nucleosomeMapFilePath, 'w') as nucleosomeMapFile:
+        for chromosome in chromosomes:
+            for position in sorted(randomGenerator.sample(range(1000, chromosomeLength), nucleosomeNum//len(chromosomes))):
+                nucleosomeMapFile.write('\t'.join((chromosome, str(position), str(position+1), '.', '.',
+                                                   randomGenerator.choice(nucleosomeStrands))) + '\n')
+
+    return list(chromosomes)
+
+
+def benchmarkDyadPositionCounting(mutationFilePath, nucleosomeMapFilePath, acceptableChromosomes, radii = (73, 1000),
+                                  useNucStrand = False):
+
+    if useNucStrand: CounterClass = MutationsInStrandedNucleosomesCounter
+    else: CounterClass = MutationsInNucleosomesCounter
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        def getOutputFilePath(engineName, radius):
+            return os.path.join(tempDir, f"{engineName}_{radius}_raw_nucleosome_mutation_counts.tsv")
+
+        # The object-based counter runs once per radius.
+        startTime = time.perf_counter()
+        for radius in radii:
+            counter = CounterClass(mutationFilePath, nucleosomeMapFilePath, getOutputFilePath("thisInThat", radius),
+                                   encompassingFeatureExtraRadius = radius, acceptableChromosomes = acceptableChromosomes)
+            counter.count()
+        thisInThatTime = time.perf_counter() - startTime
+
+        # The other engines handle every radius in one call.
+        engineTimes = dict()
+        for engineName, countingFunction in (("multiplexed", countMutationsInNucleosomeMaps),
+                                             ("numpy", countMutationsInNucleosomeMapsWithNumPy)):
+            countingTasks = [DyadPositionCountingTask(nucleosomeMapFilePath, radius, getOutputFilePath(engineName, radius))
+                             for radius in radii]
+            startTime = time.perf_counter()
+            countingFunction(mutationFilePath, countingTasks, acceptableChromosomes, useNucStrand)
+            engineTimes[engineName] = time.perf_counter() - startTime
+
+            for radius in radii:
+                if not filecmp.cmp(getOutputFilePath("thisInThat", radius), getOutputFilePath(engineName, radius), shallow = False):
+                    raise ValueError(f"The {engineName} engine's output differs from the object-based counter's "
+                                     f"for a radius of {radius}.")
+
+        print(f"ThisInThatCounter: {thisInThatTime:.3f}s")
+        for engineName, engineTime in engineTimes.items():
+            print(f"{engineName}: {engineTime:.3f}s   Speedup: {thisInThatTime/engineTime:.1f}x   (Output files identical)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmark dyad position counting engines.")
+    parser.add_argument("-m", "--mutation-file", help = "A sorted mutperiod mutation bed file.  "
+                        "If omitted (along with the nucleosome map), synthetic data is generated.")
+    parser.add_argument("-n", "--nucleosome-map", help = "A sorted nucleosome map bed file.")
+    parser.add_argument("-c", "--chromosomes", nargs = '+', help = "The acceptable chromosomes for the given files.")
+    parser.add_argument("-s", "--use-nuc-strand", action = "store_true", help = "Use the strand designations in the nucleosome map.")
+    parser.add_argument("--synthetic-mutations", type = int, default = 1000000,
+                        help = "The number of mutations in the synthetic data.")
+    parser.add_argument("--synthetic-nucleosomes", type = int, default = 100000,
+                        help = "The number of nucleosomes in the synthetic data.")
+    args = parser.parse_args()
+
+    if args.mutation_file is not None and args.nucleosome_map is not None:
+        if args.chromosomes is None: raise ValueError("Acceptable chromosomes must be given along with input files.")
+        benchmarkDyadPositionCounting(args.mutation_file, args.nucleosome_map, args.chromosomes, useNucStrand = args.use_nuc_strand)
+    else:
+        with tempfile.TemporaryDirectory() as tempDir:
+            mutationFilePath = os.path.join(tempDir, "synthetic_singlenuc_context_mutations.bed")
+            nucleosomeMapFilePath = os.path.join(tempDir, "synthetic_nucleosome_map.bed")
+            acceptableChromosomes = writeSyntheticData(mutationFilePath, nucleosomeMapFilePath, 10000000,
+                                                       args.synthetic_mutations, args.synthetic_nucleosomes)
+            benchmarkDyadPositionCounting(mutationFilePath, nucleosomeMapFilePath, acceptableChromosomes,
+                                          useNucStrand = args.use_nuc_strand)
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,102 @@
+# This script benchmarks the NumPy-backed genome context counter against the original per-base counting loop,
+# and checks that both produce byte-for-byte identical genome context frequency files.
+# If no genome fasta file is given, a random synthetic genome is generated and used instead.
+import os, time, random, tempfile, filecmp, argparse
+from benbiohelpers.FileSystemHandling.FastaFileIterator import FastaFileIterator
+from mutperiodpy.GenerateMutationBackground import countGenomeContexts, writeGenomeContextFrequencyFile
+
+
+contextNumToText = {1:"singlenuc", 2:"dinuc", 3:"trinuc", 4:"quadrunuc", 5:"pentanuc", 6:"hexanuc"}
+
+
+# The original counting loop from generateGenomeContextFrequencyFile, kept here as a reference implementation.
+def countGenomeContextsWithLoop(genomeFilePath, contextNum, acceptableChromosomes):
+
+    contextCounts=dict()
+
+    with open(genomeFilePath, 'r') as genomeFile:
+
+        extensionLength = contextNum/2 - 0.5
+        if contextNum % 2 == 0: halfBaseOffset = 0.5
+        else: halfBaseOffset = 0
+
+        for fastaEntry in FastaFileIterator(genomeFile, False):
+
+            if fastaEntry.sequenceName in acceptableChromosomes:
+
+                for i in range(0,len(fastaEntry.sequence)):
+
+                    if i + halfBaseOffset >= extensionLength and i + halfBaseOffset < len(fastaEntry.sequence) - extensionLength:
+                        context = fastaEntry.sequence[int(i+halfBaseOffset-extensionLength):int(i+halfBaseOffset+extensionLength+1)]
+                        contextCounts.setdefault(context,0)
+                        contextCounts[context] += 1
+
+    return contextCounts
+
+
+# Writes a random genome with the given chromosome lengths to the given file path.
+# A small fraction of bases are set to N so that N-containing contexts are exercised too.
+def writeSyntheticGenome(genomeFilePath, chromosomeLengths, seed = 0):
+
+    randomGenerator = random.Random(seed)
+    with open(genomeFilePath, 'w') as genomeFile:
+        for i, chromosomeLength in enumerate(chromosomeLengths):
+            genomeFile.write(">chr" + str(i+1) + '\n')
+            sequence = randomGenerator.choices("ACGTN", weights = (25,25,25,25,0.1), k = chromosomeLength)
+            for j in range(0, chromosomeLength, 60):
+                genomeFile.write(''.join(sequence[j:j+60]) + '\n')
+
+
+def benchmarkGenomeContextCounting(genomeFilePath, contextNums, acceptableChromosomes = None):
+
+    if acceptableChromosomes is None:
+        with open(genomeFilePath, 'r') as genomeFile:
+            acceptableChromosomes = [fastaEntry.sequenceName for fastaEntry in FastaFileIterator(genomeFile, False)]
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        for contextNum in contextNums:
+
+            contextText = contextNumToText[contextNum]
+            print("\nBenchmarking", contextText, "counting...")
+
+            startTime = time.perf_counter()
+            loopCounts = countGenomeContextsWithLoop(genomeFilePath, contextNum, acceptableChromosomes)
+            loopTime = time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            numpyCounts = countGenomeContexts(genomeFilePath, contextNum, acceptableChromosomes)
+            numpyTime = time.perf_counter() - startTime
+
+            loopFilePath = os.path.join(tempDir, contextText + "_loop_frequency.tsv")
+            numpyFilePath = os.path.join(tempDir, contextText + "_numpy_frequency.tsv")
+            writeGenomeContextFrequencyFile(loopCounts, loopFilePath, contextText)
+            writeGenomeContextFrequencyFile(numpyCounts, numpyFilePath, contextText)
+
+            if loopCounts != numpyCounts or not filecmp.cmp(loopFilePath, numpyFilePath, shallow = False):
+                raise ValueError("Context counts differ between the loop and NumPy implementations for " + contextText + "s.")
+
+            print(f"Loop: {loopTime:.3f}s   NumPy: {numpyTime:.3f}s   Speedup: {loopTime/numpyTime:.1f}x   (Output files identical)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmark genome context frequency counting.")
+    parser.add_argument("-g", "--genome", help = "A genome fasta file to count contexts in. "
+                        "If omitted, a synthetic genome is generated.")
+    parser.add_argument("-c", "--contexts", type = int, nargs = '+', default = [1, 2, 3, 4, 5, 6],
+                        help = "The context widths to benchmark.")
+    parser.add_argument("--synthetic-length", type = int, default = 2000000,
+                        help = "The length of each of the 3 chromosomes in the synthetic genome.")
+    args = parser.parse_args()
+
+    if args.genome is not None:
+        benchmarkGenomeContextCounting(args.genome, args.contexts)
+    else:
+        with tempfile.TemporaryDirectory() as tempDir:
+            genomeFilePath = os.path.join(tempDir, "synthetic.fa")
+            writeSyntheticGenome(genomeFilePath, (args.synthetic_length,)*3)
+            benchmarkGenomeContextCounting(genomeFilePath, args.contexts)
+
+
+if __name__ == "__main__": main()
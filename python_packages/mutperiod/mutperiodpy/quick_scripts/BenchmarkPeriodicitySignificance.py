@@ -0,0 +1,52 @@
+# This script benchmarks SNR significance testing on synthetic single nucleosome counts profiles, some periodic and some not,
+# and checks that the resulting p-values are the same regardless of the number of jobs used.
+import time, argparse
+import numpy as np
+from mutperiodpy.helper_scripts.LombScargle import (getScannedFrequencies, getLombScarglePowers, getPeriodicityStatistics,
+                                                    ResamplingMethod)
+from mutperiodpy.RunNucleosomeMutationAnalysis import getSNRPValues, SINGLE_NUC_PERIODICITY_PARAMETERS
+
+
+def benchmarkPeriodicitySignificance(profileNum, resampleNum, jobCounts, resamplingMethod: ResamplingMethod, seed = 0):
+
+    dyadPosCutoff, fromPeriod, toPeriod = SINGLE_NUC_PERIODICITY_PARAMETERS
+    dyadPositions = np.arange(-dyadPosCutoff, dyadPosCutoff + 1, dtype = np.float64)
+
+    # Every other profile oscillates with a period of 10.2.
+    randomGenerator = np.random.default_rng(seed)
+    amplitudes = np.where(np.arange(profileNum)%2 == 0, 0.2, 0)
+    countsProfiles = list(randomGenerator.poisson(50*(1 + amplitudes[:,None]*np.cos(2*np.pi*dyadPositions/10.2)[None,:]))
+                          .astype(np.float64))
+
+    frequencies = getScannedFrequencies(dyadPositions, fromPeriod, toPeriod)
+    observedSNRs = getPeriodicityStatistics(frequencies, getLombScarglePowers(dyadPositions, np.vstack(countsProfiles), frequencies))[2]
+    countsProfileGroups = {(fromPeriod, toPeriod, dyadPositions.tobytes()): list(range(profileNum))}
+
+    pValuesByJobCount = dict()
+    for jobs in jobCounts:
+        startTime = time.perf_counter()
+        pValuesByJobCount[jobs] = getSNRPValues(countsProfileGroups, countsProfiles, observedSNRs, None,
+                                                resamplingMethod, resampleNum, seed, jobs)
+        print(f"{jobs} job(s): {time.perf_counter() - startTime:.3f}s for {profileNum} profiles with {resampleNum} resamples each")
+
+    pValues = pValuesByJobCount[jobCounts[0]]
+    print(f"Median p-value for periodic profiles: {np.median(pValues[::2]):.4g}, non-periodic profiles: {np.median(pValues[1::2]):.4g}")
+    if all(np.array_equal(pValues, otherPValues) for otherPValues in pValuesByJobCount.values()):
+        print("P-values are identical for every number of jobs.")
+    else: raise AssertionError("P-values differ between numbers of jobs.")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmark SNR significance testing.")
+    parser.add_argument("-p", "--profile-num", type = int, default = 100, help = "The number of synthetic counts profiles.")
+    parser.add_argument("-r", "--resample-num", type = int, default = 1000, help = "The number of resamples for each profile.")
+    parser.add_argument("-j", "--jobs", type = int, nargs = '+', default = [1, 4], help = "The numbers of jobs to benchmark.")
+    parser.add_argument("-m", "--method", choices = [method.value for method in ResamplingMethod],
+                        default = ResamplingMethod.permutation.value, help = "The resampling method.")
+    args = parser.parse_args()
+
+    benchmarkPeriodicitySignificance(args.profile_num, args.resample_num, args.jobs, ResamplingMethod(args.method))
+
+
+if __name__ == "__main__": main()
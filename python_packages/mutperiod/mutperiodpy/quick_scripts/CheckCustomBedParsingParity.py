@@ -0,0 +1,162 @@
+# This script checks that parsing custom bed input in a single pass (streaming) produces output identical to the default
+# parsing steps.  Synthetic custom bed files are parsed both ways, sorted and unsorted, plain and gzipped, with and without
+# cohort designations (and individual cohorts), and with microsatellite stability and mutation signature stratification.
+# The inputs include auto-acquired bases and strands, indels, multi-base substitutions, and tied positions, with chromosome
+# and cohort names whose order depends on the locale.  Every output file (and metadata file, aside from its time stamp)
+# must be byte-identical between the two modes.
+# NOTE: Requires mutperiod's data directory to be set up, since the parsers read data group metadata.
+#       Stratification also requires Rscript with MSIseq and deconstructSigs.  Use --no-stratification to skip those cases.
+import os, gzip, random, tempfile, argparse
+from mutperiodpy.input_parsing.ParseCustomBed import parseCustomBed, getCustomBedSortKey
+
+
+CHROMOSOME_LENGTHS = {"chr1": 200000, "chr10": 100000, "chr2": 150000, "chrX": 100000, "chr_Un": 20000}
+COHORTS = ("TCGA-A1", "tcga-b2", "Sample_10", "sample_9", "x.1")
+COMPLEMENTS = {'A':'T', 'C':'G', 'G':'C', 'T':'A'}
+
+
+# Writes a random genome fasta file with the chromosomes in CHROMOSOME_LENGTHS.  Returns the chromosome sequences.
+def writeSyntheticGenome(genomeFilePath, randomGenerator: random.Random):
+
+    sequences = dict()
+    with open(genomeFilePath, 'w') as genomeFile:
+        for chromosome, length in CHROMOSOME_LENGTHS.items():
+            sequences[chromosome] = ''.join(randomGenerator.choice("ACGT") for _ in range(length))
+            genomeFile.write('>' + chromosome + '\n')
+            for i in range(0, length, 60): genomeFile.write(sequences[chromosome][i:i+60] + '\n')
+
+    return sequences
+
+
+def reverseComplement(sequence):
+    return ''.join(COMPLEMENTS[base] for base in reversed(sequence))
+
+
+# Returns a list of random custom bed rows (as lists of strings) for the given genome sequences.
+def getSyntheticCustomBedRows(sequences, rowNum, cohortsPresent, onlySingleBaseSubs, randomGenerator: random.Random):
+
+    rows = list()
+    for _ in range(rowNum):
+
+        # Sometimes reuse the last position, so that the sorts have ties to keep in order.
+        if len(rows) > 0 and randomGenerator.random() < 0.05: chromosome, start = rows[-1][0], int(rows[-1][1])
+        else:
+            chromosome = randomGenerator.choice(tuple(sequences))
+            start = randomGenerator.randrange(len(sequences[chromosome]) - 3)
+
+        mutationType = "SBS" if onlySingleBaseSubs else randomGenerator.choices(("SBS", "DBS", "INS", "DEL"), (85, 5, 5, 5))[0]
+        end = start + (1 if mutationType in ("SBS", "DEL") else 2)
+        strand = randomGenerator.choice("+-")
+        referenceBases = sequences[chromosome][start:end]
+        if strand == '-': referenceBases = reverseComplement(referenceBases)
+
+        if mutationType == "INS": referenceBases, mutation = '*', randomGenerator.choice("ACGT")
+        elif mutationType == "DEL": mutation = '*'
+        elif randomGenerator.random() < 0.05: mutation = '.'
+        else: mutation = ''.join(randomGenerator.choice(tuple(set("ACGT") - {base})) for base in referenceBases)
+
+        # Request some auto-acquiring.
+        if referenceBases != '*':
+            autoAcquire = randomGenerator.random()
+            if autoAcquire < 0.1: referenceBases = '.'
+            elif autoAcquire < 0.2: strand = '.'
+
+        row = [chromosome, str(start), str(end), referenceBases, mutation, strand]
+        if cohortsPresent: row.append(randomGenerator.choice(COHORTS) if randomGenerator.random() > 0.05 else '.')
+        rows.append(row)
+
+    return rows
+
+
+# Writes the given rows to the given custom bed file (gzipped if the path ends in ".gz").
+def writeCustomBed(customBedFilePath, rows):
+    openFunction = gzip.open if customBedFilePath.endswith(".gz") else open
+    with openFunction(customBedFilePath, "wt") as customBedFile:
+        for row in rows: customBedFile.write('\t'.join(row) + '\n')
+
+
+# Returns the contents of each file produced by parsing in the given data directory, by path relative to the directory.
+# (The input file and intermediate files are skipped, and time stamps are removed from metadata files.)
+def getOutputFileContents(dataDirectory, inputFileName):
+
+    outputFileContents = dict()
+    for directory, subdirectories, fileNames in os.walk(dataDirectory):
+        if "intermediate_files" in subdirectories: subdirectories.remove("intermediate_files")
+        for fileName in fileNames:
+            if fileName == inputFileName: continue
+            filePath = os.path.join(directory, fileName)
+            with open(filePath, "rb") as outputFile: contents = outputFile.readlines()
+            if fileName == ".metadata": contents = [line for line in contents if not line.startswith(b"dateTime:")]
+            outputFileContents[os.path.relpath(filePath, dataDirectory)] = contents
+
+    return outputFileContents
+
+
+# Parses the given rows with both modes and compares their output.  Returns a description of each difference found.
+def checkCase(rows, genomeFilePath, tempDir, caseName, compressed, stratifyByMS, stratifyByMutSig, separateIndividualCohorts):
+
+    dataGroup = "parity_check"
+    inputFileName = dataGroup + "_custom_input.bed" + (".gz" if compressed else '')
+    outputFileContents = dict()
+
+    for streaming in (False, True):
+        dataDirectory = os.path.join(tempDir, caseName, "streaming" if streaming else "default", dataGroup)
+        os.makedirs(dataDirectory)
+        writeCustomBed(os.path.join(dataDirectory, inputFileName), rows)
+        parseCustomBed([os.path.join(dataDirectory, inputFileName)], genomeFilePath, stratifyByMS, stratifyByMutSig,
+                       separateIndividualCohorts, streaming = streaming)
+        outputFileContents[streaming] = getOutputFileContents(dataDirectory, inputFileName)
+
+    differences = list()
+    for relativeFilePath in sorted(set(outputFileContents[False]) | set(outputFileContents[True])):
+        if relativeFilePath not in outputFileContents[True]: differences.append(relativeFilePath + " (missing when streaming)")
+        elif relativeFilePath not in outputFileContents[False]: differences.append(relativeFilePath + " (only when streaming)")
+        elif outputFileContents[False][relativeFilePath] != outputFileContents[True][relativeFilePath]:
+            differences.append(relativeFilePath)
+
+    print(f"{caseName}: {len(outputFileContents[True])} files, " +
+          ("identical" if len(differences) == 0 else "DIFFERENT: " + ", ".join(differences)))
+    return [caseName + ": " + difference for difference in differences]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Check that streaming custom bed parsing matches the default parsing steps.")
+    parser.add_argument("-r", "--rows", type = int, default = 20000, help = "The number of rows in each synthetic custom bed file.")
+    parser.add_argument("--no-stratification", action = "store_true",
+                        help = "Skip the microsatellite stability and mutation signature stratification cases (which require R).")
+    args = parser.parse_args()
+
+    randomGenerator = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        genomeFilePath = os.path.join(tempDir, "synthetic_genome", "synthetic_genome.fa")
+        os.mkdir(os.path.dirname(genomeFilePath))
+        sequences = writeSyntheticGenome(genomeFilePath, randomGenerator)
+
+        differences = list()
+        for cohortsPresent in (False, True):
+            for onlySingleBaseSubs in (True, False):
+
+                rows = getSyntheticCustomBedRows(sequences, args.rows, cohortsPresent, onlySingleBaseSubs, randomGenerator)
+                sortedRows = sorted(rows, key = getCustomBedSortKey)
+                stratifications = [(False, False)]
+                if cohortsPresent and not args.no_stratification: stratifications.append((True, True))
+
+                for inputIsSorted in (True, False):
+                    for compressed in (False, True):
+                        for stratifyByMS, stratifyByMutSig in stratifications:
+                            caseName = '_'.join(("cohorts" if cohortsPresent else "no_cohorts",
+                                                 "sbs" if onlySingleBaseSubs else "mixed",
+                                                 "sorted" if inputIsSorted else "unsorted",
+                                                 "gzipped" if compressed else "plain") +
+                                                (("stratified",) if stratifyByMS else ()))
+                            differences += checkCase(sortedRows if inputIsSorted else rows, genomeFilePath, tempDir, caseName,
+                                                     compressed, stratifyByMS, stratifyByMutSig, cohortsPresent)
+
+    if len(differences) == 0: print("All custom bed parsing output is identical.")
+    else: raise AssertionError("Custom bed parsing output differs for:\n" + '\n'.join(differences))
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,69 @@
+# This script checks that the multiplexed and NumPy dyad position counting engines produce the same nucleosome mutation counts
+# files as the ThisInThatCounter-based counters in CountNucleosomePositionMutations.
+# Synthetic mutations on the '+', '-', and '.' strands (like indels) are counted around synthetic nucleosomes in single nucleosome
+# (with and without linker DNA) and nucleosome group radii, both with and without the nucleosome map's strand designations.
+# NOTE: Requires benbiohelpers (for the ThisInThatCounter counters).
+import os, tempfile, filecmp, argparse
+from mutperiodpy.CountNucleosomePositionMutations import MutationsInNucleosomesCounter, MutationsInStrandedNucleosomesCounter
+from mutperiodpy.helper_scripts.DyadPositionCounting import (DyadPositionCountingTask, countMutationsInNucleosomeMaps,
+                                                             countMutationsInNucleosomeMapsWithNumPy)
+from mutperiodpy.quick_scripts.BenchmarkDyadPositionCounting import writeSyntheticData
+
+
+# The radii checked: single nucleosome, single nucleosome with linker DNA, and nucleosome group.
+RADII = (73, 103, 1000)
+
+
+# Counts the given mutations around the given nucleosomes with every engine and compares the output files.
+# Returns the names of any cases whose output differs from the ThisInThatCounter output.
+def checkCounts(mutationFilePath, nucleosomeMapFilePath, acceptableChromosomes, useNucStrand, directory):
+
+    if useNucStrand: CounterClass = MutationsInStrandedNucleosomesCounter
+    else: CounterClass = MutationsInNucleosomesCounter
+
+    def getOutputFilePath(engineName, radius):
+        return os.path.join(directory, f"{engineName}_{radius}_stranded_{useNucStrand}_raw_nucleosome_mutation_counts.tsv")
+
+    for radius in RADII:
+        counter = CounterClass(mutationFilePath, nucleosomeMapFilePath, getOutputFilePath("thisInThat", radius),
+                               encompassingFeatureExtraRadius = radius, acceptableChromosomes = acceptableChromosomes)
+        counter.count()
+
+    mismatches = list()
+    for engineName, countingFunction in (("multiplexed", countMutationsInNucleosomeMaps),
+                                         ("numpy", countMutationsInNucleosomeMapsWithNumPy)):
+
+        countingFunction(mutationFilePath, [DyadPositionCountingTask(nucleosomeMapFilePath, radius, getOutputFilePath(engineName, radius))
+                                            for radius in RADII], acceptableChromosomes, useNucStrand)
+
+        for radius in RADII:
+            name = f"{engineName}_radius_{radius}_stranded_{useNucStrand}"
+            identical = filecmp.cmp(getOutputFilePath("thisInThat", radius), getOutputFilePath(engineName, radius), shallow = False)
+            print(f"{name}: {'identical' if identical else 'DIFFERENT'}")
+            if not identical: mismatches.append(name)
+
+    return mismatches
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Check the dyad position counting engines against ThisInThatCounter.")
+    parser.add_argument("--synthetic-mutations", type = int, default = 100000, help = "The number of synthetic mutations.")
+    parser.add_argument("--synthetic-nucleosomes", type = int, default = 10000, help = "The number of synthetic nucleosomes.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        mutationFilePath = os.path.join(tempDir, "synthetic_singlenuc_context_mutations.bed")
+        nucleosomeMapFilePath = os.path.join(tempDir, "synthetic_nucleosome_map.bed")
+        acceptableChromosomes = writeSyntheticData(mutationFilePath, nucleosomeMapFilePath, 1000000, args.synthetic_mutations,
+                                                   args.synthetic_nucleosomes, mutationStrands = "+-.")
+
+        mismatches = [mismatch for useNucStrand in (False, True)
+                      for mismatch in checkCounts(mutationFilePath, nucleosomeMapFilePath, acceptableChromosomes, useNucStrand, tempDir)]
+
+    if len(mismatches) == 0: print("All dyad position counts are identical.")
+    else: raise AssertionError("Dyad position counts differ for: " + ", ".join(mismatches))
+
+
+if __name__ == "__main__": main()
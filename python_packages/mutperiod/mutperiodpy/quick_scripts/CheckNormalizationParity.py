@@ -0,0 +1,115 @@
+# This script checks that the Python normalization engine produces the same normalized counts files as the original
+# R script (NormalizeNucleosomeMutationCounts.R), and reports how long each engine takes.
+# Synthetic raw and background counts files are generated to cover each case the normalization handles
+# (context and custom backgrounds, half-base positions in either table, zero expected counts, alternative scaling),
+# and any given pairs of raw and background counts files are checked as well.
+# NOTE: Requires Rscript and the mutperiodR package.
+import os, time, random, tempfile, argparse, subprocess
+import numpy as np
+from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import rScriptsDirectory
+from mutperiodpy.helper_scripts.RDataTableCompatibility import readDataTable
+from mutperiodpy.NormalizeMutationCounts import (normalizeNucleosomeMutationCounts, BACKGROUND_COUNTS_HEADERS,
+                                                 RAW_COUNTS_HEADERS)
+
+
+# Writes a random counts table with the given headers across the given dyad radius.
+# Values are integers for raw counts headers, and doubles for background headers.
+def writeSyntheticCounts(filePath, headers, dyadRadius, halfBasePositions, randomGenerator: random.Random, zeroFraction = 0):
+
+    halfBaseOffset = 0.5 if halfBasePositions else 0
+    with open(filePath, 'w') as countsFile:
+        countsFile.write('\t'.join(headers) + '\n')
+        for i in range(-dyadRadius, dyadRadius + (not halfBasePositions)):
+            if headers == RAW_COUNTS_HEADERS:
+                plus, minus, aligned = (randomGenerator.randrange(200) for _ in range(3))
+                values = (str(plus), str(minus), str(plus + minus), str(aligned))
+            elif randomGenerator.random() < zeroFraction: values = ('0',)*4
+            else:
+                plus, minus, aligned = (randomGenerator.uniform(0, 150) for _ in range(3))
+                values = (str(plus), str(minus), str(plus + minus), str(aligned))
+            countsFile.write('\t'.join((str(i + halfBaseOffset),) + values) + '\n')
+
+
+# Returns the synthetic test cases as (name, raw counts file path, background counts file path, alternative scaling factor).
+def writeSyntheticCases(directory, seed = 0):
+
+    randomGenerator = random.Random(seed)
+    cases = list()
+
+    for name, dyadRadius, rawHalfBase, backgroundHeaders, backgroundHalfBase, zeroFraction, alternativeScalingFactor in (
+        ("context_single_nuc", 73, False, BACKGROUND_COUNTS_HEADERS, False, 0, None),
+        ("context_nuc_group", 1000, False, BACKGROUND_COUNTS_HEADERS, False, 0, None),
+        ("context_alternative_scaling", 73, False, BACKGROUND_COUNTS_HEADERS, False, 0, 1),
+        ("context_zero_expected", 73, False, BACKGROUND_COUNTS_HEADERS, False, 0.2, None),
+        ("half_base_background", 73, False, BACKGROUND_COUNTS_HEADERS, True, 0, None),
+        ("half_base_raw", 73, True, BACKGROUND_COUNTS_HEADERS, False, 0, None),
+        ("custom_background", 103, False, RAW_COUNTS_HEADERS, False, 0, 0.4371942),
+    ):
+        rawCountsFilePath = os.path.join(directory, name + "_raw_nucleosome_mutation_counts.tsv")
+        backgroundCountsFilePath = os.path.join(directory, name + "_background.tsv")
+        writeSyntheticCounts(rawCountsFilePath, RAW_COUNTS_HEADERS, dyadRadius, rawHalfBase, randomGenerator)
+        writeSyntheticCounts(backgroundCountsFilePath, backgroundHeaders, dyadRadius, backgroundHalfBase,
+                             randomGenerator, zeroFraction)
+        cases.append((name, rawCountsFilePath, backgroundCountsFilePath, alternativeScalingFactor))
+
+    return cases
+
+
+# Normalizes the given case with both engines and compares the results.  Returns whether or not the files are identical.
+def checkCase(name, rawCountsFilePath, backgroundCountsFilePath, alternativeScalingFactor, directory):
+
+    pythonFilePath = os.path.join(directory, name + "_python_normalized.tsv")
+    rFilePath = os.path.join(directory, name + "_R_normalized.tsv")
+
+    startTime = time.perf_counter()
+    normalizeNucleosomeMutationCounts(rawCountsFilePath, backgroundCountsFilePath, pythonFilePath, alternativeScalingFactor)
+    pythonTime = time.perf_counter() - startTime
+
+    args = ["Rscript", os.path.join(rScriptsDirectory, "NormalizeNucleosomeMutationCounts.R"),
+            rawCountsFilePath, backgroundCountsFilePath, rFilePath]
+    if alternativeScalingFactor is not None: args.append(str(alternativeScalingFactor))
+    startTime = time.perf_counter()
+    subprocess.run(args, check = True, stderr = subprocess.DEVNULL)
+    rTime = time.perf_counter() - startTime
+
+    with open(pythonFilePath, 'r') as pythonFile, open(rFilePath, 'r') as rFile:
+        identical = pythonFile.read() == rFile.read()
+
+    # If the files differ, report how much their values differ by.
+    if identical: difference = "identical"
+    else:
+        pythonColumns, rColumns = readDataTable(pythonFilePath), readDataTable(rFilePath)
+        if list(pythonColumns) != list(rColumns): difference = "DIFFERENT HEADERS"
+        else:
+            maxRelativeDifference = max(np.nanmax(np.abs(pythonColumns[header] - rColumns[header]) /
+                                                  np.maximum(np.abs(rColumns[header]), 1e-300), initial = 0)
+                                        for header in rColumns)
+            difference = f"DIFFERENT (max relative difference: {maxRelativeDifference:.3g})"
+
+    print(f"{name}: {difference}   (Python: {pythonTime:.4f}s, R: {rTime:.3f}s)")
+    return identical
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Check the Python normalization engine against the R script.")
+    parser.add_argument("-p", "--pairs", nargs = 2, action = "append", default = list(),
+                        metavar = ("RAW_COUNTS_FILE", "BACKGROUND_COUNTS_FILE"),
+                        help = "A raw counts file and the background counts file to normalize it with.  May be repeated.")
+    parser.add_argument("-a", "--alternative-scaling-factor", type = float,
+                        help = "An alternative scaling factor to use with the given pairs.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        cases = writeSyntheticCases(tempDir)
+        for i, (rawCountsFilePath, backgroundCountsFilePath) in enumerate(args.pairs):
+            cases.append((f"given_pair_{i+1}", rawCountsFilePath, backgroundCountsFilePath, args.alternative_scaling_factor))
+
+        mismatches = [case[0] for case in cases if not checkCase(*case, tempDir)]
+
+    if len(mismatches) == 0: print("All normalized counts files are identical.")
+    else: raise AssertionError("Normalized counts files differ for: " + ", ".join(mismatches))
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,70 @@
+# This script checks that sequences fetched from the packed genome match those extracted by bedtools getfasta
+# (the extraction the packed genome replaced).  A synthetic fasta file with soft-masked (lowercase) stretches,
+# IUPAC ambiguity codes, and Ns is written, and random intervals on both strands (some extending past the ends
+# of their chromosomes, which getfasta skips) are extracted both ways and compared.
+# NOTE: Requires bedtools.
+import os, random, tempfile, subprocess, argparse
+from mutperiodpy.helper_scripts.PackedGenome import getPackedGenome
+
+
+CHROMOSOME_LENGTHS = {"chr1": 50000, "chr2": 30000, "chrM": 1000}
+AMBIGUOUS_BASES = "NRYKMBVDHSW"
+
+
+# Writes a random fasta file with the chromosomes in CHROMOSOME_LENGTHS, soft-masking every third block of bases.
+def writeSoftMaskedGenome(genomeFilePath, randomGenerator: random.Random):
+
+    with open(genomeFilePath, 'w') as genomeFile:
+        for chromosome, length in CHROMOSOME_LENGTHS.items():
+
+            sequence = ''.join(randomGenerator.choice(AMBIGUOUS_BASES) if randomGenerator.random() < 0.01
+                               else randomGenerator.choice("ACGT") for _ in range(length))
+            sequence = ''.join(base.lower() if (i//500) % 3 == 1 else base for i, base in enumerate(sequence))
+
+            genomeFile.write('>' + chromosome + " synthetic chromosome\n")
+            for i in range(0, length, 60): genomeFile.write(sequence[i:i+60] + '\n')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Check packed genome sequences against bedtools getfasta.")
+    parser.add_argument("-n", "--intervals", type = int, default = 100000, help = "The number of random intervals to check.")
+    args = parser.parse_args()
+
+    randomGenerator = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        genomeFilePath = os.path.join(tempDir, "soft_masked", "soft_masked.fa")
+        os.mkdir(os.path.dirname(genomeFilePath))
+        writeSoftMaskedGenome(genomeFilePath, randomGenerator)
+
+        intervals = list()
+        for _ in range(args.intervals):
+            chromosome = randomGenerator.choice(tuple(CHROMOSOME_LENGTHS))
+            start = randomGenerator.randrange(CHROMOSOME_LENGTHS[chromosome])
+            intervals.append((chromosome, start, start + randomGenerator.randrange(1, 200), randomGenerator.choice("+-")))
+
+        bedFilePath = os.path.join(tempDir, "intervals.bed")
+        with open(bedFilePath, 'w') as bedFile:
+            for chromosome, start, end, strand in intervals:
+                bedFile.write('\t'.join((chromosome, str(start), str(end), '.', '.', strand)) + '\n')
+
+        # Extract the sequences with bedtools, keyed by their location.
+        getFastaOutput = subprocess.run(("bedtools", "getfasta", "-fi", genomeFilePath, "-bed", bedFilePath, "-s", "-tab"),
+                                        check = True, capture_output = True, text = True).stdout
+        getFastaSequences = dict(line.split('\t') for line in getFastaOutput.splitlines())
+
+        packedGenome = getPackedGenome(genomeFilePath)
+        mismatches = 0
+        for chromosome, start, end, strand in intervals:
+            expectedSequence = getFastaSequences.get(f"{chromosome}:{start}-{end}({strand})")
+            if packedGenome.fetch(chromosome, start, end, strand) != expectedSequence:
+                mismatches += 1
+                if mismatches <= 10: print("Mismatch at", f"{chromosome}:{start}-{end}({strand})")
+
+    if mismatches == 0: print("All", len(intervals), "packed genome sequences match bedtools getfasta.")
+    else: raise AssertionError(str(mismatches) + " packed genome sequences differ from bedtools getfasta.")
+
+
+if __name__ == "__main__": main()
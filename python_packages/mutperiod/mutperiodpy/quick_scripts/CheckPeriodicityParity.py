@@ -0,0 +1,141 @@
+# This script checks that the Python periodicity engine produces the same periodicity results as the original
+# R script (RunNucleosomeMutationAnalysis.R), and reports how long each engine takes.
+# Synthetic raw and normalized counts files are generated for single nucleosome and nuc-group radii (including some files
+# which fall below the mutation cutoff), and the analysis is run with both peak and expected periodicities, and both strand alignments.
+# Before that, the scanned frequency grids are checked against fixed values from lomb::lsp (which does not require R).
+# NOTE: Requires Rscript and the mutperiodR package (unless only the frequency grids are checked).
+import os, time, tempfile, argparse
+import numpy as np
+from mutperiodpy.helper_scripts.RWorker import runRScript, getRInputsFilePath
+from mutperiodpy.helper_scripts.RDataTableCompatibility import readDataTable
+from mutperiodpy.NormalizeMutationCounts import RAW_COUNTS_HEADERS, NORMALIZED_COUNTS_SOURCE_HEADERS
+from mutperiodpy.RunNucleosomeMutationAnalysis import generatePeriodicityResults
+from mutperiodpy.helper_scripts.LombScargle import getScannedFrequencies
+
+
+# The number of frequencies, and the first and last frequencies, that lomb::lsp (with ofac = 100) scans for the given
+# dyad positions and period range.  (The single nucleosome grid does not reach a period of 25 due to floating-point rounding,
+# and the half-base nuc-group grid is offset from 1/250 because the grid starts at 1/span.)
+EXPECTED_FREQUENCY_GRIDS = (
+    ("single nucleosome", np.arange(-60, 61), 5, 25, 1920, 0.04008333333333333, 0.19999999999999998),
+    ("nuc-group", np.arange(-1000, 1001), 50, 250, 3201, 0.004, 0.02),
+    ("half-base nuc-group", np.arange(-999.5, 1000), 50, 250, 3199, 0.00400200100050025, 0.02),
+)
+
+
+# Checks the scanned frequency grids against the fixed values above.  Returns whether or not they all match.
+def checkScannedFrequencyGrids():
+
+    allMatch = True
+    for name, dyadPositions, fromPeriod, toPeriod, expectedLength, expectedFirst, expectedLast in EXPECTED_FREQUENCY_GRIDS:
+        frequencies = getScannedFrequencies(dyadPositions, fromPeriod, toPeriod)
+        matches = (len(frequencies), frequencies[0], frequencies[-1]) == (expectedLength, expectedFirst, expectedLast)
+        print(f"{name} frequency grid: {'matches' if matches else 'DIFFERENT'}   "
+              f"({len(frequencies)} frequencies from {frequencies[0]!r} to {frequencies[-1]!r})")
+        allMatch = allMatch and matches
+    return allMatch
+
+
+# Writes a raw counts file and a matching normalized counts file for a data set with the given name, with counts that
+# oscillate with the given period around the given mean.  Returns the paths to both files.
+def writeSyntheticCountsFiles(directory, dataSetName, dyadRadius, period, meanCounts, randomGenerator: np.random.Generator):
+
+    nucGroup = "nuc-group_" if dyadRadius > 73 else ''
+    rawCountsFilePath = os.path.join(directory, f"{dataSetName}_{nucGroup}raw_nucleosome_mutation_counts.tsv")
+    normalizedCountsFilePath = os.path.join(directory, f"{dataSetName}_singlenuc_{nucGroup}normalized_nucleosome_mutation_counts.tsv")
+
+    dyadPositions = np.arange(-dyadRadius, dyadRadius + 1)
+    expectedCounts = meanCounts*(1 + 0.2*np.cos(2*np.pi*dyadPositions/period))
+    plusCounts, minusCounts = randomGenerator.poisson(expectedCounts/2), randomGenerator.poisson(expectedCounts/2)
+    rawColumns = (dyadPositions, plusCounts, minusCounts, plusCounts + minusCounts,
+                  randomGenerator.permutation(plusCounts + minusCounts))
+
+    with open(rawCountsFilePath, 'w') as rawCountsFile:
+        rawCountsFile.write('\t'.join(RAW_COUNTS_HEADERS) + '\n')
+        for row in zip(*(column.tolist() for column in rawColumns)): rawCountsFile.write('\t'.join(str(value) for value in row) + '\n')
+
+    with open(normalizedCountsFilePath, 'w') as normalizedCountsFile:
+        normalizedCountsFile.write('\t'.join(("Dyad_Position",) + tuple(NORMALIZED_COUNTS_SOURCE_HEADERS)) + '\n')
+        for row in zip(dyadPositions.tolist(), *(randomGenerator.uniform(0.5, 1.5, len(dyadPositions)).tolist() for _ in range(4))):
+            normalizedCountsFile.write('\t'.join(str(value) for value in row) + '\n')
+
+    return rawCountsFilePath, normalizedCountsFilePath
+
+
+# Returns the synthetic counts file paths and their expected periods.
+def writeSyntheticCases(directory, dataSetNum, seed = 0):
+
+    randomGenerator = np.random.default_rng(seed)
+    countsFilePaths, expectedPeriods = list(), list()
+
+    for i in range(dataSetNum):
+        nucGroup = i%4 == 3
+        dyadRadius, period, expectedPeriod = (1000, 190, 190) if nucGroup else (73, 10.2, 10.2)
+        meanCounts = 5 if i%7 == 6 else randomGenerator.uniform(20, 200)
+        for countsFilePath in writeSyntheticCountsFiles(directory, f"data_set_{i}", dyadRadius, period, meanCounts, randomGenerator):
+            countsFilePaths.append(countsFilePath)
+            expectedPeriods.append(expectedPeriod)
+
+    return countsFilePaths, expectedPeriods
+
+
+# Runs both engines with the given settings and compares the results.  Returns whether or not the results are identical.
+def checkCase(countsFilePaths, expectedPeriods, overridePeakPeriodicityWithExpected, alignStrands, directory):
+
+    name = f"expected_{overridePeakPeriodicityWithExpected}_aligned_{alignStrands}"
+    pythonFilePath = os.path.join(directory, name + "_python_results.tsv")
+    rFilePath = os.path.join(directory, name + "_R_results.tsv")
+
+    startTime = time.perf_counter()
+    generatePeriodicityResults(countsFilePaths, pythonFilePath, expectedPeriods, overridePeakPeriodicityWithExpected, alignStrands)
+    pythonTime = time.perf_counter() - startTime
+
+    inputsFilePath = getRInputsFilePath()
+    with open(inputsFilePath, 'w') as inputsFile:
+        inputsFile.write('\n'.join(('$'.join(countsFilePaths), rFilePath, str(overridePeakPeriodicityWithExpected),
+                                    '$'.join(str(expectedPeriod) for expectedPeriod in expectedPeriods), str(alignStrands))) + '\n')
+    startTime = time.perf_counter()
+    try: runRScript("RunNucleosomeMutationAnalysis.R", inputsFilePath)
+    finally: os.remove(inputsFilePath)
+    rTime = time.perf_counter() - startTime
+
+    with open(pythonFilePath, 'r') as pythonFile, open(rFilePath, 'r') as rFile:
+        identical = pythonFile.read() == rFile.read()
+
+    # If the files differ, report how much their values differ by.
+    if identical: difference = "identical"
+    else:
+        pythonColumns, rColumns = readDataTable(pythonFilePath), readDataTable(rFilePath)
+        if list(pythonColumns) != list(rColumns) or len(pythonColumns["SNR"]) != len(rColumns["SNR"]):
+            difference = "DIFFERENT HEADERS OR DATA SETS"
+        else:
+            maxRelativeDifference = max(np.nanmax(np.abs(pythonColumns[header] - rColumns[header]) /
+                                                  np.maximum(np.abs(rColumns[header]), 1e-300), initial = 0)
+                                        for header in rColumns if header != "Data_Set")
+            difference = f"DIFFERENT (max relative difference: {maxRelativeDifference:.3g})"
+
+    print(f"{name}: {difference}   (Python: {pythonTime:.3f}s, R: {rTime:.3f}s)")
+    return identical
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Check the Python periodicity engine against the R script.")
+    parser.add_argument("-n", "--data-set-num", type = int, default = 40, help = "The number of synthetic data sets to generate.")
+    parser.add_argument("-g", "--grids-only", action = "store_true", help = "Only check the scanned frequency grids.  (Does not need R)")
+    args = parser.parse_args()
+
+    if not checkScannedFrequencyGrids(): raise AssertionError("Scanned frequency grids differ from lomb::lsp.")
+    if args.grids_only: return
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        countsFilePaths, expectedPeriods = writeSyntheticCases(tempDir, args.data_set_num)
+        mismatches = [f"expected_{expected}_aligned_{aligned}" for expected in (False, True) for aligned in (False, True)
+                      if not checkCase(countsFilePaths, expectedPeriods, expected, aligned, tempDir)]
+
+    if len(mismatches) == 0: print("All periodicity results are identical.")
+    else: raise AssertionError("Periodicity results differ for: " + ", ".join(mismatches))
+
+
+if __name__ == "__main__": main()
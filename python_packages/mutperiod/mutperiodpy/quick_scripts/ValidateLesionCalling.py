@@ -0,0 +1,114 @@
+# This script validates the batch lesion caller used by ParseXRSeq.writeLesions against the original per-read
+# lesion calling loop, checking that both produce byte-for-byte identical lesion bed files and reporting their run times.
+# If no trimmed reads file, genome fasta file, and call parameters file are given, random synthetic ones
+# (and one of the preset call parameter files) are used instead.
+import os, time, random, tempfile, filecmp, argparse
+from mutperiodpy.helper_scripts.PackedGenome import PackedGenome, getPackedGenome
+from mutperiodpy.input_parsing.ParseXRSeq import (writeLesions, searchForLesion, readCallParams, PresetCallParams)
+
+
+# The original per-read lesion calling loop from writeLesions, kept here as a reference implementation.
+def writeLesionsPerRead(readsBedFilePath, packedGenome: PackedGenome, lesionsBedFilePath, expectedLocationsByLength, acceptableBasesByLength):
+
+    with open(readsBedFilePath, 'r') as readsBedFile:
+        with open(lesionsBedFilePath, 'w') as lesionsBedFile:
+
+            for line in readsBedFile:
+
+                choppedUpLine = line.strip().split('\t')
+                readStartPos = int(choppedUpLine[1])
+                readCounts = int(choppedUpLine[4])
+                strand = choppedUpLine[5]
+
+                readSequence = packedGenome.fetch(choppedUpLine[0], readStartPos, int(choppedUpLine[2]), strand)
+                if readSequence is None: continue
+
+                for expectedLocation in expectedLocationsByLength[len(readSequence)]:
+
+                    lesionLocation = searchForLesion(readSequence, expectedLocation[0], expectedLocation[1], acceptableBasesByLength[len(readSequence)])
+
+                    if lesionLocation is not None:
+
+                        lesionStartLocation, lesionEndLocation = lesionLocation
+                        sequence = readSequence[lesionStartLocation:lesionEndLocation]
+
+                        if strand == '-':
+                            tempLesionStartLocation = lesionStartLocation
+                            lesionStartLocation = len(readSequence) - lesionEndLocation
+                            lesionEndLocation = len(readSequence) - tempLesionStartLocation
+
+                        bedEntry = '\t'.join((choppedUpLine[0],
+                                                str(readStartPos + lesionStartLocation),
+                                                str(readStartPos + lesionEndLocation),
+                                                sequence, "OTHER", strand)) + '\n'
+                        lesionsBedFile.write(bedEntry*readCounts)
+
+
+# Writes a random genome fasta file and a trimmed reads file (with read counts in the score column) with reads of the
+# given lengths to the given file paths.  A few reads run past the ends of their chromosomes.
+def writeSyntheticData(genomeFilePath, readsFilePath, readLengths, chromosomeLength, readNum, seed = 0):
+
+    randomGenerator = random.Random(seed)
+    chromosomes = ("chr1", "chr2")
+
+    with open(genomeFilePath, 'w') as genomeFile:
+        for chromosome in chromosomes:
+            genomeFile.write('>' + chromosome + '\n')
+            sequence = ''.join(randomGenerator.choice("ACGT") for _ in range(chromosomeLength))
+            for i in range(0, chromosomeLength, 60): genomeFile.write(sequence[i:i+60] + '\n')
+
+    with open(readsFilePath, 'w') as readsFile:
+        for _ in range(readNum):
+            readLength = randomGenerator.choice(readLengths)
+            readStartPos = randomGenerator.randrange(chromosomeLength - readLength//2)
+            readsFile.write('\t'.join((randomGenerator.choice(chromosomes), str(readStartPos), str(readStartPos + readLength),
+                                       'NA', str(randomGenerator.choice((1,1,1,2,5))), randomGenerator.choice("+-"))) + '\n')
+
+
+def validateLesionCalling(readsFilePath, genomeFilePath, callParamsFilePath):
+
+    expectedLocationsByLength, acceptableBasesByLength = readCallParams(callParamsFilePath)
+
+    packedGenome = getPackedGenome(genomeFilePath)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+
+        lesionFilePaths = dict()
+        for name, lesionCaller in (("per-read", writeLesionsPerRead), ("batch", writeLesions)):
+            lesionFilePaths[name] = os.path.join(tempDir, name + "_lesions.bed")
+            startTime = time.perf_counter()
+            lesionCaller(readsFilePath, packedGenome, lesionFilePaths[name],
+                         expectedLocationsByLength, acceptableBasesByLength)
+            print(f"{name} lesion calling: {time.perf_counter() - startTime:.3f}s")
+
+        if filecmp.cmp(lesionFilePaths["per-read"], lesionFilePaths["batch"], shallow = False):
+            print("Lesion bed files are identical.")
+        else: raise AssertionError("Lesion bed files differ between the per-read and batch lesion callers.")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Validate the batch lesion caller against the per-read lesion caller.")
+    parser.add_argument("-r", "--reads", help = "A trimmed reads bed file (with read counts in the score column).")
+    parser.add_argument("-g", "--genome", help = "The genome fasta file the reads were aligned to.")
+    parser.add_argument("-c", "--call-params", help = "The lesion call parameters file.")
+    parser.add_argument("-n", "--read-num", type = int, default = 1000000, help = "The number of synthetic reads to generate.")
+    args = parser.parse_args()
+
+    if args.reads is not None:
+        validateLesionCalling(args.reads, args.genome, args.call_params)
+        return
+
+    callParamsFilePath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "input_parsing",
+                                      args.call_params or PresetCallParams.BPDE.value)
+    readLengths = list(readCallParams(callParamsFilePath)[0])
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        genomeFilePath = os.path.join(tempDir, "synthetic.fa")
+        readsFilePath = os.path.join(tempDir, "synthetic_trimmed_reads.bed")
+        print("Generating", args.read_num, "synthetic reads...")
+        writeSyntheticData(genomeFilePath, readsFilePath, readLengths, 1000000, args.read_num)
+        validateLesionCalling(readsFilePath, genomeFilePath, callParamsFilePath)
+
+
+if __name__ == "__main__": main()
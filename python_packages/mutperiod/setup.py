@@ -18,6 +18,6 @@ setup(
     entry_points=dict(
         console_scripts=['mutperiod=mutperiodpy.Main:main']
     ),
-    install_requires=["benbiohelpers", "plotnine"]
+    install_requires=["benbiohelpers", "plotnine", "numpy"]
     
 )
\ No newline at end of file